@@ -0,0 +1,272 @@
+import asyncio
+import ipaddress
+import os
+import socket
+import time
+from collections import OrderedDict
+from html.parser import HTMLParser
+from typing import Optional
+from urllib.parse import urlparse
+
+import httpx
+
+from single_flight import SingleFlight
+
+
+class ArticleFetchError(Exception):
+    """The article couldn't be downloaded or had no readable text"""
+
+
+class ArticleFetcher:
+    """
+    Downloads articles and extracts their text for summarization.
+
+    Pages are streamed through one pooled HTTP client and abandoned once they
+    exceed `max_bytes`. Parsed articles are cached by URL: within `ttl`
+    seconds they are served without a request, after that they are
+    revalidated with If-None-Match / If-Modified-Since so unchanged pages
+    are not downloaded or parsed again. Concurrent fetches of one URL share
+    a single download.
+
+    Unless `allow_private_hosts` is set, every request, including each
+    redirect, is refused if its host resolves to a private, loopback,
+    link-local or other non-public address, so article URLs can't reach
+    internal services or cloud metadata endpoints.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = 2 * 1024 * 1024,
+        timeout: float = 10.0,
+        max_connections: int = 20,
+        cache_size: int = 1000,
+        ttl: float = 300.0,
+        allow_private_hosts: bool = False
+    ):
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.cache_size = cache_size
+        self.ttl = ttl
+        self.allow_private_hosts = allow_private_hosts
+
+        # url -> {"article": dict, "etag", "last_modified", "checked_at"}
+        self._cache: "OrderedDict[str, dict]" = OrderedDict()
+        self._client: Optional[httpx.AsyncClient] = None
+        self._flight = SingleFlight()
+
+        self.hits = 0
+        self.revalidated = 0
+        self.downloads = 0
+        self.errors = 0
+
+    @classmethod
+    def from_env(cls) -> "ArticleFetcher":
+        """
+        Build the fetcher from ARTICLE_* settings
+        """
+        return cls(
+            max_bytes=int(float(os.getenv("ARTICLE_MAX_MB", "2")) * 1024 * 1024),
+            timeout=float(os.getenv("ARTICLE_FETCH_TIMEOUT", "10")),
+            max_connections=int(os.getenv("ARTICLE_MAX_CONNECTIONS", "20")),
+            cache_size=int(os.getenv("ARTICLE_CACHE_SIZE", "1000")),
+            ttl=float(os.getenv("ARTICLE_CACHE_TTL", "300")),
+            allow_private_hosts=os.getenv("ARTICLE_ALLOW_PRIVATE_HOSTS", "false").lower() == "true"
+        )
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                follow_redirects=True,
+                limits=httpx.Limits(max_connections=self.max_connections),
+                headers={"User-Agent": "AgentMarketplace-NewsSummarizer/1.0"},
+                # Runs before the first request and before every redirect
+                event_hooks={"request": [self._check_request]}
+            )
+        return self._client
+
+    async def _check_request(self, request: httpx.Request):
+        """
+        Refuse requests to hosts that resolve to non-public addresses
+        """
+        if self.allow_private_hosts:
+            return
+        host = request.url.host
+        try:
+            infos = await asyncio.get_running_loop().getaddrinfo(
+                host, request.url.port or (443 if request.url.scheme == "https" else 80), type=socket.SOCK_STREAM
+            )
+        except socket.gaierror as e:
+            raise ArticleFetchError(f"Can't resolve {host}: {str(e)}")
+        for info in infos:
+            address = ipaddress.ip_address(info[4][0].split("%")[0])
+            if address.version == 6 and address.ipv4_mapped:
+                address = address.ipv4_mapped
+            if not address.is_global:
+                raise ArticleFetchError(f"Refusing to fetch {request.url}: {host} is not a public address")
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def fetch(self, url: str) -> dict:
+        """
+        Title and text of the article at `url`
+        """
+        if urlparse(url).scheme not in ("http", "https"):
+            self.errors += 1
+            raise ArticleFetchError(f"Unsupported article URL: {url}")
+
+        entry = self._cache.get(url)
+        if entry is not None and time.time() - entry["checked_at"] < self.ttl:
+            self._cache.move_to_end(url)
+            self.hits += 1
+            return entry["article"]
+
+        try:
+            return await self._flight.do(url, lambda: self._download(url))
+        except ArticleFetchError:
+            self.errors += 1
+            raise
+        except httpx.HTTPError as e:
+            self.errors += 1
+            raise ArticleFetchError(f"Failed to fetch {url}: {str(e)}")
+
+    async def _download(self, url: str) -> dict:
+        entry = self._cache.get(url)
+        headers = {}
+        if entry is not None:
+            if entry["etag"]:
+                headers["If-None-Match"] = entry["etag"]
+            if entry["last_modified"]:
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        async with self.client.stream("GET", url, headers=headers) as response:
+            if response.status_code == 304 and entry is not None:
+                entry["checked_at"] = time.time()
+                self._cache.move_to_end(url)
+                self.revalidated += 1
+                return entry["article"]
+            if response.status_code != 200:
+                raise ArticleFetchError(f"Failed to fetch {url}: status {response.status_code}")
+
+            content_type = response.headers.get("content-type", "")
+            if content_type and not content_type.startswith(("text/html", "application/xhtml", "text/plain")):
+                raise ArticleFetchError(f"Unsupported content type for {url}: {content_type}")
+            if int(response.headers.get("content-length") or 0) > self.max_bytes:
+                raise ArticleFetchError(f"Article at {url} is larger than {self.max_bytes} bytes")
+
+            body = bytearray()
+            async for chunk in response.aiter_bytes():
+                body.extend(chunk)
+                if len(body) > self.max_bytes:
+                    raise ArticleFetchError(f"Article at {url} is larger than {self.max_bytes} bytes")
+            encoding = response.charset_encoding or "utf-8"
+        self.downloads += 1
+
+        # Parsing large pages would hold up the event loop
+        if content_type.startswith("text/plain"):
+            article = {"title": "", "text": body.decode(encoding, errors="replace").strip()}
+        else:
+            article = await asyncio.to_thread(extract_article, body.decode(encoding, errors="replace"))
+        if not article["text"]:
+            raise ArticleFetchError(f"No article text found at {url}")
+
+        self._cache[url] = {
+            "article": article,
+            "etag": response.headers.get("etag"),
+            "last_modified": response.headers.get("last-modified"),
+            "checked_at": time.time()
+        }
+        self._cache.move_to_end(url)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return article
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._cache),
+            "hits": self.hits,
+            "revalidated": self.revalidated,
+            "downloads": self.downloads,
+            "errors": self.errors,
+            "coalesced": self._flight.coalesced
+        }
+
+
+class _ArticleParser(HTMLParser):
+    """Collects the title and block-level text, skipping page chrome"""
+
+    SKIP = {"script", "style", "noscript", "nav", "header", "footer", "aside", "form", "svg", "template"}
+    BLOCKS = {"p", "h1", "h2", "h3", "h4", "li", "blockquote", "pre"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.title = ""
+        self.og_title = ""
+        self.blocks = []  # (inside <article>, text)
+        self._skip_depth = 0
+        self._article_depth = 0
+        self._in_title = False
+        self._block = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP:
+            self._skip_depth += 1
+        elif tag == "article":
+            self._article_depth += 1
+        elif tag == "title":
+            self._in_title = True
+        elif tag == "meta":
+            attrs = dict(attrs)
+            if attrs.get("property") == "og:title":
+                self.og_title = attrs.get("content") or ""
+        elif tag in self.BLOCKS and not self._skip_depth:
+            self._end_block()
+            self._block = []
+        elif tag == "br" and self._block is not None:
+            self._block.append(" ")
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP:
+            self._skip_depth = max(0, self._skip_depth - 1)
+        elif tag == "article":
+            self._end_block()
+            self._article_depth = max(0, self._article_depth - 1)
+        elif tag == "title":
+            self._in_title = False
+        elif tag in self.BLOCKS:
+            self._end_block()
+
+    def handle_data(self, data):
+        if self._in_title:
+            self.title += data
+        elif self._block is not None and not self._skip_depth:
+            self._block.append(data)
+
+    def _end_block(self):
+        if self._block is not None:
+            text = " ".join("".join(self._block).split())
+            if text:
+                self.blocks.append((self._article_depth > 0, text))
+            self._block = None
+
+
+def extract_article(html: str) -> dict:
+    """
+    Title and paragraph text of an HTML page, preferring the <article> element
+    """
+    parser = _ArticleParser()
+    parser.feed(html)
+    parser.close()
+    parser._end_block()
+
+    in_article = [text for inside, text in parser.blocks if inside]
+    paragraphs = in_article or [text for _, text in parser.blocks]
+    return {
+        "title": " ".join((parser.og_title or parser.title).split()),
+        "text": "\n\n".join(paragraphs)
+    }
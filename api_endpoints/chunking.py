@@ -0,0 +1,84 @@
+import math
+import re
+from typing import List
+
+try:
+    import tiktoken
+    _encoding = tiktoken.encoding_for_model("gpt-3.5-turbo")
+except Exception:  # tiktoken is optional; fall back to an estimate
+    _encoding = None
+
+
+def count_tokens(text: str) -> int:
+    """
+    Tokens in text for gpt-3.5-turbo, estimated when tiktoken isn't installed
+    """
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    # About 4 characters per token for ASCII text, one per character otherwise
+    ascii_chars = sum(1 for c in text if ord(c) < 128)
+    return math.ceil(ascii_chars / 4) + (len(text) - ascii_chars)
+
+
+def split_into_chunks(text: str, max_tokens: int) -> List[str]:
+    """
+    Split text into chunks of at most max_tokens, breaking between paragraphs,
+    then sentences, then words
+    """
+    pieces = []
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = paragraph.strip()
+        if paragraph:
+            pieces.extend(_split_piece(paragraph, max_tokens))
+    return [chunk for chunk, _ in _merge(pieces, "\n\n", max_tokens)]
+
+
+def _split_piece(text: str, max_tokens: int, separators=(r"(?<=[.!?])\s+", r"\s+")) -> List[tuple]:
+    """(piece, tokens) pairs no larger than max_tokens, joined back up greedily"""
+    tokens = count_tokens(text)
+    if tokens <= max_tokens:
+        return [(text, tokens)]
+    if not separators:
+        return _cut(text, tokens, max_tokens)
+
+    pieces = []
+    for part in re.split(separators[0], text):
+        if part:
+            pieces.extend(_split_piece(part, max_tokens, separators[1:]))
+    return _merge(pieces, " ", max_tokens)
+
+
+def _cut(text: str, tokens: int, max_tokens: int) -> List[tuple]:
+    """A single enormous word cut by characters into (piece, tokens) pairs"""
+    pieces = []
+    start = 0
+    while start < len(text):
+        # Tokens per character vary, so shrink a cut until it fits
+        size = max(1, len(text) * max_tokens // tokens)
+        piece = text[start:start + size]
+        piece_tokens = count_tokens(piece)
+        while piece_tokens > max_tokens and size > 1:
+            size = max(1, min(size - 1, size * max_tokens // piece_tokens))
+            piece = text[start:start + size]
+            piece_tokens = count_tokens(piece)
+        pieces.append((piece, piece_tokens))
+        start += size
+    # Shrunken cuts can leave room; fill it without putting spaces into the word
+    return _merge(pieces, "", max_tokens)
+
+
+def _merge(pieces: List[tuple], joiner: str, max_tokens: int) -> List[tuple]:
+    """Join consecutive (piece, tokens) pairs greedily, counting the joiners too"""
+    joiner_tokens = count_tokens(joiner)
+    merged, current, current_tokens = [], [], 0
+    for piece, tokens in pieces:
+        if current and current_tokens + joiner_tokens + tokens > max_tokens:
+            merged.append((joiner.join(current), current_tokens))
+            current, current_tokens = [], 0
+        if current:
+            current_tokens += joiner_tokens
+        current.append(piece)
+        current_tokens += tokens
+    if current:
+        merged.append((joiner.join(current), current_tokens))
+    return merged
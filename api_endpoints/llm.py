@@ -0,0 +1,218 @@
+import asyncio
+import json
+import os
+import re
+import time
+from types import SimpleNamespace
+from typing import Callable, Optional
+from openai import AsyncOpenAI
+from response_cache import ResponseCache
+from single_flight import SingleFlight
+from metrics import counter, histogram
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LLM_SECONDS = histogram(
+    "llm_request_duration_seconds", "LLM calls, until the full reply has arrived",
+    ("service", "model", "stream")
+)
+LLM_TOKENS = counter(
+    "llm_tokens_total", "Tokens used by LLM calls, as reported by the API",
+    ("service", "model", "kind")
+)
+
+def record_usage(service: str, model: str, usage):
+    """
+    Count prompt and completion tokens from a response's usage, if it has one
+    """
+    if usage is None:
+        return
+    LLM_TOKENS.inc(usage.prompt_tokens or 0, service=service, model=model, kind="prompt")
+    LLM_TOKENS.inc(usage.completion_tokens or 0, service=service, model=model, kind="completion")
+
+# "openai" (default) or "fake" for the offline stand-in below
+LLM_BACKEND = os.getenv("LLM_BACKEND", "openai")
+
+def create_llm_client():
+    """
+    Create the async chat completions client used by the agent services
+    """
+    if LLM_BACKEND == "fake":
+        return FakeAsyncOpenAI(
+            latency=float(os.getenv("FAKE_LLM_LATENCY", "0.5")),
+            token_latency=float(os.getenv("FAKE_LLM_TOKEN_LATENCY", "0.01"))
+        )
+    return AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+async def chat_completion(client, semaphore: asyncio.Semaphore, service: str, cache=None, flight=None,
+                          validate: Optional[Callable[[str], bool]] = None, **params) -> str:
+    """
+    Run a chat completion and return the reply text.
+
+    When a ResponseCache is given, identical requests (same service, model,
+    messages and params) are answered from it instead of calling the LLM.
+    With `validate`, only replies it accepts are cached, and a cached reply
+    it rejects is dropped and requested again.
+    When a SingleFlight is given, identical requests already in flight share
+    that call instead of starting their own.
+    """
+    key = cache.key(service, params) if cache is not None else None
+    if key is not None:
+        cached = await cache.get(key)
+        if cached is not None:
+            if validate is None or validate(cached):
+                return cached
+            await cache.delete(key)
+
+    async def complete() -> str:
+        async with semaphore:
+            with LLM_SECONDS.time(service=service, model=params.get("model"), stream="false"):
+                response = await client.chat.completions.create(**params)
+        record_usage(service, params.get("model"), getattr(response, "usage", None))
+        content = response.choices[0].message.content
+        if key is not None and content is not None and (validate is None or validate(content)):
+            await cache.set(key, content)
+        return content
+
+    if flight is not None:
+        return await flight.do(key or ResponseCache.key(service, params), complete)
+    return await complete()
+
+async def stream_chat_completion(client, semaphore: asyncio.Semaphore, service: str, cache=None, **params):
+    """
+    Stream a chat completion, yielding pieces of the reply text as they arrive.
+
+    Shares cache entries with chat_completion: a cached reply is yielded in
+    one piece, and a streamed reply is cached once it completes.
+    """
+    key = cache.key(service, params) if cache is not None else None
+    if key is not None:
+        cached = await cache.get(key)
+        if cached is not None:
+            yield cached
+            return
+
+    parts = []
+    model = params.get("model")
+    async with semaphore:
+        with LLM_SECONDS.time(service=service, model=model, stream="true"):
+            # Usage arrives in a final chunk with no choices
+            stream = await client.chat.completions.create(
+                stream=True, stream_options={"include_usage": True}, **params
+            )
+            async for chunk in stream:
+                record_usage(service, model, getattr(chunk, "usage", None))
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    parts.append(delta)
+                    yield delta
+
+    if key is not None:
+        await cache.set(key, "".join(parts))
+
+def request_coalescing() -> Optional[SingleFlight]:
+    """
+    SingleFlight for a service, or None when REQUEST_COALESCING_ENABLED=false
+    """
+    if os.getenv("REQUEST_COALESCING_ENABLED", "true").lower() != "true":
+        return None
+    return SingleFlight()
+
+def concurrency_limit(service: str, default: int = 8) -> asyncio.Semaphore:
+    """
+    Semaphore capping in-flight LLM calls for a service, e.g. TRANSLATOR_CONCURRENCY
+    """
+    return asyncio.Semaphore(int(os.getenv(f"{service}_CONCURRENCY", str(default))))
+
+
+class FakeAsyncOpenAI:
+    """
+    Offline stand-in for AsyncOpenAI that answers after a fixed delay.
+
+    Only implements chat.completions.create. The reply echoes the start of the
+    last message, so responses are deterministic and load tests need no
+    network or API key. Prompts ending in a JSON array of strings (batch
+    translations) get a JSON array with each string echoed. With stream=True
+    the first chunk arrives after `latency` and each following word after
+    `token_latency`, followed by a usage chunk when stream_options asks for
+    one.
+    """
+
+    def __init__(self, latency: float = 0.5, token_latency: float = 0.01):
+        self.latency = latency
+        self.token_latency = token_latency
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    async def _create(self, model: str, messages: list, max_tokens: int = 256, stream: bool = False, **kwargs):
+        self.calls += 1
+
+        prompt = messages[-1]["content"]
+        words = re.findall(r"\S+", prompt)
+        reply = " ".join(["[fake]"] + words[: max(1, min(len(words), max_tokens // 4))])
+        segments = self._trailing_json_array(prompt)
+        if segments is not None:
+            reply = json.dumps([f"[fake] {segment}" for segment in segments], ensure_ascii=False)
+        prompt_tokens = sum(len(re.findall(r"\S+", m["content"])) for m in messages)
+        completion_tokens = len(reply.split())
+        usage = SimpleNamespace(
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            total_tokens=prompt_tokens + completion_tokens,
+        )
+        if stream:
+            include_usage = (kwargs.get("stream_options") or {}).get("include_usage", False)
+            return self._stream(model, reply, usage if include_usage else None)
+
+        await asyncio.sleep(self.latency)
+
+        return SimpleNamespace(
+            id=f"fake-{self.calls}",
+            created=int(time.time()),
+            model=model,
+            choices=[SimpleNamespace(
+                index=0,
+                finish_reason="stop",
+                message=SimpleNamespace(role="assistant", content=reply),
+            )],
+            usage=usage,
+        )
+
+    @staticmethod
+    def _trailing_json_array(prompt: str):
+        last_line = prompt.strip().rsplit("\n", 1)[-1].strip()
+        if not last_line.startswith("["):
+            return None
+        try:
+            values = json.loads(last_line)
+        except ValueError:
+            return None
+        if isinstance(values, list) and all(isinstance(value, str) for value in values):
+            return values
+        return None
+
+    async def _stream(self, model: str, reply: str, usage=None):
+        await asyncio.sleep(self.latency)
+        words = reply.split(" ")
+        for i, word in enumerate(words):
+            if i:
+                await asyncio.sleep(self.token_latency)
+            yield SimpleNamespace(
+                id=f"fake-{self.calls}",
+                model=model,
+                choices=[SimpleNamespace(
+                    index=0,
+                    finish_reason=None,
+                    delta=SimpleNamespace(role="assistant", content=word if i == 0 else " " + word),
+                )],
+            )
+        yield SimpleNamespace(
+            id=f"fake-{self.calls}",
+            model=model,
+            choices=[SimpleNamespace(index=0, finish_reason="stop", delta=SimpleNamespace(content=None))],
+        )
+        if usage is not None:
+            yield SimpleNamespace(id=f"fake-{self.calls}", model=model, choices=[], usage=usage)
@@ -1,24 +1,37 @@
 from fastapi import FastAPI, HTTPException, Header
 from fastapi.middleware.cors import CORSMiddleware
-from typing import Optional, List
+from fastapi.responses import StreamingResponse
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Optional, List
+import json
 import os
 from dotenv import load_dotenv
 
 # Import models
 from models import (
     Article, StoryGenRequest, SummarizeRequest, SummarizeResponse,
-    TranslationRequest, TranslationResponse, TransactionHistory
+    TranslationRequest, TranslationResponse, TransactionHistory,
+    BatchTranslationRequest, BatchTranslationResponse
 )
 
 # Import services
 from news_summarizer import NewsSummarizer
 from story_gen import StoryGen
 from translator import Translator
+from response_cache import ResponseCache
+from article_fetcher import ArticleFetcher, ArticleFetchError
+from metrics import instrument_app
 
 # Load environment variables
 load_dotenv()
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    await article_fetcher.close()
+
 app = FastAPI(
+    lifespan=lifespan,
     title="AI Services API",
     description="API for AI-powered services including news summarization, story generation, and translation",
     version="1.0.0"
@@ -33,33 +46,111 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize services
-news_summarizer = NewsSummarizer()
+# Request counts, per-route latency and LLM call metrics at /metrics
+instrument_app(app, "agents")
+
+# Initialize services (summaries and translations share one response cache)
+response_cache = ResponseCache.from_env()
+article_fetcher = ArticleFetcher.from_env()
+news_summarizer = NewsSummarizer(cache=response_cache, fetcher=article_fetcher)
 story_gen = StoryGen()
-translator = Translator()
+translator = Translator(cache=response_cache)
+
+def cache_allowed(cache_control: Optional[str]) -> bool:
+    """
+    Clients opt out of cached responses with Cache-Control: no-cache (or no-store)
+    """
+    directives = (cache_control or "").lower()
+    return "no-cache" not in directives and "no-store" not in directives
+
+def sse_event(data: dict) -> str:
+    return f"data: {json.dumps(data)}\n\n"
+
+async def stream_text(deltas: AsyncIterator[str], summary: Callable[[str], dict]) -> StreamingResponse:
+    """
+    Send generated text as server-sent events: {"delta": ...} per piece, then
+    {"done": true, ...summary(text)}. Errors raised before the first piece
+    become regular HTTP errors; later ones end the stream with {"error": ...}.
+    """
+    try:
+        first = await deltas.__anext__()
+    except StopAsyncIteration:
+        first = ""
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    async def events():
+        parts = [first]
+        if first:
+            yield sse_event({"delta": first})
+        try:
+            async for delta in deltas:
+                parts.append(delta)
+                yield sse_event({"delta": delta})
+        except Exception as e:
+            yield sse_event({"error": str(e)})
+            return
+        yield sse_event({"done": True, **summary("".join(parts)), "status": "success"})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        # Stop proxies from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 @app.get("/health")
 async def health_check():
     return {"status": "healthy"}
 
 @app.post("/summarize", response_model=SummarizeResponse)
-async def summarize_article(request: SummarizeRequest):
+async def summarize_article(
+    request: SummarizeRequest,
+    cache_control: Optional[str] = Header(None, alias="Cache-Control")
+):
     """
     Summarize a news article
     """
     try:
         result = await news_summarizer.summarize(
             article_url=request.article_url,
-            article_text=request.article_text
+            article_text=request.article_text,
+            use_cache=cache_allowed(cache_control)
         )
         return SummarizeResponse(
             **result,
             status="success",
             tx_verified=True  # TODO: Implement actual transaction verification
         )
+    except ArticleFetchError as e:
+        raise HTTPException(status_code=502, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/summarize/stream")
+async def summarize_article_stream(
+    request: SummarizeRequest,
+    cache_control: Optional[str] = Header(None, alias="Cache-Control")
+):
+    """
+    Summarize a news article, streaming the summary as server-sent events
+    """
+    try:
+        article_text = await news_summarizer.article_text(request.article_url, request.article_text)
+    except ArticleFetchError as e:
+        raise HTTPException(status_code=502, detail=str(e))
+
+    deltas = news_summarizer.stream_summary(
+        article_url=request.article_url,
+        article_text=article_text,
+        use_cache=cache_allowed(cache_control)
+    )
+    return await stream_text(deltas, lambda summary: {
+        "original_length": len(article_text),
+        "summary_length": len(summary),
+        "url": request.article_url
+    })
+
 @app.post("/story/generate")
 async def generate_story(request: StoryGenRequest):
     """
@@ -75,8 +166,19 @@ async def generate_story(request: StoryGenRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/story/generate/stream")
+async def generate_story_stream(request: StoryGenRequest):
+    """
+    Generate a story, streaming it as server-sent events
+    """
+    deltas = story_gen.stream_story(request.prompt)
+    return await stream_text(deltas, lambda story: {"prompt": request.prompt})
+
 @app.post("/translate", response_model=TranslationResponse)
-async def translate_text(request: TranslationRequest):
+async def translate_text(
+    request: TranslationRequest,
+    cache_control: Optional[str] = Header(None, alias="Cache-Control")
+):
     """
     Translate text to target language
     """
@@ -84,7 +186,8 @@ async def translate_text(request: TranslationRequest):
         result = await translator.translate(
             text=request.text,
             target_language=request.target_language,
-            source_language=request.source_language
+            source_language=request.source_language,
+            use_cache=cache_allowed(cache_control)
         )
         return TranslationResponse(
             **result,
@@ -94,6 +197,38 @@ async def translate_text(request: TranslationRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/translate/batch", response_model=BatchTranslationResponse)
+async def translate_batch(
+    request: BatchTranslationRequest,
+    cache_control: Optional[str] = Header(None, alias="Cache-Control")
+):
+    """
+    Translate several texts into one or more target languages.
+    Each (text, target) pair is priced and reported separately.
+    """
+    try:
+        items = await translator.translate_batch(
+            texts=request.texts,
+            target_languages=request.target_languages,
+            source_language=request.source_language,
+            use_cache=cache_allowed(cache_control)
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    translated = sum(1 for item in items if item["error"] is None)
+    return BatchTranslationResponse(
+        items=items,
+        source_language=request.source_language or "auto",
+        translated=translated,
+        failed=len(items) - translated,
+        price_per_item=translator.price,
+        total_price=translator.price * translated,
+        status="success" if translated == len(items) else "partial"
+    )
+
 @app.get("/languages")
 async def get_supported_languages():
     """
@@ -112,6 +247,26 @@ async def get_service_prices():
         "translator": translator.get_price()
     }
 
+@app.get("/cache/stats")
+async def get_cache_stats():
+    """
+    Response cache size and hit ratio, and the parsed-article cache
+    """
+    if response_cache is None:
+        return {"enabled": False, "articles": article_fetcher.stats()}
+    return {"enabled": True, **response_cache.stats(), "articles": article_fetcher.stats()}
+
+@app.get("/coalescing/stats")
+async def get_coalescing_stats():
+    """
+    Identical in-flight requests that shared one LLM call, per service
+    """
+    services = {"news_summarizer": news_summarizer, "translator": translator, "story_gen": story_gen}
+    return {
+        name: service.flight.stats() if service.flight is not None else {"enabled": False}
+        for name, service in services.items()
+    }
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
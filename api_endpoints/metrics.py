@@ -0,0 +1,226 @@
+"""
+Prometheus-style metrics for the agent API.
+
+A copy of backend/app/common/metrics.py, so this service runs and deploys
+without the backend source tree; keep the two in sync.
+
+A small in-process registry of counters and histograms, served in the
+Prometheus text format at ``/metrics``. ``instrument_app`` adds request
+counts and per-route latency histograms to a FastAPI app; storage, the
+gateway's outbound clients and the LLM helpers register their own metrics
+in the same registry.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+# Seconds; covers in-memory lookups up to slow LLM calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # Updated from request handlers and storage worker threads
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], object] = {}
+
+    def _key(self, labels: dict) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            lines.extend(self._render_value(key, value))
+        return lines
+
+    def _render_value(self, key, value) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """Monotonically increasing total"""
+
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def _render_value(self, key, value) -> List[str]:
+        return [f"{self.name}{_labels(self.labelnames, key)} {value}"]
+
+
+class Histogram(Metric):
+    """Distribution of observed values in fixed buckets, plus their count and sum"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                # [per-bucket counts, sum, count]
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            if index < len(self.buckets):
+                entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _render_value(self, key, value) -> List[str]:
+        counts, total, count = value
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            le = 'le="%s"' % bound
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+        le = 'le="+Inf"'
+        lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {count}")
+        lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {total}")
+        lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class Registry:
+    """Metrics by name; registering an existing name returns the same metric"""
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name: str, *args, **kwargs):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = cls(name, *args, **kwargs)
+            return self._metrics[name]
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self._register(Counter, name, documentation, labelnames)
+
+    def histogram(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram, name, documentation, labelnames, buckets)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+counter = REGISTRY.counter
+histogram = REGISTRY.histogram
+
+HTTP_REQUESTS = counter(
+    "http_requests_total", "HTTP requests handled", ("service", "method", "route", "status")
+)
+HTTP_REQUEST_SECONDS = histogram(
+    "http_request_duration_seconds", "Time to handle an HTTP request, including streaming the response",
+    ("service", "method", "route")
+)
+HTTP_CLIENT_SECONDS = histogram(
+    "http_client_request_duration_seconds", "Outbound HTTP calls, until the response headers arrive",
+    ("service", "host", "method", "status")
+)
+
+
+class MetricsMiddleware:
+    """ASGI middleware counting requests and timing them per route template"""
+
+    def __init__(self, app, service: str):
+        self.app = app
+        self.service = service
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # Label by route template (/wallet/{user_id}), not the raw path
+            route = getattr(scope.get("route"), "path", "unmatched")
+            HTTP_REQUESTS.inc(service=self.service, method=scope["method"], route=route, status=status)
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start,
+                                         service=self.service, method=scope["method"], route=route)
+
+
+def instrument_app(app, service: str):
+    """Add request metrics and a GET /metrics endpoint to a FastAPI app"""
+    from fastapi.responses import PlainTextResponse
+
+    app.add_middleware(MetricsMiddleware, service=service)
+
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics():
+        return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+def httpx_event_hooks(service: str) -> dict:
+    """event_hooks for an httpx.AsyncClient that time each call into HTTP_CLIENT_SECONDS"""
+
+    async def on_request(request):
+        request.extensions["metrics_start"] = time.perf_counter()
+
+    async def on_response(response):
+        start = response.request.extensions.get("metrics_start")
+        if start is not None:
+            HTTP_CLIENT_SECONDS.observe(
+                time.perf_counter() - start, service=service, host=response.request.url.netloc.decode(),
+                method=response.request.method, status=response.status_code
+            )
+
+    return {"request": [on_request], "response": [on_response]}
@@ -42,6 +42,28 @@ class TranslationResponse(BaseModel):
     status: str
     tx_verified: bool
 
+class BatchTranslationRequest(BaseModel):
+    tx_signature: str
+    texts: List[str]
+    target_languages: List[str]
+    source_language: Optional[str] = None
+    wallet_address: str
+
+class BatchTranslationItem(BaseModel):
+    text: str
+    target_language: str
+    translated_text: Optional[str] = None
+    error: Optional[str] = None
+
+class BatchTranslationResponse(BaseModel):
+    items: List[BatchTranslationItem]
+    source_language: str
+    translated: int
+    failed: int
+    price_per_item: int  # in lamports
+    total_price: int  # in lamports, for translated items only
+    status: str
+
 class TransactionHistory(BaseModel):
     id: int
     tx_signature: str
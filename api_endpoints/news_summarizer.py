@@ -1,32 +1,39 @@
-from typing import Optional
+import asyncio
 import os
-from openai import OpenAI
+from typing import List, Optional
+from article_fetcher import ArticleFetcher
+from chunking import count_tokens, split_into_chunks
+from llm import chat_completion, stream_chat_completion, create_llm_client, concurrency_limit, request_coalescing
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Articles longer than this are summarized chunk by chunk, then combined
+SUMMARY_CHUNK_TOKENS = int(os.getenv("SUMMARY_CHUNK_TOKENS", "2500"))
+# Chunk summaries generated at once for one article
+SUMMARY_CHUNK_PARALLELISM = int(os.getenv("SUMMARY_CHUNK_PARALLELISM", "4"))
+
 class NewsSummarizer:
-    def __init__(self):
-        self.client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    def __init__(self, cache=None, fetcher: Optional[ArticleFetcher] = None):
+        self.client = create_llm_client()
+        self.cache = cache
+        self.fetcher = fetcher or ArticleFetcher.from_env()
+        self.semaphore = concurrency_limit("NEWS_SUMMARIZER")
+        self.flight = request_coalescing()
+        self.chunk_tokens = SUMMARY_CHUNK_TOKENS
+        self.chunk_parallelism = SUMMARY_CHUNK_PARALLELISM
         self.price = 2000  # in lamports
 
-    async def summarize(self, article_url: str, article_text: Optional[str] = None) -> dict:
+    def _completion_params(self, article_text: str, instruction: str = "Please summarize this article: ") -> dict:
         """
-        Summarize a news article either from URL or provided text
+        Model, prompt and sampling settings for a summary
         """
-        try:
-            # If no text provided, try to extract from URL
-            if not article_text:
-                # TODO: Implement web scraping for article text
-                raise ValueError("Article text extraction not implemented yet")
-
-            # Create the summary using OpenAI
-            response = self.client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": """You are a professional news summarizer. 
+        return dict(
+            model="gpt-3.5-turbo",
+            messages=[
+                {
+                    "role": "system",
+                    "content": """You are a professional news summarizer. 
                         Create a concise summary of the article that includes:
                         1. Main topic and key points
                         2. Important facts and figures
@@ -34,17 +41,109 @@ class NewsSummarizer:
                         4. Context and implications
                         
                         Keep the summary under 200 words."""
-                    },
-                    {
-                        "role": "user",
-                        "content": f"Please summarize this article: {article_text}"
-                    }
-                ],
-                temperature=0.7,
-                max_tokens=500
-            )
+                },
+                {
+                    "role": "user",
+                    "content": f"{instruction}{article_text}"
+                }
+            ],
+            temperature=0.7,
+            max_tokens=500
+        )
+
+    def _chunk_params(self, chunk: str, index: int, total: int) -> dict:
+        """
+        Model, prompt and sampling settings for summarizing one chunk of a long article
+        """
+        return dict(
+            model="gpt-3.5-turbo",
+            messages=[
+                {
+                    "role": "system",
+                    "content": "You are a professional news summarizer. Summarize this section of a longer article, "
+                               "keeping its key points, facts, figures and quotes. Keep it under 150 words."
+                },
+                {
+                    "role": "user",
+                    "content": f"Section {index} of {total}:\n\n{chunk}"
+                }
+            ],
+            temperature=0.3,
+            max_tokens=300
+        )
+
+    async def _summary_params(self, article_text: str, use_cache: bool) -> dict:
+        """
+        Completion params for the final summary of an article.
+
+        Articles over chunk_tokens are split into chunks that are summarized
+        concurrently (map); the final summary is written from those chunk
+        summaries (reduce), which are themselves condensed first if they are
+        still too long.
+        """
+        if count_tokens(article_text) <= self.chunk_tokens:
+            return self._completion_params(article_text)
+
+        chunks = split_into_chunks(article_text, self.chunk_tokens)
+        while True:
+            summaries = await self._summarize_chunks(chunks, use_cache)
+            if len(summaries) == 1:
+                break
+            next_chunks = split_into_chunks("\n\n".join(summaries), self.chunk_tokens)
+            # Stop once the summaries fit in one prompt (or stop shrinking)
+            if len(next_chunks) == 1 or len(next_chunks) >= len(chunks):
+                break
+            chunks = next_chunks
+
+        sections = "\n\n".join(f"Section {i}: {summary}" for i, summary in enumerate(summaries, 1))
+        return self._completion_params(
+            sections,
+            instruction="Please summarize this article from these summaries of its consecutive sections:\n\n"
+        )
+
+    async def _summarize_chunks(self, chunks: List[str], use_cache: bool) -> List[str]:
+        limit = asyncio.Semaphore(self.chunk_parallelism)
 
-            summary = response.choices[0].message.content
+        async def summarize_chunk(index: int, chunk: str) -> str:
+            async with limit:
+                return await chat_completion(
+                    self.client,
+                    self.semaphore,
+                    "news_summarizer",
+                    cache=self.cache if use_cache else None,
+                    flight=self.flight,
+                    **self._chunk_params(chunk, index, len(chunks))
+                )
+
+        return await asyncio.gather(*(summarize_chunk(i, chunk) for i, chunk in enumerate(chunks, 1)))
+
+    async def article_text(self, article_url: str, article_text: Optional[str] = None) -> str:
+        """
+        The provided article text, or the text extracted from article_url
+        """
+        if article_text:
+            return article_text
+        article = await self.fetcher.fetch(article_url)
+        return article["text"]
+
+    async def summarize(self, article_url: str, article_text: Optional[str] = None, use_cache: bool = True) -> dict:
+        """
+        Summarize a news article either from URL or provided text.
+        Set use_cache=False to bypass the response cache.
+        """
+        try:
+            # If no text provided, extract it from the URL
+            article_text = await self.article_text(article_url, article_text)
+
+            # Create the summary using OpenAI
+            summary = await chat_completion(
+                self.client,
+                self.semaphore,
+                "news_summarizer",
+                cache=self.cache if use_cache else None,
+                flight=self.flight,
+                **await self._summary_params(article_text, use_cache)
+            )
 
             return {
                 "summary": summary,
@@ -57,3 +156,17 @@ class NewsSummarizer:
             print(f"Error summarizing article: {str(e)}")
             raise
 
+    async def stream_summary(self, article_url: str, article_text: Optional[str] = None, use_cache: bool = True):
+        """
+        Summarize an article, yielding the summary text as it is generated
+        """
+        article_text = await self.article_text(article_url, article_text)
+
+        async for delta in stream_chat_completion(
+            self.client,
+            self.semaphore,
+            "news_summarizer",
+            cache=self.cache if use_cache else None,
+            **await self._summary_params(article_text, use_cache)
+        ):
+            yield delta
@@ -0,0 +1,202 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+
+class ResponseCache:
+    """
+    Content-addressed cache of LLM completions with memory and disk tiers.
+
+    Keys are a hash of the service name, model, messages and sampling params,
+    so identical requests share an entry. Both tiers evict least recently
+    used entries once over their size budget, and entries expire after `ttl`
+    seconds. Disk entries survive restarts.
+    """
+
+    def __init__(
+        self,
+        max_memory_bytes: int = 64 * 1024 * 1024,
+        disk_dir: Optional[str] = None,
+        max_disk_bytes: int = 512 * 1024 * 1024,
+        ttl: float = 24 * 3600
+    ):
+        self.max_memory_bytes = max_memory_bytes
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.ttl = ttl
+
+        # key -> (expires_at, size, value)
+        self._memory: "OrderedDict[str, Tuple[float, int, str]]" = OrderedDict()
+        self._memory_bytes = 0
+        # key -> size, least recently used first
+        self._disk: "OrderedDict[str, int]" = OrderedDict()
+        self._disk_bytes = 0
+        # Disk writes run in worker threads
+        self._disk_lock = threading.Lock()
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if self.disk_dir:
+            self._load_disk_index()
+
+    @classmethod
+    def from_env(cls) -> Optional["ResponseCache"]:
+        """
+        Build the cache from RESPONSE_CACHE_* settings, or None if disabled
+        """
+        if os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() != "true":
+            return None
+        return cls(
+            max_memory_bytes=int(float(os.getenv("RESPONSE_CACHE_MEMORY_MB", "64")) * 1024 * 1024),
+            disk_dir=os.getenv("RESPONSE_CACHE_DIR", ".cache/responses") or None,
+            max_disk_bytes=int(float(os.getenv("RESPONSE_CACHE_DISK_MB", "512")) * 1024 * 1024),
+            ttl=float(os.getenv("RESPONSE_CACHE_TTL", str(24 * 3600)))
+        )
+
+    @staticmethod
+    def key(service: str, params: dict) -> str:
+        """
+        Hash of the service and the full completion request
+        """
+        payload = json.dumps({"service": service, **params}, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    async def get(self, key: str) -> Optional[str]:
+        entry = self._memory.get(key)
+        if entry is not None:
+            expires_at, _, value = entry
+            if expires_at > time.time():
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return value
+            self._drop_memory(key)
+
+        if self.disk_dir and key in self._disk:
+            record = await asyncio.to_thread(self._read_disk, key)
+            if record is not None and record["expires_at"] > time.time():
+                with self._disk_lock:
+                    if key in self._disk:
+                        self._disk.move_to_end(key)
+                self._put_memory(key, record["value"], record["expires_at"])
+                self.disk_hits += 1
+                return record["value"]
+            await asyncio.to_thread(self._drop_disk, key)
+
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, value: str):
+        expires_at = time.time() + self.ttl
+        self._put_memory(key, value, expires_at)
+        if self.disk_dir:
+            await asyncio.to_thread(self._write_disk, key, value, expires_at)
+
+    async def delete(self, key: str):
+        self._drop_memory(key)
+        if self.disk_dir and key in self._disk:
+            await asyncio.to_thread(self._drop_disk, key)
+
+    def stats(self) -> dict:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_entries": len(self._memory),
+            "memory_bytes": self._memory_bytes,
+            "disk_entries": len(self._disk),
+            "disk_bytes": self._disk_bytes,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_ratio": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+            "evictions": self.evictions
+        }
+
+    # Memory tier
+
+    def _put_memory(self, key: str, value: str, expires_at: float):
+        size = len(value.encode())
+        if size > self.max_memory_bytes:
+            return
+        self._drop_memory(key)
+        self._memory[key] = (expires_at, size, value)
+        self._memory_bytes += size
+        while self._memory_bytes > self.max_memory_bytes:
+            oldest = next(iter(self._memory))
+            self._drop_memory(oldest)
+            self.evictions += 1
+
+    def _drop_memory(self, key: str):
+        entry = self._memory.pop(key, None)
+        if entry is not None:
+            self._memory_bytes -= entry[1]
+
+    # Disk tier
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], f"{key}.json")
+
+    def _load_disk_index(self):
+        entries = []
+        for root, _, files in os.walk(self.disk_dir):
+            for name in files:
+                if name.endswith(".json"):
+                    path = os.path.join(root, name)
+                    stat = os.stat(path)
+                    entries.append((stat.st_mtime, name[:-len(".json")], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_bytes += size
+
+    def _read_disk(self, key: str) -> Optional[dict]:
+        try:
+            with open(self._path(key)) as f:
+                record = json.load(f)
+            os.utime(self._path(key))  # Keeps LRU order across restarts
+            return record
+        except (OSError, ValueError):
+            return None
+
+    def _write_disk(self, key: str, value: str, expires_at: float):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"expires_at": expires_at, "value": value}, f)
+        os.replace(tmp_path, path)
+
+        size = os.path.getsize(path)
+        with self._disk_lock:
+            self._drop_disk_index(key)
+            self._disk[key] = size
+            self._disk_bytes += size
+            evict = []
+            while self._disk_bytes > self.max_disk_bytes and len(self._disk) > 1:
+                oldest = next(iter(self._disk))
+                self._drop_disk_index(oldest)
+                evict.append(oldest)
+        for oldest in evict:
+            self._remove_file(oldest)
+            self.evictions += 1
+
+    def _drop_disk_index(self, key: str):
+        size = self._disk.pop(key, None)
+        if size is not None:
+            self._disk_bytes -= size
+
+    def _drop_disk(self, key: str):
+        with self._disk_lock:
+            self._drop_disk_index(key)
+        self._remove_file(key)
+
+    def _remove_file(self, key: str):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
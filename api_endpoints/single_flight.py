@@ -0,0 +1,45 @@
+import asyncio
+from typing import Awaitable, Callable, Dict
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical calls into one.
+
+    The first caller for a key starts the call; callers arriving with the same
+    key while it is in flight wait for and share its result (or exception).
+    The call runs as its own task, so a caller that disconnects doesn't
+    cancel it for the others.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Task] = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable]):
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+            self.calls += 1
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _finish(self, key: str, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Mark the exception retrieved in case every caller went away
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> dict:
+        requests = self.calls + self.coalesced
+        return {
+            "in_flight": len(self._calls),
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "coalesced_ratio": self.coalesced / requests if requests else 0.0
+        }
@@ -1,6 +1,6 @@
-from typing import Optional, Dict
 import os
-from openai import OpenAI
+from typing import Optional, Dict
+from llm import chat_completion, stream_chat_completion, create_llm_client, concurrency_limit, request_coalescing
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -8,32 +8,46 @@ load_dotenv()
 
 class StoryGen:
     def __init__(self):
-        self.client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        self.client = create_llm_client()
+        self.semaphore = concurrency_limit("STORY_GEN")
+        self.temperature = float(os.getenv("STORY_GEN_TEMPERATURE", "0.7"))
+        # Stories are only shared between identical requests when sampling is deterministic
+        self.flight = request_coalescing() if self.temperature == 0 else None
         self.price = 2000  # in lamports
 
+    def _completion_params(self, prompt: str) -> dict:
+        """
+        Model, prompt and sampling settings for a story
+        """
+        return dict(
+            model="gpt-3.5-turbo",
+            messages=[
+                {
+                    "role": "system",
+                    "content": "You are a creative story writer. Generate engaging and imaginative stories based on the given prompt."
+                },
+                {
+                    "role": "user",
+                    "content": prompt
+                }
+            ],
+            temperature=self.temperature,
+            max_tokens=1000
+        )
+
     async def generate_story(self, prompt: str) -> dict:
         """
         Generate a story based on the given prompt
         """
         try:
-            response = self.client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are a creative story writer. Generate engaging and imaginative stories based on the given prompt."
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-                temperature=0.7,
-                max_tokens=1000
+            story = await chat_completion(
+                self.client,
+                self.semaphore,
+                "story_gen",
+                flight=self.flight,
+                **self._completion_params(prompt)
             )
 
-            story = response.choices[0].message.content
-
             return {
                 "prompt": prompt,
                 "story": story
@@ -43,4 +57,14 @@ class StoryGen:
             print(f"Error generating story: {str(e)}")
             raise
 
-
+    async def stream_story(self, prompt: str):
+        """
+        Generate a story, yielding the text as it is written
+        """
+        async for delta in stream_chat_completion(
+            self.client,
+            self.semaphore,
+            "story_gen",
+            **self._completion_params(prompt)
+        ):
+            yield delta
@@ -0,0 +1,8 @@
+"""
+The agent service imports its modules by plain name, as it does when run from
+its own directory; tests get the same import path.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
@@ -0,0 +1,43 @@
+"""Tests for splitting long articles into chunks that fit a token budget"""
+import random
+
+import pytest
+
+from chunking import count_tokens, split_into_chunks
+
+
+def article(seed: int) -> str:
+    rng = random.Random(seed)
+    words = ["the", "market", "rallied", "after", "reports", "that", "regulators", "would", "approve",
+             "funds", "économie", "données", "市場", "経済ニュース", "x" * 300]
+    paragraphs = []
+    for _ in range(rng.randint(5, 40)):
+        sentences = []
+        for _ in range(rng.randint(1, 12)):
+            sentence = " ".join(rng.choice(words) for _ in range(rng.randint(3, 60)))
+            sentences.append(sentence + rng.choice([".", "!", "?"]))
+        paragraphs.append(" ".join(sentences))
+    return "\n\n".join(paragraphs)
+
+
+@pytest.mark.parametrize("max_tokens", [20, 100, 500])
+@pytest.mark.parametrize("seed", range(10))
+def test_chunks_fit_the_budget(seed, max_tokens):
+    text = article(seed)
+    chunks = split_into_chunks(text, max_tokens)
+    assert all(count_tokens(chunk) <= max_tokens for chunk in chunks), \
+        max(count_tokens(chunk) for chunk in chunks)
+    # Nothing but whitespace is lost
+    assert "".join("".join(chunks).split()) == "".join(text.split())
+
+
+def test_short_paragraphs_share_a_chunk():
+    chunks = split_into_chunks("One.\n\nTwo.\n\nThree.", 500)
+    assert chunks == ["One.\n\nTwo.\n\nThree."]
+
+
+def test_enormous_word_is_cut():
+    word = "市" * 50 + "a" * 400
+    chunks = split_into_chunks(word, 30)
+    assert "".join(chunks) == word
+    assert all(count_tokens(chunk) <= 30 for chunk in chunks)
@@ -1,13 +1,24 @@
-from typing import Optional, Dict
+import asyncio
+import json
 import os
-from openai import OpenAI
+from typing import Optional, Dict, List, Tuple
+from llm import chat_completion, create_llm_client, concurrency_limit, request_coalescing
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Limits for packing batch segments into one model request
+BATCH_MAX_SEGMENTS = int(os.getenv("TRANSLATOR_BATCH_MAX_SEGMENTS", "20"))
+BATCH_MAX_CHARS = int(os.getenv("TRANSLATOR_BATCH_MAX_CHARS", "4000"))
+# Most (text, target language) pairs accepted in one batch
+BATCH_MAX_ITEMS = int(os.getenv("TRANSLATOR_BATCH_MAX_ITEMS", "200"))
+
 class Translator:
-    def __init__(self):
-        self.client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    def __init__(self, cache=None):
+        self.client = create_llm_client()
+        self.cache = cache
+        self.semaphore = concurrency_limit("TRANSLATOR")
+        self.flight = request_coalescing()
         self.price = 1500  # in lamports
         self.supported_languages = {
             "en": "English",
@@ -29,10 +40,12 @@ class Translator:
         self,
         text: str,
         target_language: str,
-        source_language: Optional[str] = None
+        source_language: Optional[str] = None,
+        use_cache: bool = True
     ) -> dict:
         """
-        Translate text to target language
+        Translate text to target language.
+        Set use_cache=False to bypass the response cache.
         """
         try:
             # Validate language codes
@@ -51,7 +64,12 @@ class Translator:
             Text to translate: {text}"""
 
             # Get translation from OpenAI
-            response = self.client.chat.completions.create(
+            translation = await chat_completion(
+                self.client,
+                self.semaphore,
+                "translator",
+                cache=self.cache if use_cache else None,
+                flight=self.flight,
                 model="gpt-3.5-turbo",
                 messages=[
                     {
@@ -67,8 +85,6 @@ class Translator:
                 max_tokens=1000
             )
 
-            translation = response.choices[0].message.content
-
             return {
                 "original_text": text,
                 "translated_text": translation,
@@ -82,8 +98,150 @@ class Translator:
             print(f"Error translating text: {str(e)}")
             raise
 
+    async def translate_batch(
+        self,
+        texts: List[str],
+        target_languages: List[str],
+        source_language: Optional[str] = None,
+        use_cache: bool = True
+    ) -> List[dict]:
+        """
+        Translate every text into every target language.
+
+        Texts for a target are packed into as few model requests as the batch
+        limits allow, and all targets run concurrently. Returns one item per
+        (text, target) pair, in text order, with either translated_text or error.
+        """
+        if len(texts) * len(target_languages) > BATCH_MAX_ITEMS:
+            raise ValueError(f"Batch exceeds {BATCH_MAX_ITEMS} translations")
+        if source_language and source_language not in self.supported_languages:
+            raise ValueError(f"Unsupported source language: {source_language}")
+
+        # Duplicate texts are translated once
+        unique_texts = list(dict.fromkeys(texts))
+        targets = list(dict.fromkeys(target_languages))
+        groups = self._pack_segments(unique_texts)
+
+        # (text, target) -> (translation, error)
+        results: Dict[Tuple[str, str], Tuple[Optional[str], Optional[str]]] = {}
+
+        async def translate_group(group: List[str], target: str):
+            translations = await self._translate_segments(group, target, source_language, use_cache)
+            for text in group:
+                results[(text, target)] = translations[text]
+
+        jobs = []
+        for target in targets:
+            if target not in self.supported_languages:
+                for text in unique_texts:
+                    results[(text, target)] = (None, f"Unsupported target language: {target}")
+                continue
+            jobs.extend(translate_group(group, target) for group in groups)
+        await asyncio.gather(*jobs)
+
+        items = []
+        for text in texts:
+            for target in target_languages:
+                translation, error = results[(text, target)]
+                items.append({
+                    "text": text,
+                    "target_language": target,
+                    "translated_text": translation,
+                    "error": error
+                })
+        return items
+
+    def _pack_segments(self, texts: List[str]) -> List[List[str]]:
+        """Split texts into groups within BATCH_MAX_SEGMENTS and BATCH_MAX_CHARS"""
+        groups, group, chars = [], [], 0
+        for text in texts:
+            if group and (len(group) >= BATCH_MAX_SEGMENTS or chars + len(text) > BATCH_MAX_CHARS):
+                groups.append(group)
+                group, chars = [], 0
+            group.append(text)
+            chars += len(text)
+        if group:
+            groups.append(group)
+        return groups
 
+    async def _translate_segments(
+        self,
+        segments: List[str],
+        target_language: str,
+        source_language: Optional[str],
+        use_cache: bool
+    ) -> Dict[str, Tuple[Optional[str], Optional[str]]]:
+        """
+        Translate several segments in one model request, falling back to one
+        request per segment if the reply can't be matched up with the input
+        """
+        if len(segments) > 1:
+            source_lang_name = self.supported_languages.get(source_language, "auto-detected")
+            target_lang_name = self.supported_languages[target_language]
+            prompt = f"""Translate each string in the JSON array below from {source_lang_name} to {target_lang_name}.
+            Preserve the context, tone, and any cultural references.
+            Reply with only a JSON array of the translations, in the same order.
+            {json.dumps(segments, ensure_ascii=False)}"""
+
+            try:
+                reply = await chat_completion(
+                    self.client,
+                    self.semaphore,
+                    "translator",
+                    cache=self.cache if use_cache else None,
+                    flight=self.flight,
+                    # A reply that can't be matched up with the segments isn't worth replaying
+                    validate=lambda reply: matches_segments(reply, segments),
+                    model="gpt-3.5-turbo",
+                    messages=[
+                        {
+                            "role": "system",
+                            "content": "You are a professional translator. Provide accurate translations while preserving context and cultural nuances."
+                        },
+                        {
+                            "role": "user",
+                            "content": prompt
+                        }
+                    ],
+                    temperature=0.3,
+                    max_tokens=min(4000, 1000 + sum(len(segment) for segment in segments))
+                )
+                translations = parse_json_array(reply)
+                if translations is not None and len(translations) == len(segments):
+                    return {segment: (translation, None) for segment, translation in zip(segments, translations)}
+                print(f"Batch translation reply didn't match {len(segments)} segments, translating individually")
+            except Exception as e:
+                print(f"Error translating batch: {str(e)}")
+
+        async def translate_one(segment: str):
+            try:
+                result = await self.translate(segment, target_language, source_language, use_cache=use_cache)
+                return segment, (result["translated_text"], None)
+            except Exception as e:
+                return segment, (None, str(e))
+
+        return dict(await asyncio.gather(*(translate_one(segment) for segment in segments)))
 
     def get_supported_languages(self) -> Dict[str, str]:
         """Get list of supported languages"""
-        return self.supported_languages 
\ No newline at end of file
+        return self.supported_languages
+
+def matches_segments(reply: Optional[str], segments: List[str]) -> bool:
+    """Whether a batch reply holds one translation per segment"""
+    translations = parse_json_array(reply)
+    return translations is not None and len(translations) == len(segments)
+
+def parse_json_array(reply: Optional[str]) -> Optional[List[str]]:
+    """The list of strings in a model reply, tolerating surrounding text or code fences"""
+    if not reply:
+        return None
+    start, end = reply.find("["), reply.rfind("]")
+    if start == -1 or end < start:
+        return None
+    try:
+        values = json.loads(reply[start:end + 1])
+    except ValueError:
+        return None
+    if not isinstance(values, list) or not all(isinstance(value, str) for value in values):
+        return None
+    return values
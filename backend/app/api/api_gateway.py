@@ -1,12 +1,51 @@
 from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from pydantic import BaseModel
+import asyncio
 import httpx
+import logging
+import math
 import os
 from fastapi.middleware.cors import CORSMiddleware
-from tinydb import TinyDB, Query
+from contextlib import asynccontextmanager
+import sys
 import uuid
 from datetime import datetime
+from typing import Optional, Tuple
 
-app = FastAPI()
+# Shared backend modules live in backend/app/common
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.interprocess import ChangeMarker, FileLock
+from common.metrics import histogram, httpx_event_hooks, instrument_app
+from common.storage import open_storage
+from call_log import ApiCallLogger
+from key_cache import KeyCache
+from key_usage import KeyUsageReporter
+from credits import CreditManager, EscrowError
+from upstream import TargetNotAllowed, UpstreamPool, url_host_port
+from stage_timing import StageStats, StageTimings
+from rate_limit import RateLimiter, open_backend, parse_overrides
+
+logger = logging.getLogger(__name__)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One pooled HTTP client for the lifetime of the app so connections to
+    # the auth and escrow services are kept alive and reused
+    app.state.http_client = create_http_client()
+    await call_logger.start()
+    await credit_manager.start(app.state.http_client)
+    await key_usage.start(app.state.http_client)
+    yield
+    await key_usage.stop()
+    await credit_manager.stop()
+    await call_logger.stop()
+    await upstream_pool.aclose()
+    await rate_limiter.backend.close()
+    await app.state.http_client.aclose()
+
+app = FastAPI(lifespan=lifespan)
 
 # Enable CORS
 app.add_middleware(
@@ -17,22 +56,215 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Request counts and per-route latency at /metrics
+instrument_app(app, "api-gateway")
+
 AUTH_SERVICE_URL = os.getenv("AUTH_SERVICE_URL", "http://auth-service/verify")
 ESCROW_SERVICE_URL = os.getenv("ESCROW_SERVICE_URL", "http://escrow-service")
 COST_PER_REQUEST = 0.01  # Fixed cost per request as per requirements
 
-# Set up TinyDB for API call logging
+# Outbound HTTP client settings
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30.0"))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "10.0"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5.0"))
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "false").lower() == "true"
+
+def create_http_client() -> httpx.AsyncClient:
+    """Create the shared outbound client with the configured pool limits"""
+    return httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+        http2=HTTP2_ENABLED,
+        event_hooks=httpx_event_hooks("api-gateway"),
+    )
+
+# Cache of /verify responses per API key (invalid keys are cached for less time)
+key_cache = KeyCache(
+    max_size=int(os.getenv("KEY_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("KEY_CACHE_TTL", "60")),
+    negative_ttl=float(os.getenv("KEY_CACHE_NEGATIVE_TTL", "5")),
+)
+
+# Uses of keys verified from the cache, reported to the auth service (which
+# counts the rest in /verify) every KEY_USAGE_FLUSH_INTERVAL seconds
+key_usage = KeyUsageReporter(
+    os.getenv("KEY_USAGE_URL", AUTH_SERVICE_URL.rsplit("/", 1)[0] + "/apikeys/use/batch"),
+    flush_interval=float(os.getenv("KEY_USAGE_FLUSH_INTERVAL", "5")),
+    max_keys=int(os.getenv("KEY_USAGE_MAX_KEYS", "10000")),
+)
+
+# Billing: charge each request against a block of credit reserved from escrow
+# (CREDIT_RESERVATION_SIZE requests' worth, 0 charges escrow on every request)
+credit_manager = CreditManager(
+    ESCROW_SERVICE_URL,
+    COST_PER_REQUEST,
+    reservation_size=int(os.getenv("CREDIT_RESERVATION_SIZE", "100")),
+    reservation_ttl=float(os.getenv("CREDIT_RESERVATION_TTL", "60")),
+)
+
+# Proxied requests get a connection pool per target host (at most
+# UPSTREAM_MAX_CLIENTS of them), separate from the client used for auth and
+# escrow. PROXY_ALLOWED_HOSTS limits the targets (comma separated, "host",
+# "host:port" or "*.domain"). When it's empty, only hosts with public
+# addresses are allowed unless PROXY_ALLOW_PRIVATE_HOSTS is set. The auth
+# and escrow services are never allowed.
+upstream_pool = UpstreamPool(
+    allowed_hosts=os.getenv("PROXY_ALLOWED_HOSTS", "").split(","),
+    blocked_origins=[url_host_port(AUTH_SERVICE_URL), url_host_port(ESCROW_SERVICE_URL)],
+    allow_private_hosts=os.getenv("PROXY_ALLOW_PRIVATE_HOSTS", "false").lower() == "true",
+    max_clients=int(os.getenv("UPSTREAM_MAX_CLIENTS", "256")),
+    max_connections_per_host=int(os.getenv("UPSTREAM_MAX_CONNECTIONS_PER_HOST", "50")),
+    max_keepalive_per_host=int(os.getenv("UPSTREAM_MAX_KEEPALIVE_PER_HOST", "10")),
+    keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    connect_timeout=float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "5.0")),
+    read_timeout=float(os.getenv("UPSTREAM_READ_TIMEOUT", "30.0")),
+    write_timeout=float(os.getenv("UPSTREAM_WRITE_TIMEOUT", "30.0")),
+    pool_timeout=float(os.getenv("UPSTREAM_POOL_TIMEOUT", "5.0")),
+    http2=HTTP2_ENABLED,
+    event_hooks=httpx_event_hooks("api-gateway-upstream"),
+)
+
+# Token buckets per client IP, and per API key and X-Agent-ID once the key is
+# verified (requests per second and burst; a rate of 0 disables that limit).
+# Overrides are JSON objects keyed by API key or agent id, e.g.
+# {"sk_abc": {"rate": 5, "burst": 10}}
+rate_limiter = RateLimiter(
+    open_backend(os.getenv("RATE_LIMIT_BACKEND", "local")),
+    key_rate=float(os.getenv("RATE_LIMIT_KEY_RATE", "100")),
+    key_burst=float(os.getenv("RATE_LIMIT_KEY_BURST", "200")),
+    agent_rate=float(os.getenv("RATE_LIMIT_AGENT_RATE", "200")),
+    agent_burst=float(os.getenv("RATE_LIMIT_AGENT_BURST", "400")),
+    key_overrides=parse_overrides(os.getenv("RATE_LIMIT_KEY_OVERRIDES", "")),
+    agent_overrides=parse_overrides(os.getenv("RATE_LIMIT_AGENT_OVERRIDES", "")),
+    ip_rate=float(os.getenv("RATE_LIMIT_IP_RATE", "500")),
+    ip_burst=float(os.getenv("RATE_LIMIT_IP_BURST", "1000")),
+)
+
+# Proxy pipeline stage durations, reported by /stats and /metrics
+stage_stats = StageStats(histogram(
+    "gateway_proxy_stage_duration_seconds", "Time spent in each stage of /api/proxy", ("stage",)
+))
+
+def get_http_client() -> httpx.AsyncClient:
+    """The app's shared client, created on first use if lifespan hasn't run"""
+    if not hasattr(app.state, "http_client"):
+        app.state.http_client = create_http_client()
+    return app.state.http_client
+
+# Set up storage for API call logging (TinyDB or SQLite, see STORAGE_BACKEND)
 db_path = os.getenv("DATABASE_PATH", "./api_calls.json")
-db = TinyDB(db_path)
+db = open_storage(db_path, indexes={'api_calls': ['agent_id']})
 api_call_logs = db.table('api_calls')
 
+# The auth service tells one gateway worker about a deleted key; that worker
+# touches keys_invalidated, and every other worker clears its key cache
+keys_invalidated = ChangeMarker(db_path + ".keys-invalidated")
+keys_invalidated_lock = FileLock(db_path + ".keys-invalidated.lock")
+
+# API call logs are queued in memory and written in batches by a background task
+call_logger = ApiCallLogger(
+    api_call_logs,
+    max_queue=int(os.getenv("API_LOG_QUEUE_SIZE", "10000")),
+    batch_size=int(os.getenv("API_LOG_BATCH_SIZE", "100")),
+    flush_interval=float(os.getenv("API_LOG_FLUSH_INTERVAL", "1.0")),
+)
+
 @app.get("/")
 async def health_check():
     return {"status": "healthy", "service": "api-gateway"}
 
+@app.get("/stats")
+async def get_stats():
+    """Gateway counters for monitoring"""
+    return {
+        "api_call_log": call_logger.stats(),
+        "key_cache": key_cache.stats(),
+        "key_usage": key_usage.stats(),
+        "credits": credit_manager.stats(),
+        "upstream": upstream_pool.stats(),
+        "proxy_stages": stage_stats.stats(),
+        "rate_limit": rate_limiter.stats(),
+    }
+
+class InvalidateKeyRequest(BaseModel):
+    key: str
+
+@app.post("/internal/keys/invalidate")
+async def invalidate_api_key(req: InvalidateKeyRequest):
+    """Drop an API key from the verification cache (called when auth deletes a key)"""
+    invalidated = key_cache.invalidate(req.key)
+    # ChangeMarker bumps must not interleave across workers
+    with keys_invalidated_lock:
+        keys_invalidated.bump()
+    return {"invalidated": invalidated}
+
+def cached_verification(api_key: str) -> Tuple[bool, Optional[dict]]:
+    """key_cache.get, after dropping keys other workers were told were deleted.
+
+    A hit for a valid key counts as a use of the key, since it won't reach
+    the auth service's /verify.
+    """
+    if keys_invalidated.changed():
+        key_cache.clear()
+    hit, user_data = key_cache.get(api_key)
+    if hit and user_data is not None:
+        key_usage.record(api_key)
+    return hit, user_data
+
+async def verify_api_key(client: httpx.AsyncClient, api_key: str) -> Optional[dict]:
+    """Verify an API key with the auth service, going through the key cache.
+
+    Returns the /verify response, or None if the key is invalid.
+    """
+    hit, user_data = cached_verification(api_key)
+    if hit:
+        return user_data
+    return await fetch_verification(client, api_key)
+
+async def fetch_verification(client: httpx.AsyncClient, api_key: str) -> Optional[dict]:
+    """Ask the auth service about an API key and cache the answer"""
+    auth_response = await client.get(
+        AUTH_SERVICE_URL,
+        headers={"X-API-Key": api_key}
+    )
+    if auth_response.status_code == 200:
+        user_data = auth_response.json()
+        key_cache.set(api_key, user_data)
+        return user_data
+
+    # Only cache definite rejections, not auth service errors
+    if auth_response.status_code in (401, 404):
+        key_cache.set(api_key, None)
+    return None
+
+def rate_limited(retry_after: float) -> HTTPException:
+    return HTTPException(
+        status_code=429,
+        detail="Rate limit exceeded",
+        headers={"Retry-After": str(math.ceil(retry_after))}
+    )
+
+async def enforce_client_rate_limit(request: Request):
+    """Raise 429 with Retry-After when the client's IP is over its limit (before the key is verified)"""
+    retry_after = await rate_limiter.check_client(request.client.host if request.client else "unknown")
+    if retry_after:
+        raise rate_limited(retry_after)
+
+async def enforce_rate_limit(api_key: str, agent_id: Optional[str]):
+    """Raise 429 with Retry-After when a verified key or its agent is over its limit"""
+    retry_after = await rate_limiter.check(api_key, agent_id)
+    if retry_after:
+        raise rate_limited(retry_after)
+
 def log_api_call(agent_id: str, api_key: str, success: bool):
-    """Log an API call with timestamp and details"""
-    api_call_logs.insert({
+    """Queue an API call log entry with timestamp and details"""
+    call_logger.log({
         "id": str(uuid.uuid4()),
         "agent_id": agent_id,
         "api_key": api_key,
@@ -57,33 +289,128 @@ async def test_api(
 
 @app.post("/api/test-with-auth")
 async def test_api_with_auth(
+    request: Request,
     x_api_key: str = Header(..., alias="X-API-Key"),
     x_agent_id: str = Header(None, alias="X-Agent-ID")
 ):
     # Verify the API key only without charging or forwarding the request
-    async with httpx.AsyncClient() as client:
-        try:
-            auth_response = await client.get(
-                AUTH_SERVICE_URL,
-                headers={"X-API-Key": x_api_key}
-            )
-
-            if auth_response.status_code != 200:
-                if x_agent_id:
-                    log_api_call(x_agent_id, x_api_key, False)
-                raise HTTPException(status_code=401, detail="Invalid API key")
-
-            if x_agent_id:
-                log_api_call(x_agent_id, x_api_key, True)
-
-            return {
-                "status": "success", 
-                "message": "API tested successfully"
-            }
-        except Exception as e:
-            if x_agent_id:
-                log_api_call(x_agent_id, x_api_key, False)
-            raise HTTPException(status_code=500, detail=f"Error testing API: {str(e)}")
+    await enforce_client_rate_limit(request)
+    client = get_http_client()
+    try:
+        user_data = await verify_api_key(client, x_api_key)
+
+        if user_data is None:
+            raise HTTPException(status_code=401, detail="Invalid API key")
+        await enforce_rate_limit(x_api_key, x_agent_id)
+
+        if x_agent_id:
+            log_api_call(x_agent_id, x_api_key, True)
+
+        return {
+            "status": "success", 
+            "message": "API tested successfully"
+        }
+    except HTTPException:
+        if x_agent_id:
+            log_api_call(x_agent_id, x_api_key, False)
+        raise
+    except Exception as e:
+        if x_agent_id:
+            log_api_call(x_agent_id, x_api_key, False)
+        raise HTTPException(status_code=500, detail=f"Error testing API: {str(e)}")
+
+# Headers that only apply to a single connection, plus the gateway's own
+HOP_BY_HOP_HEADERS = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+    "te", "trailer", "trailers", "transfer-encoding", "upgrade"
+}
+GATEWAY_HEADERS = {"x-api-key", "x-target-url", "x-agent-id"}
+
+def forward_request_headers(headers) -> dict:
+    """Client headers to send upstream (httpx sets Host)"""
+    skip = HOP_BY_HOP_HEADERS | GATEWAY_HEADERS | {"host"}
+    return {k: v for k, v in headers.items() if k.lower() not in skip}
+
+def forward_response_headers(headers) -> dict:
+    """Upstream headers to return to the client (uvicorn adds its own Date and Server)"""
+    skip = HOP_BY_HOP_HEADERS | {"date", "server"}
+    return {k: v for k, v in headers.items() if k.lower() not in skip}
+
+def verified_user_id(user_data: Optional[dict]) -> str:
+    """The user id from a /verify response, or the matching HTTP error"""
+    if user_data is None:
+        raise HTTPException(status_code=401, detail="Invalid API key")
+    user_id = user_data.get("uuid")
+    if not user_id:
+        raise HTTPException(status_code=400, detail="Wallet not found")
+    return user_id
+
+async def verify_remote(client: httpx.AsyncClient, api_key: str) -> str:
+    return verified_user_id(await fetch_verification(client, api_key))
+
+async def charge_request(client: httpx.AsyncClient, user_id: str, agent_id: Optional[str]):
+    """Charge one request (from the user's reserved credit when possible)"""
+    try:
+        charged = await credit_manager.charge(client, user_id, agent_id)
+    except EscrowError:
+        raise HTTPException(status_code=500, detail="Failed to deduct balance")
+    if not charged:
+        raise HTTPException(status_code=402, detail="Credits unavailable")
+
+async def refund_request(client: httpx.AsyncClient, user_id: str, agent_id: Optional[str]):
+    """Take back a request's charge; failures are logged, since the request has failed anyway"""
+    try:
+        await credit_manager.refund_charge(client, user_id, agent_id)
+    except Exception as e:
+        logger.error(f"Failed to refund request for {user_id}: {str(e)}")
+
+async def verify_and_charge(client: httpx.AsyncClient, api_key: str, agent_id: Optional[str],
+                            timings: StageTimings) -> str:
+    """Verify the API key, apply its rate limits and charge its user; returns the user id.
+
+    When the key's cache entry has expired its user is still known, so with
+    refundable (reservation) charges the charge runs alongside re-verifying
+    the key. The first step to fail ends the request; a charge made for a
+    key that turns out to be invalid is refunded.
+    """
+    hit, user_data = cached_verification(api_key)
+    if not hit:
+        stale = key_cache.get_stale(api_key)
+        if stale and stale.get("uuid") and credit_manager.refundable:
+            # The key was valid until its cache entry expired, so its limits apply
+            await enforce_rate_limit(api_key, agent_id)
+            return await verify_and_charge_concurrently(client, api_key, agent_id, stale["uuid"], timings)
+        user_data = await timings.measure("verify", fetch_verification(client, api_key))
+
+    user_id = verified_user_id(user_data)
+    await enforce_rate_limit(api_key, agent_id)
+    await timings.measure("charge", charge_request(client, user_id, agent_id))
+    return user_id
+
+async def verify_and_charge_concurrently(client: httpx.AsyncClient, api_key: str, agent_id: Optional[str],
+                                         user_id: str, timings: StageTimings) -> str:
+    verify = asyncio.ensure_future(timings.measure("verify", verify_remote(client, api_key)))
+    # The charge is never cancelled, so a reservation is never left half made
+    charge = asyncio.ensure_future(timings.measure("charge", charge_request(client, user_id, agent_id)))
+
+    def refund_if_charged(task: asyncio.Future):
+        if task.exception() is None:
+            credit_manager.refund(user_id, agent_id)
+
+    await asyncio.wait({verify, charge}, return_when=asyncio.FIRST_EXCEPTION)
+    if verify.done() and verify.exception() is not None:
+        charge.add_done_callback(refund_if_charged)
+        raise verify.exception()
+    if charge.done() and charge.exception() is not None:
+        verify.cancel()
+        raise charge.exception()
+
+    verified_id = verify.result()
+    if verified_id != user_id:
+        # The key now belongs to someone else: move the charge to them
+        credit_manager.refund(user_id, agent_id)
+        await charge_request(client, verified_id, agent_id)
+    return verified_id
 
 @app.post("/api/proxy")
 async def proxy_request(
@@ -92,96 +419,78 @@ async def proxy_request(
     x_target_url: str = Header(..., alias="X-Target-URL"),
     x_agent_id: str = Header(None, alias="X-Agent-ID")
 ):
-    # Step 1: Verify API Key with Auth Service
-    async with httpx.AsyncClient() as client:
+    # Reject disallowed targets before anything is charged
+    try:
+        origin = await upstream_pool.check_target(x_target_url)
+    except TargetNotAllowed as e:
+        if x_agent_id:
+            log_api_call(x_agent_id, x_api_key, False)
+        raise HTTPException(status_code=403, detail=str(e))
+
+    # Throttle by client IP before anything reaches auth or escrow; the key
+    # and agent limits apply once the key is verified
+    await enforce_client_rate_limit(request)
+
+    timings = StageTimings()
+    client = get_http_client()
+    try:
+        # Steps 1 and 2: verify the API key and charge its user
+        user_id = await timings.measure("admit", verify_and_charge(client, x_api_key, x_agent_id, timings))
+    except HTTPException:
+        if x_agent_id:
+            log_api_call(x_agent_id, x_api_key, False)
+        stage_stats.record(timings)
+        raise
+    except Exception as e:
+        if x_agent_id:
+            log_api_call(x_agent_id, x_api_key, False)
+        stage_stats.record(timings)
+        raise HTTPException(status_code=500, detail=f"Error processing request: {str(e)}")
+
+    # We always log the call for tracking purposes
+    if x_agent_id:
+        log_api_call(x_agent_id, x_api_key, True)
+
+    # Step 3: Forward original request to target URL. Both bodies are
+    # streamed, so large uploads and long or incremental (SSE) responses
+    # are never held in the gateway's memory
+    has_body = "content-length" in request.headers or "transfer-encoding" in request.headers
+    upstream = upstream_pool.acquire(origin)
+    try:
+        upstream_request = upstream.build_request(
+            request.method,
+            x_target_url,
+            headers=forward_request_headers(request.headers),
+            params=request.query_params,
+            content=request.stream() if has_body else b""
+        )
+        upstream_response = await timings.measure("upstream", upstream.send(upstream_request, stream=True))
+    except Exception as e:
+        upstream_pool.release(upstream)
+        stage_stats.record(timings)
+        if x_agent_id:
+            log_api_call(x_agent_id, x_api_key, False)
+        # The target never answered, so the request isn't billed
+        await refund_request(client, user_id, x_agent_id)
+        if isinstance(e, httpx.TimeoutException):
+            raise HTTPException(status_code=504, detail="Upstream request timed out")
+        raise HTTPException(status_code=502, detail=f"Error forwarding request: {str(e)}")
+    stage_stats.record(timings)
+
+    async def close_upstream():
         try:
-            auth_response = await client.get(
-                AUTH_SERVICE_URL,
-                headers={"X-API-Key": x_api_key}
-            )
-
-            if auth_response.status_code != 200:
-                if x_agent_id:
-                    log_api_call(x_agent_id, x_api_key, False)
-                raise HTTPException(status_code=401, detail="Invalid API key")
-
-            user_data = auth_response.json()
-            user_id = user_data.get("uuid")
-            if not user_id:
-                if x_agent_id:
-                    log_api_call(x_agent_id, x_api_key, False)
-                raise HTTPException(status_code=400, detail="Wallet not found")
-
-            # Step 2: Check escrow balance
-            escrow_balance_url = f"{ESCROW_SERVICE_URL}/balance/{user_id}"
-            balance_response = await client.get(escrow_balance_url)
-            
-            if balance_response.status_code != 200:
-                if x_agent_id:
-                    log_api_call(x_agent_id, x_api_key, False)
-                raise HTTPException(status_code=500, detail="Failed to check balance")
-                
-            balance = balance_response.json().get("balance", 0.0)
-
-            if balance < COST_PER_REQUEST:
-                if x_agent_id:
-                    log_api_call(x_agent_id, x_api_key, False)
-                raise HTTPException(status_code=402, detail="Credits unavailable")
-
-            # Step 3: Spend the funds
-            spend_response = await client.post(
-                f"{ESCROW_SERVICE_URL}/spend",
-                headers={
-                    "X-User-ID": user_id,
-                    "X-Agent-ID": x_agent_id if x_agent_id else None
-                },
-                json={"cost": COST_PER_REQUEST}
-            )
-            
-            if spend_response.status_code != 200:
-                if x_agent_id:
-                    log_api_call(x_agent_id, x_api_key, False)
-                raise HTTPException(status_code=500, detail="Failed to deduct balance")
-
-            # We always log the call for tracking purposes
-            if x_agent_id:
-                log_api_call(x_agent_id, x_api_key, True)
-
-            # Step 4: Forward original request to target URL
-            try:
-                body = await request.body()
-                headers = dict(request.headers)
-                
-                # Remove gateway-specific headers
-                headers.pop("x-api-key", None)
-                headers.pop("x-target-url", None)
-                headers.pop("x-agent-id", None)
-                
-                # For this example, we're just returning success instead of forwarding
-                # In a real implementation, you would do:
-                # target_response = await client.request(
-                #     request.method,
-                #     x_target_url,
-                #     headers=headers,
-                #     content=body
-                # )
-                # return target_response.json()
-                
-                return {
-                    "status": "success", 
-                    "message": "Request was successful"
-                }
-                
-            except Exception as e:
-                if x_agent_id:
-                    log_api_call(x_agent_id, x_api_key, False)
-                raise HTTPException(status_code=500, detail=f"Error forwarding request: {str(e)}")
-        except HTTPException:
-            raise
-        except Exception as e:
-            if x_agent_id:
-                log_api_call(x_agent_id, x_api_key, False)
-            raise HTTPException(status_code=500, detail=f"Error processing request: {str(e)}")
+            await upstream_response.aclose()
+        finally:
+            upstream_pool.release(upstream)
+
+    headers = forward_response_headers(upstream_response.headers)
+    headers["Server-Timing"] = timings.server_timing()
+    return StreamingResponse(
+        upstream_response.aiter_raw(),
+        status_code=upstream_response.status_code,
+        headers=headers,
+        background=BackgroundTask(close_upstream)
+    )
 
 if __name__ == "__main__":
     import uvicorn
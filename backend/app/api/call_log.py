@@ -0,0 +1,111 @@
+"""
+Batched, asynchronous API call logging for the gateway.
+
+Request handlers push log entries onto a bounded in-memory queue; a
+background task drains it and writes entries to storage in batches, either
+when a batch fills up or when the flush interval elapses. The hot path never
+touches disk, and anything still queued is flushed on shutdown.
+"""
+import asyncio
+import logging
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class ApiCallLogger:
+    """Buffers API call log entries and writes them in batches"""
+
+    def __init__(self, table, max_queue: int = 10000, batch_size: int = 100, flush_interval: float = 1.0):
+        self.table = table
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+        # Counters exposed through stats()
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    def log(self, entry: dict):
+        """Queue a log entry; written synchronously if the writer isn't running"""
+        if not self.running:
+            self._write_batch([entry])
+            return
+
+        try:
+            self.queue.put_nowait(entry)
+            self.enqueued += 1
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    async def start(self):
+        """Start the background writer"""
+        if self.running:
+            return
+        self.queue = asyncio.Queue(maxsize=self.max_queue)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the writer after flushing everything that is queued"""
+        if not self.running:
+            return
+        await self.queue.put(_STOP)
+        await self._task
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self.queue.get()
+            if item is _STOP:
+                return
+
+            batch = [item]
+            stopping = False
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            await asyncio.to_thread(self._write_batch, batch)
+            if stopping:
+                return
+
+    def _write_batch(self, batch: List[dict]):
+        try:
+            self.table.insert_multiple(batch)
+            self.written += len(batch)
+            self.batches += 1
+        except Exception as e:
+            self.failed += len(batch)
+            logger.error(f"Failed to write {len(batch)} API call log entries: {str(e)}")
+
+    def stats(self) -> dict:
+        return {
+            "queued": self.queue.qsize() if self.running else 0,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "batches": self.batches,
+        }
@@ -0,0 +1,233 @@
+"""
+Per-request billing for the gateway, optionally from pre-paid reservations.
+
+With reservations enabled the gateway reserves a block of credit per user
+from escrow (``reservation_size`` requests' worth), charges requests against
+it locally, and settles the block back to escrow when it runs out, expires,
+or the gateway shuts down. Escrow then refunds whatever wasn't used. With a
+reservation size of 0 every request is charged through escrow's /charge.
+"""
+import asyncio
+import logging
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+
+class EscrowError(Exception):
+    """Escrow couldn't be reached or returned an unexpected response"""
+
+
+class Reservation:
+    def __init__(self, reservation_id: str, user_id: str, requests: int, expires_at: float):
+        self.id = reservation_id
+        self.user_id = user_id
+        self.remaining = requests
+        self.used = 0
+        self.agent_usage: Counter = Counter()
+        self.expires_at = expires_at
+
+    def usable(self) -> bool:
+        return self.remaining > 0 and self.expires_at > time.monotonic()
+
+
+class CreditManager:
+    """Charges COST_PER_REQUEST per call, from reservations when enabled"""
+
+    def __init__(self, escrow_url: str, cost: float, reservation_size: int = 100,
+                 reservation_ttl: float = 60.0):
+        self.escrow_url = escrow_url
+        self.cost = cost
+        self.reservation_size = reservation_size
+        self.reservation_ttl = reservation_ttl
+        self.reservations: Dict[str, Reservation] = {}
+        # Closed reservations whose settlement failed; retried in the background
+        self.unsettled: List[Reservation] = []
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._client: Optional[httpx.AsyncClient] = None
+        self._task: Optional[asyncio.Task] = None
+
+        # Counters exposed through stats()
+        self.local_charges = 0
+        self.escrow_charges = 0
+        self.reservations_made = 0
+        self.reservations_settled = 0
+        self.refunds = 0
+
+    async def start(self, client: httpx.AsyncClient):
+        """Start settling expired reservations in the background"""
+        self._client = client
+        if self.reservation_size > 0 and self._task is None:
+            self._task = asyncio.create_task(self._settle_expired_periodically())
+
+    async def stop(self):
+        """Settle every open reservation"""
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        for user_id in list(self.reservations):
+            async with self._lock(user_id):
+                await self._settle(user_id)
+        await self._retry_unsettled()
+
+    async def charge(self, client: httpx.AsyncClient, user_id: str, agent_id: Optional[str] = None) -> bool:
+        """Charge one request; False if the user can't cover it"""
+        if self.reservation_size <= 0:
+            return await self._charge_escrow(client, user_id, agent_id)
+
+        async with self._lock(user_id):
+            reservation = self.reservations.get(user_id)
+            if reservation is None or not reservation.usable():
+                if reservation is not None:
+                    await self._settle(user_id, client)
+                reservation = await self._reserve(client, user_id)
+                if reservation is None:
+                    return False
+
+            reservation.remaining -= 1
+            reservation.used += 1
+            if agent_id:
+                reservation.agent_usage[agent_id] += 1
+            self.local_charges += 1
+            return True
+
+    @property
+    def refundable(self) -> bool:
+        """Charges are made locally and can be taken back with refund()"""
+        return self.reservation_size > 0
+
+    def refund(self, user_id: str, agent_id: Optional[str] = None) -> bool:
+        """Take back one local charge, e.g. one made for a key that turned out invalid"""
+        reservation = self.reservations.get(user_id)
+        if reservation is None or reservation.used == 0:
+            return False
+        reservation.remaining += 1
+        reservation.used -= 1
+        if agent_id and reservation.agent_usage[agent_id] > 0:
+            reservation.agent_usage[agent_id] -= 1
+        self.refunds += 1
+        return True
+
+    async def refund_charge(self, client: httpx.AsyncClient, user_id: str, agent_id: Optional[str] = None):
+        """Give back one request's charge, e.g. when the request couldn't be forwarded.
+
+        Local charges go back to the reservation. If it's gone, or charges go
+        through escrow, escrow refunds the cost.
+        """
+        if self.refundable and self.refund(user_id, agent_id):
+            return
+        headers = {"X-User-ID": user_id}
+        if agent_id:
+            headers["X-Agent-ID"] = agent_id
+        response = await client.post(f"{self.escrow_url}/refund", headers=headers, json={"amount": self.cost})
+        if response.status_code != 200:
+            raise EscrowError(f"Refund failed with status {response.status_code}")
+        self.refunds += 1
+
+    def _lock(self, user_id: str) -> asyncio.Lock:
+        if user_id not in self._locks:
+            self._locks[user_id] = asyncio.Lock()
+        return self._locks[user_id]
+
+    async def _charge_escrow(self, client: httpx.AsyncClient, user_id: str, agent_id: Optional[str]) -> bool:
+        headers = {"X-User-ID": user_id}
+        if agent_id:
+            headers["X-Agent-ID"] = agent_id
+        response = await client.post(f"{self.escrow_url}/charge", headers=headers, json={"cost": self.cost})
+        if response.status_code == 402:
+            return False
+        if response.status_code != 200:
+            raise EscrowError(f"Charge failed with status {response.status_code}")
+        self.escrow_charges += 1
+        return True
+
+    async def _reserve(self, client: httpx.AsyncClient, user_id: str) -> Optional[Reservation]:
+        response = await client.post(
+            f"{self.escrow_url}/reserve",
+            headers={"X-User-ID": user_id},
+            # Escrow releases it by itself if this gateway never settles it
+            json={"amount": self.cost * self.reservation_size, "min_amount": self.cost,
+                  "ttl": self.reservation_ttl},
+        )
+        if response.status_code == 402:
+            return None
+        if response.status_code != 200:
+            raise EscrowError(f"Reservation failed with status {response.status_code}")
+
+        data = response.json()
+        requests = int(round(data["amount"] / self.cost))
+        reservation = Reservation(data["reservation_id"], user_id, requests,
+                                  time.monotonic() + self.reservation_ttl)
+        self.reservations[user_id] = reservation
+        self.reservations_made += 1
+        return reservation
+
+    async def _settle(self, user_id: str, client: Optional[httpx.AsyncClient] = None):
+        """Close a user's reservation and report its usage to escrow"""
+        reservation = self.reservations.pop(user_id, None)
+        if reservation is not None and not await self._post_settlement(reservation, client):
+            self.unsettled.append(reservation)
+
+    async def _post_settlement(self, reservation: Reservation, client: Optional[httpx.AsyncClient] = None) -> bool:
+        """Escrow refunds the unused part of the reservation"""
+        client = client or self._client
+        try:
+            response = await client.post(
+                f"{self.escrow_url}/reservations/{reservation.id}/settle",
+                json={
+                    "used": reservation.used * self.cost,
+                    "requests": reservation.used,
+                    "agent_usage": dict(reservation.agent_usage),
+                },
+            )
+            # 409 means an earlier attempt already went through
+            if response.status_code not in (200, 409):
+                raise EscrowError(f"Settlement failed with status {response.status_code}")
+        except Exception as e:
+            logger.error(f"Failed to settle reservation {reservation.id} for {reservation.user_id}: {str(e)}")
+            return False
+        self.reservations_settled += 1
+        return True
+
+    async def _retry_unsettled(self):
+        pending, self.unsettled = self.unsettled, []
+        for reservation in pending:
+            if not await self._post_settlement(reservation):
+                self.unsettled.append(reservation)
+
+    async def _settle_expired_periodically(self):
+        while True:
+            await asyncio.sleep(min(self.reservation_ttl, 5.0))
+            now = time.monotonic()
+            for user_id, reservation in list(self.reservations.items()):
+                if reservation.expires_at <= now:
+                    async with self._lock(user_id):
+                        if self.reservations.get(user_id) is reservation:
+                            await self._settle(user_id)
+            self._evict_idle_locks()
+            await self._retry_unsettled()
+
+    def _evict_idle_locks(self):
+        """Drop the locks no one holds or waits for, so there's no lock per user ever seen"""
+        # An asyncio.Lock that isn't locked has no waiters, and acquiring a free
+        # lock doesn't yield, so no charge is between getting a lock and taking it
+        for user_id, lock in list(self._locks.items()):
+            if not lock.locked():
+                del self._locks[user_id]
+
+    def stats(self) -> dict:
+        return {
+            "open_reservations": len(self.reservations),
+            "reserved_requests_remaining": sum(r.remaining for r in self.reservations.values()),
+            "local_charges": self.local_charges,
+            "escrow_charges": self.escrow_charges,
+            "reservations_made": self.reservations_made,
+            "reservations_settled": self.reservations_settled,
+            "refunds": self.refunds,
+            "unsettled_reservations": len(self.unsettled),
+            "user_locks": len(self._locks),
+        }
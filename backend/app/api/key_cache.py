@@ -0,0 +1,90 @@
+"""
+In-process LRU + TTL cache of API key verification results.
+
+Holds the auth service's /verify response per API key so repeated calls with
+the same key skip the round trip. Invalid keys are cached too (as None) for
+a shorter TTL, so a flood of bad keys doesn't reach the auth service either.
+Expired entries for valid keys stay (until evicted) as a hint of the key's
+user while it is re-verified.
+"""
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+_MISSING = object()
+
+
+class KeyCache:
+    """LRU cache of /verify responses with per-entry expiry"""
+
+    def __init__(self, max_size: int = 10000, ttl: float = 60.0, negative_ttl: float = 5.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries: "OrderedDict[str, Tuple[float, Optional[dict]]]" = OrderedDict()
+
+        # Counters exposed through stats()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, api_key: str) -> Tuple[bool, Optional[dict]]:
+        """Return (hit, user_data); user_data is None for a cached invalid key"""
+        entry = self._entries.get(api_key, _MISSING)
+        if entry is _MISSING:
+            self.misses += 1
+            return False, None
+
+        expires_at, user_data = entry
+        if expires_at <= time.monotonic():
+            if user_data is None:
+                del self._entries[api_key]
+            self.misses += 1
+            return False, None
+
+        self._entries.move_to_end(api_key)
+        if user_data is None:
+            self.negative_hits += 1
+        else:
+            self.hits += 1
+        return True, user_data
+
+    def get_stale(self, api_key: str) -> Optional[dict]:
+        """Last /verify response for a valid key, even if expired"""
+        entry = self._entries.get(api_key)
+        return entry[1] if entry is not None else None
+
+    def set(self, api_key: str, user_data: Optional[dict]):
+        """Cache a verification result; pass None to cache an invalid key"""
+        ttl = self.ttl if user_data is not None else self.negative_ttl
+        if ttl <= 0 or self.max_size <= 0:
+            return
+        self._entries[api_key] = (time.monotonic() + ttl, user_data)
+        self._entries.move_to_end(api_key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, api_key: str) -> bool:
+        """Drop a key, e.g. after it was deleted in the auth service"""
+        if self._entries.pop(api_key, None) is None:
+            return False
+        self.invalidations += 1
+        return True
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.negative_hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "hit_ratio": (self.hits + self.negative_hits) / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
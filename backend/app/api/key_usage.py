@@ -0,0 +1,100 @@
+"""
+Usage of API keys whose verification the gateway served from its cache.
+
+Cache hits never reach the auth service's /verify, which is where key usage
+(use_count, last_used) is counted. The gateway counts those uses itself and
+reports them to the auth service in one POST per flush interval, or sooner
+once `max_keys` different keys are waiting. Counts that can't be delivered
+are kept for the next flush; anything still pending is sent on shutdown.
+"""
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+
+class KeyUsageReporter:
+    """Counts cache-served uses per API key and reports them to auth in batches"""
+
+    def __init__(self, url: str, flush_interval: float = 5.0, max_keys: int = 10000):
+        self.url = url
+        self.flush_interval = flush_interval
+        self.max_keys = max_keys
+        # api_key -> (uses, last used), not yet reported
+        self._pending: Dict[str, Tuple[int, str]] = {}
+        self._client: Optional[httpx.AsyncClient] = None
+        self._task: Optional[asyncio.Task] = None
+        self._full: Optional[asyncio.Event] = None
+
+        # Counters exposed through stats()
+        self.recorded = 0
+        self.reported = 0
+        self.flushes = 0
+        self.failures = 0
+
+    def record(self, api_key: str):
+        """Count one use of a key whose verification came from the cache"""
+        now = datetime.utcnow().isoformat()
+        count, _ = self._pending.get(api_key, (0, now))
+        self._pending[api_key] = (count + 1, now)
+        self.recorded += 1
+        if len(self._pending) >= self.max_keys and self._full is not None:
+            self._full.set()
+
+    async def start(self, client: httpx.AsyncClient):
+        """Start reporting in the background"""
+        self._client = client
+        if self._task is None:
+            self._full = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop reporting after sending whatever is pending"""
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._full.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._full.clear()
+            await self.flush()
+
+    async def flush(self) -> int:
+        """Send pending usage to the auth service; returns the keys reported"""
+        if not self._pending or self._client is None:
+            return 0
+        pending, self._pending = self._pending, {}
+        usage = [{"key": key, "count": count, "last_used": last_used}
+                 for key, (count, last_used) in pending.items()]
+        try:
+            response = await self._client.post(self.url, json={"usage": usage})
+            response.raise_for_status()
+        except Exception as e:
+            self.failures += 1
+            logger.warning(f"Failed to report usage of {len(usage)} API keys: {str(e)}")
+            # Merged back, so the next flush retries them
+            for key, (count, last_used) in pending.items():
+                pending_count, pending_last_used = self._pending.get(key, (0, last_used))
+                self._pending[key] = (count + pending_count, max(last_used, pending_last_used))
+            return 0
+        self.flushes += 1
+        self.reported += len(usage)
+        return len(usage)
+
+    def stats(self) -> dict:
+        return {
+            "pending_keys": len(self._pending),
+            "recorded": self.recorded,
+            "reported_keys": self.reported,
+            "flushes": self.flushes,
+            "failures": self.failures,
+        }
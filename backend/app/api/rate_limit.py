@@ -0,0 +1,150 @@
+"""
+Token-bucket rate limiting for the gateway, per client IP, API key and agent.
+
+Each client IP, API key and X-Agent-ID has a bucket that refills at `rate`
+tokens per second up to `burst`; a request takes one token from every
+bucket that applies and is rejected (with the time until it would succeed)
+if any is empty. The IP bucket is checked before the API key is verified;
+the key and agent buckets only once it is, so requests with an invalid key
+can't use up a real key's or agent's allowance.
+
+Buckets live in a RateLimitBackend: the in-process backend here suits a
+single gateway, and replicas can share counters through another backend
+implementing the same interface (e.g. Redis with a script doing the same
+arithmetic atomically).
+"""
+import json
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+
+class Limit(NamedTuple):
+    bucket: str
+    rate: float   # tokens per second
+    burst: float  # bucket capacity
+
+
+class RateLimitBackend(ABC):
+    """Where bucket state lives; implementations must make acquire atomic"""
+
+    @abstractmethod
+    async def acquire(self, limits: List[Limit]) -> float:
+        """Take a token from every bucket, or none if any is empty.
+
+        Returns 0 if the tokens were taken, otherwise seconds until they could be.
+        """
+
+    async def close(self):
+        pass
+
+
+class LocalRateLimitBackend(RateLimitBackend):
+    """Buckets in this process's memory, least recently used dropped past max_buckets"""
+
+    def __init__(self, max_buckets: int = 100000):
+        self.max_buckets = max_buckets
+        # bucket -> (tokens, updated_at)
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+    async def acquire(self, limits: List[Limit]) -> float:
+        # No awaits below, so this is atomic within the event loop
+        now = time.monotonic()
+        levels = []
+        retry_after = 0.0
+        for limit in limits:
+            tokens, updated_at = self._buckets.get(limit.bucket, (limit.burst, now))
+            tokens = min(limit.burst, tokens + (now - updated_at) * limit.rate)
+            levels.append(tokens)
+            if tokens < 1:
+                retry_after = max(retry_after, (1 - tokens) / limit.rate)
+
+        for limit, tokens in zip(limits, levels):
+            self._buckets[limit.bucket] = (tokens - 1 if not retry_after else tokens, now)
+            self._buckets.move_to_end(limit.bucket)
+        while len(self._buckets) > self.max_buckets:
+            self._buckets.popitem(last=False)
+        return retry_after
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+BACKENDS = {
+    "local": LocalRateLimitBackend,
+}
+
+
+def open_backend(name: str) -> RateLimitBackend:
+    """The rate limit backend selected by RATE_LIMIT_BACKEND"""
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown rate limit backend: {name}")
+    return BACKENDS[name]()
+
+
+def parse_overrides(value: str) -> Dict[str, Tuple[float, float]]:
+    """'{"id": {"rate": 5, "burst": 10}}' -> {"id": (5.0, 10.0)}"""
+    if not value:
+        return {}
+    return {
+        name: (float(limit["rate"]), float(limit.get("burst", limit["rate"])))
+        for name, limit in json.loads(value).items()
+    }
+
+
+class RateLimiter:
+    """Applies the per-IP, per-key and per-agent limits, with overrides by key or agent id"""
+
+    def __init__(self, backend: RateLimitBackend, key_rate: float = 100.0, key_burst: float = 200.0,
+                 agent_rate: float = 200.0, agent_burst: float = 400.0,
+                 key_overrides: Optional[Dict[str, Tuple[float, float]]] = None,
+                 agent_overrides: Optional[Dict[str, Tuple[float, float]]] = None,
+                 ip_rate: float = 500.0, ip_burst: float = 1000.0):
+        self.backend = backend
+        self.ip_limit = (ip_rate, ip_burst)
+        self.key_limit = (key_rate, key_burst)
+        self.agent_limit = (agent_rate, agent_burst)
+        self.key_overrides = key_overrides or {}
+        self.agent_overrides = agent_overrides or {}
+
+        # Counters exposed through stats()
+        self.allowed = 0
+        self.limited = 0
+
+    def limits_for(self, api_key: str, agent_id: Optional[str]) -> List[Limit]:
+        limits = []
+        rate, burst = self.key_overrides.get(api_key, self.key_limit)
+        if rate > 0:
+            limits.append(Limit(f"key:{api_key}", rate, max(burst, 1)))
+        if agent_id:
+            rate, burst = self.agent_overrides.get(agent_id, self.agent_limit)
+            if rate > 0:
+                limits.append(Limit(f"agent:{agent_id}", rate, max(burst, 1)))
+        return limits
+
+    async def check(self, api_key: str, agent_id: Optional[str] = None) -> float:
+        """0 if a request with a verified key may go ahead, otherwise seconds to wait (a rate of 0 means unlimited)"""
+        limits = self.limits_for(api_key, agent_id)
+        retry_after = await self.backend.acquire(limits) if limits else 0.0
+        if retry_after:
+            self.limited += 1
+        else:
+            self.allowed += 1
+        return retry_after
+
+    async def check_client(self, client_ip: str) -> float:
+        """Like check, for the client's IP address before its key is verified"""
+        rate, burst = self.ip_limit
+        if rate <= 0:
+            return 0.0
+        retry_after = await self.backend.acquire([Limit(f"ip:{client_ip}", rate, max(burst, 1))])
+        if retry_after:
+            self.limited += 1
+        return retry_after
+
+    def stats(self) -> dict:
+        stats = {"allowed": self.allowed, "limited": self.limited}
+        if isinstance(self.backend, LocalRateLimitBackend):
+            stats["buckets"] = len(self.backend)
+        return stats
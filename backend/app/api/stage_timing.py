@@ -0,0 +1,50 @@
+"""
+Per-stage timing for the gateway's proxy pipeline.
+
+Each request records how long its stages took (key verification, charging,
+the upstream call), returned to the caller in a Server-Timing header and
+aggregated for /stats (and, given a histogram, for /metrics).
+"""
+import time
+from typing import Awaitable, Dict
+
+
+class StageTimings:
+    """Stage durations (ms) for one request"""
+
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+
+    async def measure(self, stage: str, awaitable: Awaitable):
+        start = time.perf_counter()
+        try:
+            return await awaitable
+        finally:
+            self.stages[stage] = (time.perf_counter() - start) * 1000
+
+    def server_timing(self) -> str:
+        return ", ".join(f"{stage};dur={ms:.2f}" for stage, ms in self.stages.items())
+
+
+class StageStats:
+    """Count, mean and max duration per stage across requests"""
+
+    def __init__(self, histogram=None):
+        self._stages: Dict[str, list] = {}  # stage -> [count, total_ms, max_ms]
+        # Optional metrics histogram with a "stage" label, observed in seconds
+        self.histogram = histogram
+
+    def record(self, timings: StageTimings):
+        for stage, ms in timings.stages.items():
+            if self.histogram is not None:
+                self.histogram.observe(ms / 1000, stage=stage)
+            entry = self._stages.setdefault(stage, [0, 0.0, 0.0])
+            entry[0] += 1
+            entry[1] += ms
+            entry[2] = max(entry[2], ms)
+
+    def stats(self) -> dict:
+        return {
+            stage: {"count": count, "mean_ms": total / count, "max_ms": max_ms}
+            for stage, (count, total, max_ms) in self._stages.items()
+        }
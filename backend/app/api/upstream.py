@@ -0,0 +1,161 @@
+"""
+Outbound connections for requests the gateway proxies to X-Target-URL.
+
+Each upstream origin (scheme, host, port) gets its own pooled client, so a
+slow or busy target can only tie up its own connections and never starves
+the auth and escrow calls or other targets. At most `max_clients` clients
+are kept; the least recently used one is closed once its last response is.
+
+Targets are restricted so the gateway can't be used as a proxy into the
+network it runs in. With an allowlist of hosts only those are allowed.
+Without one, any host is allowed as long as all of its addresses are
+public: private, loopback, link-local and other non-public addresses are
+refused. The gateway's own auth and escrow services are always refused.
+"""
+import asyncio
+import ipaddress
+import socket
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+from urllib.parse import urlsplit
+
+import httpx
+
+Origin = Tuple[str, str, int]
+
+
+class TargetNotAllowed(Exception):
+    """X-Target-URL isn't an http(s) URL on an allowed host"""
+
+
+def url_host_port(url: str) -> Tuple[str, int]:
+    """(host, port) of a URL, with the scheme's default port"""
+    parts = urlsplit(url)
+    return (parts.hostname or "").lower(), parts.port or (443 if parts.scheme == "https" else 80)
+
+
+class UpstreamPool:
+    """Lazily created httpx clients, one per upstream origin"""
+
+    def __init__(self, allowed_hosts: Iterable[str] = (), blocked_origins: Iterable[Tuple[str, int]] = (),
+                 allow_private_hosts: bool = False, max_clients: int = 256,
+                 max_connections_per_host: int = 50, max_keepalive_per_host: int = 10,
+                 keepalive_expiry: float = 30.0, connect_timeout: float = 5.0, read_timeout: float = 30.0,
+                 write_timeout: float = 30.0, pool_timeout: float = 5.0, http2: bool = False,
+                 event_hooks: Optional[dict] = None, resolve_ttl: float = 60.0):
+        self.allowed_hosts = {host.strip().lower() for host in allowed_hosts if host.strip()}
+        self.blocked_origins = set(blocked_origins)
+        self.allow_private_hosts = allow_private_hosts
+        self.max_clients = max_clients
+        self.limits = httpx.Limits(
+            max_connections=max_connections_per_host,
+            max_keepalive_connections=max_keepalive_per_host,
+            keepalive_expiry=keepalive_expiry,
+        )
+        # Read and write timeouts apply between chunks, so long streams are fine
+        # as long as they keep moving
+        self.timeout = httpx.Timeout(connect=connect_timeout, read=read_timeout,
+                                     write=write_timeout, pool=pool_timeout)
+        self.http2 = http2
+        self.event_hooks = event_hooks
+        self.resolve_ttl = resolve_ttl
+        self._clients: "OrderedDict[Origin, httpx.AsyncClient]" = OrderedDict()
+        # Responses still open per client, so an evicted client is closed only when idle
+        self._users: Dict[httpx.AsyncClient, int] = {}
+        self._evicted = set()
+        # host -> when its addresses were last found to be public
+        self._public_hosts: "OrderedDict[str, float]" = OrderedDict()
+        self.evictions = 0
+
+    async def check_target(self, url: str) -> Origin:
+        """The URL's origin, or TargetNotAllowed"""
+        try:
+            parts = urlsplit(url)
+            port = parts.port
+        except ValueError:
+            raise TargetNotAllowed(f"Invalid target URL: {url}")
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise TargetNotAllowed(f"Invalid target URL: {url}")
+
+        host = parts.hostname.lower()
+        port = port or (443 if parts.scheme == "https" else 80)
+        if (host, port) in self.blocked_origins:
+            raise TargetNotAllowed(f"Target host not allowed: {host}")
+        if self.allowed_hosts:
+            if not self._host_allowed(host, port):
+                raise TargetNotAllowed(f"Target host not allowed: {host}")
+        elif not self.allow_private_hosts:
+            await self._check_public(host, port)
+        return parts.scheme, host, port
+
+    def _host_allowed(self, host: str, port: int) -> bool:
+        for allowed in self.allowed_hosts:
+            allowed_host, _, allowed_port = allowed.partition(":")
+            if allowed_port and allowed_port != str(port):
+                continue
+            if allowed_host == host:
+                return True
+            # "*.example.com" matches subdomains of example.com
+            if allowed_host.startswith("*.") and host.endswith(allowed_host[1:]):
+                return True
+        return False
+
+    async def _check_public(self, host: str, port: int):
+        """Refuse hosts with any non-public address; answers are cached for resolve_ttl"""
+        checked_at = self._public_hosts.get(host)
+        if checked_at is not None and time.monotonic() - checked_at < self.resolve_ttl:
+            self._public_hosts.move_to_end(host)
+            return
+        try:
+            infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        except socket.gaierror:
+            raise TargetNotAllowed(f"Target host can't be resolved: {host}")
+        for info in infos:
+            address = ipaddress.ip_address(info[4][0].split("%")[0])
+            if address.version == 6 and address.ipv4_mapped:
+                address = address.ipv4_mapped
+            if not address.is_global:
+                raise TargetNotAllowed(f"Target host not allowed: {host} is not a public address")
+        self._public_hosts[host] = time.monotonic()
+        self._public_hosts.move_to_end(host)
+        while len(self._public_hosts) > self.max_clients:
+            self._public_hosts.popitem(last=False)
+
+    def acquire(self, origin: Origin) -> httpx.AsyncClient:
+        """The origin's client, held until release() is called with it"""
+        client = self._clients.get(origin)
+        if client is None:
+            client = httpx.AsyncClient(limits=self.limits, timeout=self.timeout, http2=self.http2,
+                                       event_hooks=self.event_hooks)
+            self._clients[origin] = client
+            self._users[client] = 0
+            while len(self._clients) > self.max_clients:
+                _, oldest = self._clients.popitem(last=False)
+                self._evicted.add(oldest)
+                self.evictions += 1
+                if not self._users[oldest]:
+                    self._close(oldest)
+        self._clients.move_to_end(origin)
+        self._users[client] += 1
+        return client
+
+    def release(self, client: httpx.AsyncClient):
+        """Done with a client from acquire(); closes it if it was evicted and is now idle"""
+        self._users[client] -= 1
+        if not self._users[client] and client in self._evicted:
+            self._close(client)
+
+    def _close(self, client: httpx.AsyncClient):
+        del self._users[client]
+        self._evicted.discard(client)
+        asyncio.ensure_future(client.aclose())
+
+    async def aclose(self):
+        clients = list(self._clients.values()) + list(self._evicted)
+        self._clients, self._users, self._evicted = OrderedDict(), {}, set()
+        await asyncio.gather(*(client.aclose() for client in clients))
+
+    def stats(self) -> dict:
+        return {"upstream_hosts": len(self._clients), "evicted_open": len(self._evicted),
+                "evictions": self.evictions}
@@ -1,18 +1,36 @@
-from fastapi import FastAPI, HTTPException, Request, Header
+from fastapi import BackgroundTasks, FastAPI, HTTPException, Header
 from pydantic import BaseModel
 from uuid import uuid4
 from datetime import datetime
-from typing import List
-from tinydb import TinyDB, Query
-from tinydb.operations import add, set
+from typing import Dict, List, Optional, Tuple
 from fastapi.middleware.cors import CORSMiddleware
+from contextlib import asynccontextmanager
+import asyncio
+import json
 import logging
+import os
+import sys
+import threading
+import urllib.request
+
+# Shared backend modules live in backend/app/common
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.interprocess import ChangeMarker, FileLock
+from common.metrics import instrument_app
+from common.storage import open_storage
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    flusher = asyncio.create_task(flush_usage_periodically())
+    yield
+    flusher.cancel()
+    flush_usage()
+
+app = FastAPI(lifespan=lifespan)
 
 # Enable CORS - ensure these settings match your frontend
 app.add_middleware(
@@ -24,16 +42,32 @@ app.add_middleware(
 )
 
 # DB setup
-db = TinyDB("auth_db.json")
+db_path = os.getenv("DATABASE_PATH", "auth_db.json")
+db = open_storage(db_path, indexes={"users": ["wallet_address"]})
 users_table = db.table("users")
 
-# Log all requests middleware
-@app.middleware("http")
-async def log_requests(request: Request, call_next):
-    logger.info(f"Request: {request.method} {request.url.path}")
-    response = await call_next(request)
-    logger.info(f"Response status: {response.status_code}")
-    return response
+# Gateway endpoints to notify when a key is deleted so cached verifications
+# are dropped, e.g. "http://api-gateway:8002/internal/keys/invalidate"
+KEY_INVALIDATION_URLS = [u for u in os.getenv("KEY_INVALIDATION_URLS", "").split(",") if u]
+
+# In-memory API key index: key -> (wallet_address, key record).
+# Built from the users table at startup and kept in step by add_api_key and
+# delete_api_key, so /verify and /apikeys/use never scan every user. Key
+# changes also bump keys_changed, so the other workers rebuild their index.
+api_key_index: Dict[str, Tuple[str, dict]] = {}
+keys_changed = ChangeMarker(db_path + ".keys")
+
+# Key usage (use_count delta, last_used) accumulated in memory and written
+# to the users table once per USAGE_FLUSH_INTERVAL, so /verify stays read-only
+USAGE_FLUSH_INTERVAL = float(os.getenv("USAGE_FLUSH_INTERVAL", "5.0"))
+pending_usage: Dict[str, Tuple[int, str]] = {}
+usage_lock = threading.Lock()
+
+# Serializes read-modify-write of user documents, across workers
+users_lock = FileLock(db_path + ".users.lock")
+
+# Request counts and per-route latency at /metrics
+instrument_app(app, "auth")
 
 # Schemas
 class WalletRequest(BaseModel):
@@ -49,11 +83,121 @@ class DeleteAPIKeyRequest(BaseModel):
 
 class UseAPIKeyRequest(BaseModel):
     key: str
+    # Uses being reported, e.g. by a gateway that verified the key from its cache
+    count: int = 1
+    last_used: Optional[str] = None
+
+class KeyUsageBatch(BaseModel):
+    usage: List[UseAPIKeyRequest]
 
 # Helpers
 def get_user(wallet_address: str):
-    UserQ = Query()
-    return users_table.get(UserQ.wallet_address == wallet_address)
+    return users_table.get(wallet_address=wallet_address)
+
+def build_api_key_index():
+    """Rebuild the API key index from the users table"""
+    global api_key_index
+    # Under users_lock, so a key this worker adds or deletes meanwhile can't
+    # be undone by swapping in an index read before the change
+    with users_lock:
+        index = {}
+        for user in users_table.all():
+            for key in user["api_keys"]:
+                index[key["key"]] = (user["wallet_address"], key)
+        # Swapped in whole, so lookups meanwhile use the previous index
+        api_key_index = index
+    logger.info(f"Indexed {len(index)} API keys")
+
+def find_api_key(api_key: str) -> Optional[Tuple[str, dict]]:
+    """Return (wallet_address, key record) for an API key, or None"""
+    if keys_changed.changed():
+        build_api_key_index()
+    return api_key_index.get(api_key)
+
+def record_key_usage(api_key: str, uses: int = 1, used_at: Optional[str] = None) -> Optional[Tuple[str, dict]]:
+    """Count uses of an API key (last one at `used_at`, default now); persisted by the next usage flush"""
+    entry = find_api_key(api_key)
+    if not entry:
+        return None
+
+    used_at = used_at or datetime.utcnow().isoformat()
+    with usage_lock:
+        count, last_used = pending_usage.get(api_key, (0, used_at))
+        pending_usage[api_key] = (count + uses, max(last_used, used_at))
+    return entry
+
+def apply_pending_usage(api_keys: List[dict]) -> List[dict]:
+    """Copy of api_keys including usage that hasn't been flushed yet"""
+    with usage_lock:
+        pending = {k["key"]: pending_usage[k["key"]] for k in api_keys if k["key"] in pending_usage}
+    if not pending:
+        return api_keys
+
+    result = []
+    for key in api_keys:
+        if key["key"] in pending:
+            count, last_used = pending[key["key"]]
+            key = {**key, "use_count": key["use_count"] + count, "last_used": last_used}
+        result.append(key)
+    return result
+
+def flush_usage() -> int:
+    """Write accumulated key usage with one update per user; returns keys flushed"""
+    with usage_lock:
+        pending = dict(pending_usage)
+        pending_usage.clear()
+    if not pending:
+        return 0
+
+    by_wallet: Dict[str, Dict[str, Tuple[int, str]]] = {}
+    for api_key, usage in pending.items():
+        entry = find_api_key(api_key)
+        if entry:  # Keys deleted since they were used are dropped
+            by_wallet.setdefault(entry[0], {})[api_key] = usage
+
+    for wallet_address, usage in by_wallet.items():
+        try:
+            with users_lock:
+                user = get_user(wallet_address)
+                if not user:
+                    continue
+                for key in user["api_keys"]:
+                    if key["key"] in usage:
+                        count, last_used = usage[key["key"]]
+                        key["use_count"] += count
+                        key["last_used"] = last_used
+                users_table.update({"api_keys": user["api_keys"]}, wallet_address=wallet_address)
+        except Exception as e:
+            logger.error(f"Failed to flush API key usage for {wallet_address}: {str(e)}")
+            # Put the counts back so the next flush retries them
+            with usage_lock:
+                for api_key, (count, last_used) in usage.items():
+                    pending_count, pending_last_used = pending_usage.get(api_key, (0, last_used))
+                    pending_usage[api_key] = (count + pending_count, max(last_used, pending_last_used))
+
+    return sum(len(usage) for usage in by_wallet.values())
+
+async def flush_usage_periodically():
+    while True:
+        await asyncio.sleep(USAGE_FLUSH_INTERVAL)
+        await asyncio.to_thread(flush_usage)
+
+def notify_key_deleted(api_key: str):
+    """Tell the gateways to drop a deleted key from their verification caches"""
+    for url in KEY_INVALIDATION_URLS:
+        try:
+            req = urllib.request.Request(
+                url,
+                data=json.dumps({"key": api_key}).encode(),
+                headers={"Content-Type": "application/json"},
+                method="POST",
+            )
+            urllib.request.urlopen(req, timeout=5).close()
+        except Exception as e:
+            logger.warning(f"Failed to invalidate API key at {url}: {str(e)}")
+
+# Build the key index on startup
+build_api_key_index()
 
 # Routes
 @app.get("/")
@@ -63,49 +207,55 @@ def health_check():
 
 @app.post("/auth")
 def authenticate(wallet: WalletRequest):
-    existing_user = get_user(wallet.wallet_address)
-    if existing_user:
-        return {"session_id": existing_user["session_id"]}
-
-    session_id = str(uuid4())
-    users_table.insert({
-        "wallet_address": wallet.wallet_address,
-        "session_id": session_id,
-        "created_at": datetime.utcnow().isoformat(),
-        "api_keys": []
-    })
+    with users_lock:
+        existing_user = get_user(wallet.wallet_address)
+        if existing_user:
+            return {"session_id": existing_user["session_id"]}
+
+        session_id = str(uuid4())
+        users_table.insert({
+            "wallet_address": wallet.wallet_address,
+            "session_id": session_id,
+            "created_at": datetime.utcnow().isoformat(),
+            "api_keys": []
+        })
     return {"session_id": session_id}
 
 @app.post("/apikeys/add")
 def add_api_key(req: APIKeyRequest):
-    UserQ = Query()
-    user = get_user(req.wallet_address)
-    if not user:
-        raise HTTPException(status_code=404, detail="Wallet not found. Authenticate first.")
-
-    api_key = {
-        "name": req.name,
-        "key": uuid4().hex,
-        "created_at": datetime.utcnow().isoformat(),
-        "last_used": None,
-        "use_count": 0
-    }
-    user["api_keys"].append(api_key)
-    users_table.update({"api_keys": user["api_keys"]}, UserQ.wallet_address == req.wallet_address)
+    with users_lock:
+        user = get_user(req.wallet_address)
+        if not user:
+            raise HTTPException(status_code=404, detail="Wallet not found. Authenticate first.")
+
+        api_key = {
+            "name": req.name,
+            "key": uuid4().hex,
+            "created_at": datetime.utcnow().isoformat(),
+            "last_used": None,
+            "use_count": 0
+        }
+        user["api_keys"].append(api_key)
+        users_table.update({"api_keys": user["api_keys"]}, wallet_address=req.wallet_address)
+        api_key_index[api_key["key"]] = (req.wallet_address, api_key)
+        keys_changed.bump()
     return {"message": "API key added", "key": api_key["key"]}
 
 @app.post("/apikeys/delete")
-def delete_api_key(req: DeleteAPIKeyRequest):
-    UserQ = Query()
-    user = get_user(req.wallet_address)
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found.")
+def delete_api_key(req: DeleteAPIKeyRequest, background_tasks: BackgroundTasks):
+    with users_lock:
+        user = get_user(req.wallet_address)
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found.")
 
-    filtered_keys = [k for k in user["api_keys"] if k["key"] != req.key]
-    if len(filtered_keys) == len(user["api_keys"]):
-        raise HTTPException(status_code=404, detail="API key not found.")
+        filtered_keys = [k for k in user["api_keys"] if k["key"] != req.key]
+        if len(filtered_keys) == len(user["api_keys"]):
+            raise HTTPException(status_code=404, detail="API key not found.")
 
-    users_table.update({"api_keys": filtered_keys}, UserQ.wallet_address == req.wallet_address)
+        users_table.update({"api_keys": filtered_keys}, wallet_address=req.wallet_address)
+        api_key_index.pop(req.key, None)
+        keys_changed.bump()
+    background_tasks.add_task(notify_key_deleted, req.key)
     return {"message": "API key deleted"}
 
 @app.get("/apikeys/{wallet_address}")
@@ -113,48 +263,53 @@ def list_api_keys(wallet_address: str):
     user = get_user(wallet_address)
     if not user:
         raise HTTPException(status_code=404, detail="User not found.")
-    return user["api_keys"]
+    # Include usage that hasn't been flushed to the DB yet
+    return apply_pending_usage(user["api_keys"])
 
 @app.post("/apikeys/use")
 def use_api_key(req: UseAPIKeyRequest):
-    UserQ = Query()
-    all_users = users_table.all()
-    for user in all_users:
-        for key in user["api_keys"]:
-            if key["key"] == req.key:
-                key["use_count"] += 1
-                key["last_used"] = datetime.utcnow().isoformat()
-                users_table.update({"api_keys": user["api_keys"]}, UserQ.wallet_address == user["wallet_address"])
-                return {
-                    "message": "Usage recorded",
-                    "name": key["name"],
-                    "wallet_address": user["wallet_address"]
-                }
-    raise HTTPException(status_code=404, detail="Invalid API key.")
+    if req.count < 1:
+        raise HTTPException(status_code=400, detail="Count must be positive.")
+    entry = record_key_usage(req.key, req.count, req.last_used)
+    if not entry:
+        raise HTTPException(status_code=404, detail="Invalid API key.")
+
+    wallet_address, key = entry
+    return {
+        "message": "Usage recorded",
+        "name": key["name"],
+        "wallet_address": wallet_address
+    }
+
+# Usage of many keys in one call, from gateways that verified them from their
+# cache. Unknown (e.g. since deleted) keys are skipped and listed.
+@app.post("/apikeys/use/batch")
+def use_api_keys(req: KeyUsageBatch):
+    recorded, unknown = 0, []
+    for usage in req.usage:
+        if usage.count < 1:
+            continue
+        if record_key_usage(usage.key, usage.count, usage.last_used):
+            recorded += 1
+        else:
+            unknown.append(usage.key)
+    return {"recorded": recorded, "unknown": unknown}
 
 @app.get("/verify")
 def verify_api_key(x_api_key: str = Header(..., alias="X-API-Key")):
-    # Look for a user with the given API key
-    all_users = users_table.all()
-    for user in all_users:
-        for key in user["api_keys"]:
-            if key["key"] == x_api_key:
-                # Update key usage
-                UserQ = Query()
-                key["use_count"] += 1
-                key["last_used"] = datetime.utcnow().isoformat()
-                users_table.update({"api_keys": user["api_keys"]}, UserQ.wallet_address == user["wallet_address"])
-                
-                # Return user data
-                return {
-                    "name": key["name"],
-                    "wallet_address": user["wallet_address"],
-                    "uuid": user["wallet_address"],  # Using wallet address as UUID
-                    "valid": True
-                }
-    
-    # If no matching API key is found
-    raise HTTPException(status_code=401, detail="Invalid API key")
+    # Look up the key in the index and update its usage
+    entry = record_key_usage(x_api_key)
+    if not entry:
+        # If no matching API key is found
+        raise HTTPException(status_code=401, detail="Invalid API key")
+
+    wallet_address, key = entry
+    return {
+        "name": key["name"],
+        "wallet_address": wallet_address,
+        "uuid": wallet_address,  # Using wallet address as UUID
+        "valid": True
+    }
 
 if __name__ == "__main__":
     import uvicorn
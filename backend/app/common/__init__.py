@@ -0,0 +1 @@
+# Common module initialization file
\ No newline at end of file
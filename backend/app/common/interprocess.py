@@ -0,0 +1,98 @@
+"""
+Coordination between worker processes of one service (uvicorn --workers N).
+
+``FileLock`` serializes a critical section across threads and processes with
+an ``flock`` on a lock file next to the data it protects. ``ChangeMarker``
+lets one process tell the others that shared data changed, so they can drop
+what they built from it in memory.
+
+Both need ``fcntl`` (Linux, macOS). Where it is missing the lock only covers
+threads of one process, so services must run with a single worker there.
+"""
+import os
+import threading
+import uuid
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+class FileLock:
+    """Reentrant lock held across threads and across processes sharing `path`"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+
+    def acquire(self, blocking: bool = True) -> bool:
+        if not self._thread_lock.acquire(blocking):
+            return False
+        if self._depth == 0 and fcntl is not None:
+            if self._fd is None:
+                self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(self._fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                self._thread_lock.release()
+                return False
+        self._depth += 1
+        return True
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0 and fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class ChangeMarker:
+    """A file rewritten on every change; other processes notice it by stat"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._seen = self._stamp()
+        # Another process's change that was pending when this one bumped
+        self._missed = False
+
+    def _stamp(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        # A replaced file gets a new inode even within one mtime tick
+        return stat.st_ino, stat.st_mtime_ns
+
+    def bump(self):
+        """Record a change for the other processes to see on their next changed().
+
+        This process's own changed() doesn't report it: the caller has already
+        updated what it built in memory. Bumps must be serialized across
+        processes (e.g. under a FileLock), or one made between this process's
+        last check and its bump could go unnoticed here.
+        """
+        self._missed = self._missed or self._stamp() != self._seen
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(uuid.uuid4().hex)
+        os.replace(tmp_path, self.path)
+        self._seen = self._stamp()
+
+    def changed(self) -> bool:
+        """Whether another process bumped the marker since the last call"""
+        stamp = self._stamp()
+        if stamp == self._seen and not self._missed:
+            return False
+        self._seen = stamp
+        self._missed = False
+        return True
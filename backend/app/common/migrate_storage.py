@@ -0,0 +1,61 @@
+"""
+One-shot migration of TinyDB JSON databases into SQLite storage.
+
+Each JSON file (auth_db.json, escrow.json, api_calls.json, ...) is imported
+into a sibling .db file, keeping table names and document ids. Indexes are
+created by the services themselves the next time they open the database
+with STORAGE_BACKEND=sqlite.
+
+Usage:
+    python backend/app/common/migrate_storage.py backend/app/auth/auth_db.json \\
+        backend/app/solana/escrow.json backend/app/api/api_calls.json
+"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.storage import SQLiteStorage, storage_path
+
+
+def migrate(json_path: str, force: bool = False) -> str:
+    """Import one TinyDB JSON file into SQLite and return the new path"""
+    db_path = storage_path(json_path, "sqlite")
+    if os.path.exists(db_path):
+        if not force:
+            raise SystemExit(f"{db_path} already exists (use --force to overwrite)")
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(db_path + suffix):
+                os.remove(db_path + suffix)
+
+    with open(json_path) as f:
+        data = json.load(f) if os.path.getsize(json_path) else {}
+
+    storage = SQLiteStorage(db_path)
+    with storage.lock:
+        for name, docs in data.items():
+            storage.table(name)
+            storage.execute("BEGIN")
+            for doc_id, doc in sorted(docs.items(), key=lambda item: int(item[0])):
+                storage.execute(
+                    f'INSERT INTO "{name}" (id, doc) VALUES (?, ?)', [int(doc_id), json.dumps(doc)]
+                )
+            storage.commit()
+            print(f"{json_path}: {len(docs)} documents -> {db_path}:{name}")
+    storage.close()
+    return db_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="+", help="TinyDB JSON files to migrate")
+    parser.add_argument("--force", action="store_true", help="Overwrite existing .db files")
+    args = parser.parse_args()
+
+    for json_path in args.files:
+        migrate(json_path, force=args.force)
+
+
+if __name__ == "__main__":
+    main()
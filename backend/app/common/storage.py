@@ -0,0 +1,388 @@
+"""
+Pluggable document storage shared by the auth, escrow and gateway services.
+
+Tables hold plain dict documents and are queried by field equality, e.g.
+``users.get(wallet_address=addr)`` or ``tx.search(user_id=uid)``. ``page``
+returns matching documents in descending order of some fields, a limited
+number at a time.
+
+Two engines are available, selected with the ``STORAGE_BACKEND`` env var:
+
+- ``tinydb`` (default): the original JSON file storage.
+- ``sqlite``: one SQLite database in WAL mode with an expression index on
+  each declared field (or tuple of fields, for ``page``), so lookups and
+  writes don't touch the whole file.
+
+Both can be shared by several worker processes: TinyDB operations hold an
+``flock`` on ``<path>.lock`` and re-read the file, and SQLite updates run in
+``BEGIN IMMEDIATE`` transactions.
+
+Every table operation is timed into ``storage_operation_duration_seconds``.
+"""
+import json
+import os
+import sqlite3
+import threading
+from functools import reduce, wraps
+from operator import and_
+from typing import Dict, Iterable, List, Optional, Sequence, Union
+
+from tinydb import TinyDB, where
+
+from common.interprocess import FileLock
+from common.metrics import histogram
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "tinydb")
+# Seconds a SQLite write waits for another process's transaction
+SQLITE_BUSY_TIMEOUT = float(os.getenv("SQLITE_BUSY_TIMEOUT", "30"))
+
+STORAGE_SECONDS = histogram(
+    "storage_operation_duration_seconds", "Table operations, including waiting for the storage lock",
+    ("backend", "table", "operation")
+)
+
+
+def _timed(method):
+    """Record a table method's duration under its name"""
+
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with STORAGE_SECONDS.time(backend=self.backend, table=self.name, operation=method.__name__):
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
+
+class TinyDBTable:
+    """Table backed by a TinyDB table"""
+
+    backend = "tinydb"
+
+    def __init__(self, table, lock=None):
+        self._table = table
+        self.name = table.name
+        # TinyDB rewrites the whole file on each write, so concurrent writers
+        # from the threadpool and other workers must not interleave
+        self._lock = lock or threading.RLock()
+
+    def _cond(self, fields: dict):
+        return reduce(and_, (where(k) == v for k, v in fields.items()))
+
+    @_timed
+    def insert(self, doc: dict) -> int:
+        with self._lock:
+            # TinyDB caches the next document id; another process may have used it
+            self._table._next_id = None
+            return self._table.insert(doc)
+
+    @_timed
+    def insert_multiple(self, docs: Iterable[dict]) -> List[int]:
+        with self._lock:
+            self._table._next_id = None
+            return self._table.insert_multiple(docs)
+
+    @_timed
+    def get(self, **fields) -> Optional[dict]:
+        with self._lock:
+            return self._table.get(self._cond(fields))
+
+    @_timed
+    def search(self, **fields) -> List[dict]:
+        with self._lock:
+            return self._table.search(self._cond(fields))
+
+    @_timed
+    def page(self, order_by: Sequence[str], limit: int, before: Optional[tuple] = None,
+             start=None, end=None, **fields) -> List[dict]:
+        """Up to `limit` matching documents, last first by the `order_by` fields.
+
+        Only documents whose `order_by` values sort below `before` are
+        returned, and `start`/`end` bound the first field inclusively.
+        """
+        with self._lock:
+            docs = self._table.search(self._cond(fields))
+        first = order_by[0]
+        docs = [doc for doc in docs
+                if (start is None or doc[first] >= start) and (end is None or doc[first] <= end)
+                and (before is None or tuple(doc[key] for key in order_by) < tuple(before))]
+        docs.sort(key=lambda doc: tuple(doc[key] for key in order_by), reverse=True)
+        return docs[:limit]
+
+    @_timed
+    def update(self, values: dict, **fields) -> int:
+        with self._lock:
+            return len(self._table.update(values, self._cond(fields)))
+
+    @_timed
+    def upsert_multiple(self, docs: Iterable[dict], key: str) -> int:
+        """Update the document with each doc's `key` value, or insert the doc, in one file write"""
+        by_key = {doc[key]: doc for doc in docs}
+        if not by_key:
+            return 0
+
+        def updater(table: dict):
+            missing = dict(by_key)
+            for stored in table.values():
+                doc = missing.pop(stored.get(key), None)
+                if doc is not None:
+                    stored.update(doc)
+            next_id = max(table, default=0) + 1
+            for doc in missing.values():
+                table[next_id] = dict(doc)
+                next_id += 1
+
+        with self._lock:
+            # One read and one write of the file, however many documents change
+            self._table._update_table(updater)
+            self._table._next_id = None
+        return len(by_key)
+
+    @_timed
+    def remove(self, **fields) -> int:
+        with self._lock:
+            return len(self._table.remove(self._cond(fields)))
+
+    @_timed
+    def all(self) -> List[dict]:
+        with self._lock:
+            return self._table.all()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._table)
+
+
+class TinyDBStorage:
+    """The original TinyDB JSON storage; indexes are ignored"""
+
+    def __init__(self, path: str, indexes: Optional[Dict[str, List[Union[str, tuple]]]] = None):
+        self.path = path
+        self.lock = FileLock(path + ".lock")
+        self._db = TinyDB(path)
+
+    def table(self, name: str) -> TinyDBTable:
+        # No query cache: it isn't cleared by other processes' writes
+        return TinyDBTable(self._db.table(name, cache_size=0), self.lock)
+
+    def close(self):
+        self._db.close()
+
+
+class SQLiteTable:
+    """Table stored as JSON documents in a SQLite table"""
+
+    backend = "sqlite"
+
+    def __init__(self, storage: "SQLiteStorage", name: str):
+        self._storage = storage
+        self._name = name
+        self.name = name
+
+    def _where(self, fields: dict):
+        clauses = []
+        params = []
+        for key, value in fields.items():
+            if value is None:
+                clauses.append(f"json_extract(doc, '$.{key}') IS NULL")
+            else:
+                clauses.append(f"json_extract(doc, '$.{key}') = ?")
+                params.append(value)
+        return " AND ".join(clauses), params
+
+    def _select(self, fields: dict, limit: Optional[int] = None):
+        sql = f'SELECT id, doc FROM "{self._name}"'
+        params = []
+        if fields:
+            where_sql, params = self._where(fields)
+            sql += f" WHERE {where_sql}"
+        sql += " ORDER BY id"
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        return self._storage.execute(sql, params).fetchall()
+
+    @_timed
+    def insert(self, doc: dict) -> int:
+        with self._storage.lock:
+            cursor = self._storage.execute(
+                f'INSERT INTO "{self._name}" (doc) VALUES (?)', [json.dumps(doc)]
+            )
+            self._storage.commit()
+            return cursor.lastrowid
+
+    @_timed
+    def insert_multiple(self, docs: Iterable[dict]) -> List[int]:
+        with self._storage.lock:
+            ids = []
+            for doc in docs:
+                cursor = self._storage.execute(
+                    f'INSERT INTO "{self._name}" (doc) VALUES (?)', [json.dumps(doc)]
+                )
+                ids.append(cursor.lastrowid)
+            self._storage.commit()
+            return ids
+
+    @_timed
+    def get(self, **fields) -> Optional[dict]:
+        with self._storage.lock:
+            rows = self._select(fields, limit=1)
+        return json.loads(rows[0][1]) if rows else None
+
+    @_timed
+    def search(self, **fields) -> List[dict]:
+        with self._storage.lock:
+            rows = self._select(fields)
+        return [json.loads(doc) for _, doc in rows]
+
+    @_timed
+    def page(self, order_by: Sequence[str], limit: int, before: Optional[tuple] = None,
+             start=None, end=None, **fields) -> List[dict]:
+        """Up to `limit` matching documents, last first by the `order_by` fields.
+
+        Only documents whose `order_by` values sort below `before` are
+        returned, and `start`/`end` bound the first field inclusively. An
+        index on the `fields` followed by the `order_by` fields serves it.
+        """
+        where_sql, params = self._where(fields) if fields else ("1", [])
+        columns = [f"json_extract(doc, '$.{key}')" for key in order_by]
+        if start is not None:
+            where_sql += f" AND {columns[0]} >= ?"
+            params.append(start)
+        if end is not None:
+            where_sql += f" AND {columns[0]} <= ?"
+            params.append(end)
+        if before is not None:
+            where_sql += f" AND ({', '.join(columns)}) < ({', '.join('?' * len(columns))})"
+            params.extend(before)
+        order_sql = ", ".join(f"{column} DESC" for column in columns)
+        with self._storage.lock:
+            rows = self._storage.execute(
+                f'SELECT doc FROM "{self._name}" WHERE {where_sql} ORDER BY {order_sql} LIMIT {int(limit)}',
+                params
+            ).fetchall()
+        return [json.loads(doc) for doc, in rows]
+
+    @_timed
+    def update(self, values: dict, **fields) -> int:
+        with self._storage.lock:
+            # Take the write lock before reading, so another process can't
+            # change the documents between the read and the write
+            self._storage.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._select(fields)
+                for row_id, doc in rows:
+                    doc = json.loads(doc)
+                    doc.update(values)
+                    self._storage.execute(
+                        f'UPDATE "{self._name}" SET doc = ? WHERE id = ?', [json.dumps(doc), row_id]
+                    )
+                self._storage.commit()
+            except Exception:
+                self._storage.rollback()
+                raise
+            return len(rows)
+
+    @_timed
+    def upsert_multiple(self, docs: Iterable[dict], key: str) -> int:
+        """Update the document with each doc's `key` value, or insert the doc, in one transaction"""
+        docs = list(docs)
+        with self._storage.lock:
+            self._storage.execute("BEGIN IMMEDIATE")
+            try:
+                for doc in docs:
+                    rows = self._select({key: doc[key]}, limit=1)
+                    if rows:
+                        row_id, stored = rows[0]
+                        stored = json.loads(stored)
+                        stored.update(doc)
+                        self._storage.execute(
+                            f'UPDATE "{self._name}" SET doc = ? WHERE id = ?', [json.dumps(stored), row_id]
+                        )
+                    else:
+                        self._storage.execute(
+                            f'INSERT INTO "{self._name}" (doc) VALUES (?)', [json.dumps(doc)]
+                        )
+                self._storage.commit()
+            except Exception:
+                self._storage.rollback()
+                raise
+        return len(docs)
+
+    @_timed
+    def remove(self, **fields) -> int:
+        with self._storage.lock:
+            where_sql, params = self._where(fields)
+            cursor = self._storage.execute(f'DELETE FROM "{self._name}" WHERE {where_sql}', params)
+            self._storage.commit()
+            return cursor.rowcount
+
+    @_timed
+    def all(self) -> List[dict]:
+        with self._storage.lock:
+            rows = self._select({})
+        return [json.loads(doc) for _, doc in rows]
+
+    def __len__(self):
+        with self._storage.lock:
+            return self._storage.execute(f'SELECT COUNT(*) FROM "{self._name}"').fetchone()[0]
+
+
+class SQLiteStorage:
+    """SQLite storage in WAL mode with per-field expression indexes"""
+
+    def __init__(self, path: str, indexes: Optional[Dict[str, List[Union[str, tuple]]]] = None):
+        self.path = path
+        self.indexes = indexes or {}
+        self.lock = threading.RLock()
+        self._conn = sqlite3.connect(path, timeout=SQLITE_BUSY_TIMEOUT, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._tables: Dict[str, SQLiteTable] = {}
+
+    def execute(self, sql: str, params: Iterable = ()):
+        return self._conn.execute(sql, list(params))
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def table(self, name: str) -> SQLiteTable:
+        if name not in self._tables:
+            with self.lock:
+                self.execute(
+                    f'CREATE TABLE IF NOT EXISTS "{name}" '
+                    "(id INTEGER PRIMARY KEY AUTOINCREMENT, doc TEXT NOT NULL)"
+                )
+                for fields in self.indexes.get(name, []):
+                    fields = (fields,) if isinstance(fields, str) else fields
+                    columns = ", ".join(f"json_extract(doc, '$.{field}')" for field in fields)
+                    self.execute(
+                        f'CREATE INDEX IF NOT EXISTS "{name}_{"_".join(fields)}" ON "{name}" ({columns})'
+                    )
+                self.commit()
+            self._tables[name] = SQLiteTable(self, name)
+        return self._tables[name]
+
+    def close(self):
+        self._conn.close()
+
+
+BACKENDS = {
+    "tinydb": TinyDBStorage,
+    "sqlite": SQLiteStorage,
+}
+
+
+def storage_path(path: str, backend: str = STORAGE_BACKEND) -> str:
+    """Map a service's JSON database path to the file the backend uses"""
+    if backend == "sqlite" and path.endswith(".json"):
+        return path[: -len(".json")] + ".db"
+    return path
+
+
+def open_storage(path: str, indexes: Optional[Dict[str, List[Union[str, tuple]]]] = None, backend: str = STORAGE_BACKEND):
+    """Open the storage selected by STORAGE_BACKEND for a service database"""
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown storage backend: {backend}")
+    return BACKENDS[backend](storage_path(path, backend), indexes)
@@ -1,13 +1,41 @@
-from fastapi import FastAPI, HTTPException, Header
+from fastapi import FastAPI, HTTPException, Header, Query
 from pydantic import BaseModel
-from tinydb import TinyDB, Query
 from fastapi.middleware.cors import CORSMiddleware
+from contextlib import asynccontextmanager
+import asyncio
+import logging
 import os
+import sys
+import threading
 import uvicorn
-from datetime import datetime
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
 import uuid
 
-app = FastAPI()
+# Shared backend modules live in backend/app/common
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.interprocess import FileLock
+from common.metrics import instrument_app
+from common.storage import open_storage
+from ledger import InsufficientFunds, Ledger
+from spend_batcher import SpendBatcher
+from rollups import PERIODS, Rollups
+
+logger = logging.getLogger(__name__)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    projector = asyncio.create_task(project_ledger_periodically())
+    expirer = asyncio.create_task(expire_reservations_periodically())
+    yield
+    expirer.cancel()
+    projector.cancel()
+    project_ledger()
+    if is_projector:
+        ledger.snapshot()
+    ledger.close()
+
+app = FastAPI(lifespan=lifespan)
 
 # Enable CORS
 app.add_middleware(
@@ -18,51 +46,301 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Request counts and per-route latency at /metrics
+instrument_app(app, "escrow")
+
 # Test endpoint for connectivity checks
 @app.get("/test")
 def test_connection():
     return {"status": "ok", "message": "API is working"}
 
-# TinyDB setup
+# Storage setup (TinyDB or SQLite, see STORAGE_BACKEND)
 db_path = os.getenv("DATABASE_PATH", "./escrow.json")
-db = TinyDB(db_path)
-escrow_table = db.table('user_escrow')
+db = open_storage(db_path, indexes={
+    'user_escrow': ['user_id'],
+    # (user_id, timestamp, id) serves wallet history pages
+    'transactions': ['user_id', 'id', ('user_id', 'timestamp', 'id')],
+    'agent_usage': ['agent_id'],
+    'reservations': ['id', 'status'],
+    'rollups': ['key'],
+})
+escrow_table = db.table('user_escrow')  # Balances from before the ledger, imported into a new ledger
 transactions_table = db.table('transactions')
 agent_usage_table = db.table('agent_usage')  # Store agent usage in same DB for simplicity
+reservations_table = db.table('reservations')  # Credit blocks reserved by the gateway
+rollups_table = db.table('rollups')  # Hourly/daily spend and deposit totals
+
+# Balances live in an append-only ledger (see ledger.py) in LEDGER_DIR. The
+# transactions table and agent usage counts are written from it in batches
+# every LEDGER_FLUSH_INTERVAL seconds. With several workers, each one follows
+# the ledger for the others' entries, and one of them (the projector) does
+# all the writing to storage.
+LEDGER_DIR = os.getenv("LEDGER_DIR", os.path.splitext(db_path)[0] + "_ledger")
+LEDGER_FLUSH_INTERVAL = float(os.getenv("LEDGER_FLUSH_INTERVAL", "1.0"))
+ledger = Ledger(
+    LEDGER_DIR,
+    fsync=os.getenv("LEDGER_FSYNC", "true").lower() == "true",
+    snapshot_every=int(os.getenv("LEDGER_SNAPSHOT_EVERY", "10000")),
+)
+projection_lock = threading.Lock()
+projector_lock = FileLock(os.path.join(LEDGER_DIR, "projector.lock"))
+is_projector = False
+# Set when a projector takes over, since its predecessor may have stopped
+# between writing transactions and recording how far it got
+check_stored_transactions = True
+
+# Concurrent /spend and /charge requests are committed to the ledger together:
+# a batch closes after SPEND_BATCH_MAX_WAIT_MS or at SPEND_BATCH_MAX_SIZE spends
+spend_batcher = SpendBatcher(
+    ledger,
+    max_batch=int(os.getenv("SPEND_BATCH_MAX_SIZE", "256")),
+    max_wait=float(os.getenv("SPEND_BATCH_MAX_WAIT_MS", "2")) / 1000,
+) if os.getenv("SPEND_BATCHING_ENABLED", "true").lower() == "true" else None
+
+# Spend/deposit rollups per user and agent, kept in memory and written to
+# rollups_table with each batch of ledger entries the projector writes
+rollups = Rollups(rollups_table)
+
+# Per-user locks for reserve, which reads the balance before deciding what to
+# append; plain debits are checked atomically by the ledger
+user_locks: Dict[str, threading.Lock] = {}
+user_locks_guard = threading.Lock()
+
+# Usage counts per agent, kept in memory and written with the ledger projection
+agent_usage: Dict[str, int] = {}
+dirty_agents = set()
+agent_usage_lock = threading.Lock()
+
+# Serializes settlements across workers, so a reservation is refunded only once
+reservations_lock = FileLock(os.path.join(LEDGER_DIR, "reservations.lock"))
+
+# A reservation expires RESERVATION_TTL seconds after it's made (or after the
+# ttl the gateway asks for). Open reservations still unsettled
+# RESERVATION_EXPIRY_GRACE seconds after that, e.g. because the gateway that
+# made them crashed, are released in full by the projector, which checks
+# every RESERVATION_EXPIRY_INTERVAL seconds.
+RESERVATION_TTL = float(os.getenv("RESERVATION_TTL", "60"))
+RESERVATION_EXPIRY_GRACE = float(os.getenv("RESERVATION_EXPIRY_GRACE", "300"))
+RESERVATION_EXPIRY_INTERVAL = float(os.getenv("RESERVATION_EXPIRY_INTERVAL", "30"))
+
+def user_lock(user_id: str) -> threading.Lock:
+    """Get the lock serializing balance changes for a user"""
+    with user_locks_guard:
+        if user_id not in user_locks:
+            user_locks[user_id] = threading.Lock()
+        return user_locks[user_id]
+
+def new_transaction(user_id: str, amount: float, tx_type: str, agent_id: str = None) -> dict:
+    transaction = {'id': str(uuid.uuid4()), 'user_id': user_id, 'amount': amount, 'type': tx_type,
+                   'timestamp': datetime.now().isoformat()}
+    if agent_id:
+        transaction['agent_id'] = agent_id
+    return transaction
+
+def rollup_records(entry: dict) -> List[dict]:
+    """What a ledger entry adds to the rollups, as Rollups.record arguments"""
+    records = []
+    transaction = entry.get('tx')
+    if transaction and transaction['type'] in ('deposit', 'spent'):
+        records.append({'user_id': transaction['user_id'], 'tx_type': transaction['type'],
+                        'amount': transaction['amount'], 'agent_id': transaction.get('agent_id'),
+                        'at': datetime.fromisoformat(transaction['timestamp'])})
+    settles = entry.get('settles')
+    # Usage charged from a reservation counts as spend
+    if settles and settles['used'] > 0:
+        records.append({'user_id': entry['user_id'], 'tx_type': 'spent', 'amount': settles['used'],
+                        'count': settles['requests'], 'agent_counts': settles['agent_usage'],
+                        'at': datetime.fromisoformat(settles['settled_at'])})
+    return records
+
+def record_rollups(entry: dict):
+    """Add a committed ledger entry to the in-memory rollups"""
+    for record in rollup_records(entry):
+        rollups.record(**record)
+
+def commit(user_id: str, delta: float, transaction: Optional[dict] = None, check_funds: bool = False,
+           **details) -> dict:
+    """Apply a balance change through the ledger (durable on return) and add it to the rollups"""
+    entry = ledger.append(user_id, delta, check_funds=check_funds, tx=transaction, **details)
+    record_rollups(entry)
+    return entry
+
+# Helper function to update agent usage count
+def update_agent_usage(agent_id: str, count: int = 1):
+    """Update the usage count for an agent"""
+    if not agent_id:
+        return 0
+    
+    with agent_usage_lock:
+        agent_usage[agent_id] = agent_usage.get(agent_id, 0) + count
+        dirty_agents.add(agent_id)
+        return agent_usage[agent_id]
+
+def record_agent_usage(entry: dict):
+    """Count a ledger entry's spend, or the usage charged from a reservation it settles, per agent"""
+    transaction = entry.get('tx')
+    if transaction and transaction['type'] == 'spent':
+        update_agent_usage(transaction.get('agent_id'))
+    settles = entry.get('settles')
+    if settles:
+        for agent_id, count in settles['agent_usage'].items():
+            update_agent_usage(agent_id, count)
+
+def apply_followed_entry(entry: dict):
+    """Add a ledger entry appended by another worker to this worker's rollups and usage"""
+    record_rollups(entry)
+    record_agent_usage(entry)
+
+ledger.on_entry = apply_followed_entry
+
+def claim_projection() -> bool:
+    """Become the projector if no other worker is; returns whether this worker is it"""
+    global is_projector, check_stored_transactions
+    if not is_projector and projector_lock.acquire(blocking=False):
+        is_projector = True
+        check_stored_transactions = True
+        # Rollups are written from where the previous projector's last batch ended
+        rollups.load_stored()
+        # The previous projector may not have written everything this worker knows
+        with agent_usage_lock:
+            dirty_agents.update(agent_usage)
+        logger.info("This worker is now writing the ledger to storage")
+    return is_projector
+
+def unstored_transactions(transactions: List[dict]) -> List[dict]:
+    """The transactions that aren't in the transactions table yet"""
+    stored = set()
+    for user_id in {transaction['user_id'] for transaction in transactions}:
+        stored.update(transaction['id'] for transaction in transactions_table.search(user_id=user_id))
+    return [transaction for transaction in transactions if transaction['id'] not in stored]
 
-# Helper function to record transactions
-def record_transaction(user_id: str, amount: float, tx_type: str):
-    tx_id = str(uuid.uuid4())
-    timestamp = datetime.now().isoformat()
-    transactions_table.insert({
-        'id': tx_id,
-        'user_id': user_id,
-        'amount': amount,
-        'type': tx_type,
-        'timestamp': timestamp
-    })
-    return {'id': tx_id, 'user_id': user_id, 'amount': amount, 'type': tx_type, 'timestamp': timestamp}
+def flush_agent_usage():
+    with agent_usage_lock:
+        counts = {agent_id: agent_usage[agent_id] for agent_id in dirty_agents}
+        dirty_agents.clear()
+    for agent_id, count in counts.items():
+        if not agent_usage_table.update({"usage_count": count}, agent_id=agent_id):
+            agent_usage_table.insert({"agent_id": agent_id, "usage_count": count})
+
+def project_ledger() -> int:
+    """Write durable ledger entries' transactions, agent usage and rollups to storage in one batch"""
+    global check_stored_transactions
+    if not claim_projection():
+        # Another worker writes them; just stop holding on to what it has written
+        ledger.forget_released()
+        return 0
+    with projection_lock:
+        entries = ledger.pending()
+        transactions = [entry['tx'] for entry in entries if entry.get('tx')]
+        if transactions and check_stored_transactions:
+            transactions = unstored_transactions(transactions)
+        # If this batch fails part way, the retry must skip what it stored
+        check_stored_transactions = True
+        if transactions:
+            transactions_table.insert_multiple(transactions)
+        flush_agent_usage()
+        # Rollups record the last entry they include, so they are written
+        # before the batch is released and never miss or repeat an entry
+        unrolled = [entry for entry in entries if rollups.stored_seq is None or entry['seq'] > rollups.stored_seq]
+        if unrolled:
+            rollups.write([record for entry in unrolled for record in rollup_records(entry)], unrolled[-1]['seq'])
+        ledger.release(entries)
+        check_stored_transactions = False
+    if ledger.needs_snapshot():
+        ledger.snapshot()
+    return len(entries)
+
+async def project_ledger_periodically():
+    while True:
+        await asyncio.sleep(LEDGER_FLUSH_INTERVAL)
+        try:
+            await asyncio.to_thread(project_ledger)
+        except Exception as e:
+            logger.error(f"Failed to write ledger entries to storage: {str(e)}")
+
+def recover_ledger(entries: List[dict], released_seq: int, rollups_seq: int):
+    """Apply ledger entries that storage missed because the service stopped before writing them.
+
+    Entries after `rollups_seq` (the last one in the stored rollups) are
+    added to the in-memory rollups. Entries after `released_seq` (the last
+    one projected) are added to agent usage, skipping transactions that did
+    reach storage; the projector writes them out with its next batch. The
+    projector also restores reservation rows, matched by id and status.
+    """
+    for entry in entries:
+        if entry['seq'] > rollups_seq:
+            record_rollups(entry)
+
+    entries_after = [entry for entry in entries if entry['seq'] > released_seq]
+    unstored = {transaction['id'] for transaction in
+                unstored_transactions([entry['tx'] for entry in entries_after if entry.get('tx')])}
+    recovered = 0
+    for entry in entries_after:
+        if entry.get('tx') and entry['tx']['id'] not in unstored:
+            continue
+        record_agent_usage(entry)
+        recovered += 1
+
+    if is_projector:
+        for entry in entries:
+            reservation = entry.get('reservation')
+            if reservation and not reservations_table.get(id=reservation['id']):
+                reservations_table.insert(reservation)
+            settles = entry.get('settles')
+            if settles:
+                stored = reservations_table.get(id=settles['id'])
+                if stored and stored['status'] == 'open':
+                    reservations_table.update({'used': settles['used'], 'status': settles.get('status', 'settled'),
+                                               'settled_at': settles['settled_at']}, id=settles['id'])
+    if recovered:
+        logger.info(f"Recovered {recovered} ledger entries missing from storage")
+
+def load_rollups(entries: List[dict], released_seq: int) -> int:
+    """Load persisted rollups, backfilling them from transactions the first time.
+
+    Returns the seq of the last ledger entry they include. Rollups written
+    before they recorded one are taken to include every released entry.
+    """
+    seq = rollups.load()
+    if seq is not None:
+        return seq
+    if not len(rollups_table):
+        # Transactions of entries after released_seq are added by recover_ledger
+        unreleased = {entry['tx']['id'] for entry in entries if entry['seq'] > released_seq and entry.get('tx')}
+        records = rollups.backfill([tx for tx in transactions_table.all() if tx['id'] not in unreleased])
+        if is_projector:
+            rollups.write(records, released_seq)
+    return released_seq
 
 # Ensure demo user exists with sufficient balance
 def ensure_demo_user():
     """Create a demo user with some initial balance if it doesn't exist"""
-    User = Query()
-    demo_user = escrow_table.get(User.user_id == "demo_user")
-    if not demo_user:
-        escrow_table.insert({'user_id': "demo_user", 'balance': 10.0})  # Give 10 SOL to start
-        # Record the initial transaction
-        record_transaction("demo_user", 10.0, 'deposit')
+    balance = ledger.balance("demo_user")
+    if balance is None:
+        # Give 10 SOL to start
+        commit("demo_user", 10.0, new_transaction("demo_user", 10.0, 'deposit'))
         print("Created demo user with 10.0 SOL balance")
-    elif demo_user['balance'] < 1.0:
+    elif balance < 1.0:
         # Top up if balance is low
-        new_balance = demo_user['balance'] + 10.0
-        escrow_table.update({'balance': new_balance}, User.user_id == "demo_user")
-        # Record the top-up transaction
-        record_transaction("demo_user", 10.0, 'deposit')
-        print(f"Topped up demo user to {new_balance} SOL balance")
+        entry = commit("demo_user", 10.0, new_transaction("demo_user", 10.0, 'deposit'))
+        print(f"Topped up demo user to {entry['balance']} SOL balance")
 
-# Create demo user on startup
-ensure_demo_user()
+def load_agent_usage():
+    for record in agent_usage_table.all():
+        agent_usage[record['agent_id']] = record.get('usage_count', 0)
+
+# Replay the ledger, load rollups and agent usage, recover anything storage
+# missed and create demo user on startup.
+# The first worker to start becomes the projector.
+replayed_entries = ledger.open({record['user_id']: record['balance'] for record in escrow_table.all()})
+released_seq = ledger.released_seq
+is_projector = projector_lock.acquire(blocking=False)
+rollups_seq = load_rollups(replayed_entries, released_seq)
+load_agent_usage()
+recover_ledger(replayed_entries, released_seq, rollups_seq)
+if is_projector:
+    ensure_demo_user()
+    project_ledger()
 
 # Pydantic models
 class DepositRequest(BaseModel):
@@ -71,6 +349,22 @@ class DepositRequest(BaseModel):
 class SpendRequest(BaseModel):
     cost: float
 
+class RefundRequest(BaseModel):
+    amount: float
+
+class ReserveRequest(BaseModel):
+    amount: float
+    # Reserve less than `amount` (but at least this much) if the balance is short
+    min_amount: Optional[float] = None
+    # Seconds until the reservation expires, RESERVATION_TTL by default
+    ttl: Optional[float] = None
+
+class SettleRequest(BaseModel):
+    used: float
+    # Number of requests charged against the reservation
+    requests: int = 0
+    agent_usage: Dict[str, int] = {}
+
 class Transaction(BaseModel):
     id: str
     user_id: str
@@ -89,108 +383,267 @@ def deposit_funds(
     request: DepositRequest,
     user_id: str = Header(..., alias="X-User-ID")
 ):
-    User = Query()
-    user_record = escrow_table.get(User.user_id == user_id)
-    
-    if user_record:
-        new_balance = user_record['balance'] + request.amount
-        escrow_table.update({'balance': new_balance}, User.user_id == user_id)
-    else:
-        escrow_table.insert({'user_id': user_id, 'balance': request.amount})
-        new_balance = request.amount
-    
-    # Record the transaction
-    transaction = record_transaction(user_id, request.amount, 'deposit')
-        
-    return {"user_id": user_id, "balance": new_balance, "transaction": transaction}
+    transaction = new_transaction(user_id, request.amount, 'deposit')
+    entry = commit(user_id, request.amount, transaction)
+    return {"user_id": user_id, "balance": entry['balance'], "transaction": transaction}
 
-# Get wallet details (balance and transactions)
+# Get wallet details (balance and a page of transactions, newest first).
+# `before` is a cursor: the id of the last transaction on the previous page
+# (returned as `next_before`) or an ISO timestamp. `start`/`end` restrict the
+# page to an inclusive timestamp range.
 @app.get("/wallet/{user_id}")
-def get_wallet_details(user_id: str):
-    User = Query()
-    Tx = Query()
-    
-    # Get user balance
-    user_record = escrow_table.get(User.user_id == user_id)
-    balance = user_record['balance'] if user_record else 0
-    
-    # Get transactions for this user
-    transactions = transactions_table.search(Tx.user_id == user_id)
-    
-    # Sort transactions by timestamp in descending order (newest first)
-    transactions.sort(key=lambda x: x['timestamp'], reverse=True)
-    
+def get_wallet_details(
+    user_id: str,
+    limit: int = Query(50, ge=1, le=500),
+    before: Optional[str] = None,
+    start: Optional[str] = None,
+    end: Optional[str] = None
+):
+    balance = ledger.balance(user_id) or 0
+
+    def in_page(transaction: dict) -> bool:
+        key = (transaction['timestamp'], transaction['id'])
+        return ((before_key is None or key < before_key)
+                and (start is None or key[0] >= start) and (end is None or key[0] <= end))
+
+    # Transactions the projection hasn't written to storage yet come from the ledger
+    unstored = [entry['tx'] for entry in ledger.unreleased(user_id) if entry.get('tx')]
+    before_key = None
+    if before:
+        cursor = next((tx for tx in unstored if tx['id'] == before), None) or transactions_table.get(id=before)
+        before_key = (cursor['timestamp'], cursor['id']) if cursor else (before, '')
+
+    # One extra row tells whether there is another page
+    stored = transactions_table.page(('timestamp', 'id'), limit + 1, before=before_key,
+                                     start=start, end=end, user_id=user_id)
+    page = {transaction['id']: transaction for transaction in stored}
+    page.update((transaction['id'], transaction) for transaction in unstored if in_page(transaction))
+    transactions = sorted(page.values(), key=lambda tx: (tx['timestamp'], tx['id']), reverse=True)
+
     return {
         "user_id": user_id,
         "balance": balance,
-        "transactions": transactions
+        "transactions": transactions[:limit],
+        "next_before": transactions[limit - 1]['id'] if len(transactions) > limit else None
     }
 
 # Check balance
 @app.get("/balance/{user_id}")
 def get_balance(user_id: str):
-    User = Query()
-    user_record = escrow_table.get(User.user_id == user_id)
-    
-    if not user_record:
-        return {"user_id": user_id, "balance": 0}
-    
-    return {"user_id": user_id, "balance": user_record['balance']}
+    return {"user_id": user_id, "balance": ledger.balance(user_id) or 0}
+
+async def charge_user(user_id: str, cost: float, agent_id: str = None):
+    """Check the balance and debit it in one ledger append, batched with concurrent spends"""
+    if cost <= 0:
+        # A negative cost would credit the balance while being recorded as spend
+        raise HTTPException(status_code=400, detail="Cost must be positive")
+    transaction = new_transaction(user_id, cost, 'spent', agent_id)
+    if spend_batcher is not None:
+        entry = await spend_batcher.append(user_id, -cost, check_funds=True, tx=transaction)
+    else:
+        entry = await asyncio.to_thread(ledger.append, user_id, -cost, check_funds=True, tx=transaction)
+    record_rollups(entry)
+    new_balance = entry['balance']
+
+    # Update agent usage count if agent_id is provided
+    usage_count = 0
+    if agent_id:
+        usage_count = update_agent_usage(agent_id)
+
+    return {"user_id": user_id, "balance": new_balance, "transaction": transaction, "usage_count": usage_count}
 
 # Spend funds endpoint (requires X-User-ID header)
 @app.post("/spend")
-def spend_funds(
+async def spend_funds(
     request: SpendRequest,
     user_id: str = Header(..., alias="X-User-ID"),
     agent_id: str = Header(None, alias="X-Agent-ID")
 ):
-    User = Query()
-    user_record = escrow_table.get(User.user_id == user_id)
-    
-    if not user_record or user_record['balance'] < request.cost:
+    try:
+        return await charge_user(user_id, request.cost, agent_id)
+    except InsufficientFunds:
         raise HTTPException(status_code=400, detail="Insufficient funds")
-    
-    new_balance = user_record['balance'] - request.cost
-    escrow_table.update({'balance': new_balance}, User.user_id == user_id)
-    
-    # Record the transaction
-    transaction = record_transaction(user_id, request.cost, 'spent')
-    
-    # Update agent usage count if agent_id is provided
-    usage_count = 0
-    if agent_id:
-        usage_count = update_agent_usage(agent_id)
-    
-    return {"user_id": user_id, "balance": new_balance, "transaction": transaction, "usage_count": usage_count}
 
-# Helper function to update agent usage count
-def update_agent_usage(agent_id: str):
-    """Update the usage count for an agent"""
-    if not agent_id:
-        return 0
-    
-    Agent = Query()
-    agent_record = agent_usage_table.get(Agent.agent_id == agent_id)
-    
-    if agent_record:
-        new_count = agent_record.get("usage_count", 0) + 1
-        agent_usage_table.update({"usage_count": new_count}, Agent.agent_id == agent_id)
-        return new_count
+# Authorize and charge in a single round trip (requires X-User-ID header).
+# Returns 402 when the balance can't cover the cost, so callers don't need
+# a separate /balance check first.
+@app.post("/charge")
+async def authorize_and_charge(
+    request: SpendRequest,
+    user_id: str = Header(..., alias="X-User-ID"),
+    agent_id: str = Header(None, alias="X-Agent-ID")
+):
+    try:
+        return await charge_user(user_id, request.cost, agent_id)
+    except InsufficientFunds:
+        raise HTTPException(status_code=402, detail="Insufficient funds")
+
+# Give back a charge for a request the gateway couldn't complete (requires
+# X-User-ID header). Recorded as a 'refund' transaction.
+@app.post("/refund")
+def refund_charge(
+    request: RefundRequest,
+    user_id: str = Header(..., alias="X-User-ID"),
+    agent_id: str = Header(None, alias="X-Agent-ID")
+):
+    if request.amount <= 0:
+        raise HTTPException(status_code=400, detail="Amount must be positive")
+    transaction = new_transaction(user_id, request.amount, 'refund', agent_id)
+    entry = commit(user_id, request.amount, transaction)
+    return {"user_id": user_id, "balance": entry['balance'], "transaction": transaction}
+
+# Reserve a block of credit for the gateway to charge against locally
+# (requires X-User-ID header). The amount is debited up front and recorded
+# as a 'reserved' transaction; settling refunds the unused part.
+@app.post("/reserve")
+def reserve_funds(
+    request: ReserveRequest,
+    user_id: str = Header(..., alias="X-User-ID")
+):
+    min_amount = request.min_amount if request.min_amount is not None else request.amount
+    with user_lock(user_id):
+        balance = ledger.balance(user_id) or 0
+
+        amount = min(request.amount, balance)
+        if amount <= 0 or amount < min_amount:
+            raise HTTPException(status_code=402, detail="Insufficient funds")
+
+        transaction = new_transaction(user_id, amount, 'reserved')
+        ttl = request.ttl if request.ttl is not None else RESERVATION_TTL
+        reservation = {
+            'id': transaction['id'],
+            'user_id': user_id,
+            'amount': amount,
+            'used': 0,
+            'status': 'open',
+            'created_at': transaction['timestamp'],
+            'expires_at': (datetime.fromisoformat(transaction['timestamp']) + timedelta(seconds=ttl)).isoformat(),
+            'settled_at': None
+        }
+        # The ledger entry carries the reservation so it can be restored after a crash
+        try:
+            entry = commit(user_id, -amount, transaction, check_funds=True, reservation=reservation)
+        except InsufficientFunds:
+            # Another worker spent from the balance since it was read
+            raise HTTPException(status_code=402, detail="Insufficient funds")
+        reservations_table.insert(reservation)
+
+    return {"reservation_id": transaction['id'], "user_id": user_id, "amount": amount, "balance": entry['balance']}
+
+def close_reservation(reservation: dict, used: float, requests: int, agent_usage: Dict[str, int],
+                      status: str = 'settled') -> Tuple[dict, Optional[dict], float]:
+    """Refund the unused part of an open reservation; call with reservations_lock held"""
+    user_id = reservation['user_id']
+    refund = max(0.0, reservation['amount'] - used)
+    transaction = new_transaction(user_id, refund, 'refund') if refund > 0 else None
+    settles = {'id': reservation['id'], 'used': used, 'settled_at': datetime.now().isoformat(),
+               'requests': requests, 'agent_usage': agent_usage, 'status': status}
+    # Logged even without a refund, so the settlement survives a crash
+    entry = commit(user_id, refund, transaction, settles=settles)
+    reservations_table.update({
+        'used': used,
+        'status': status,
+        'settled_at': settles['settled_at']
+    }, id=reservation['id'])
+    for agent_id, count in agent_usage.items():
+        update_agent_usage(agent_id, count)
+    return entry, transaction, refund
+
+def reservation_expiry(reservation: dict) -> datetime:
+    """When an open reservation is released; rows from before expires_at use RESERVATION_TTL"""
+    expires_at = reservation.get('expires_at')
+    if expires_at:
+        expires = datetime.fromisoformat(expires_at)
     else:
-        agent_usage_table.insert({"agent_id": agent_id, "usage_count": 1})
-        return 1
+        expires = datetime.fromisoformat(reservation['created_at']) + timedelta(seconds=RESERVATION_TTL)
+    return expires + timedelta(seconds=RESERVATION_EXPIRY_GRACE)
+
+def expire_reservations() -> int:
+    """Release open reservations whose gateway never settled them, refunding them in full"""
+    now = datetime.now()
+    expired = 0
+    for reservation in reservations_table.search(status='open'):
+        if reservation_expiry(reservation) > now:
+            continue
+        with reservations_lock:
+            reservation = reservations_table.get(id=reservation['id'])
+            if reservation['status'] != 'open':
+                continue
+            # What the gateway charged against it is lost with the gateway
+            close_reservation(reservation, 0.0, 0, {}, status='expired')
+        expired += 1
+    if expired:
+        logger.warning(f"Released {expired} expired reservations")
+    return expired
+
+async def expire_reservations_periodically():
+    while True:
+        await asyncio.sleep(RESERVATION_EXPIRY_INTERVAL)
+        if is_projector:
+            try:
+                await asyncio.to_thread(expire_reservations)
+            except Exception as e:
+                logger.error(f"Failed to release expired reservations: {str(e)}")
+
+# Settle a reservation: refund what wasn't used and record agent usage
+@app.post("/reservations/{reservation_id}/settle")
+def settle_reservation(reservation_id: str, request: SettleRequest):
+    reservation = reservations_table.get(id=reservation_id)
+    if not reservation:
+        raise HTTPException(status_code=404, detail="Reservation not found")
+
+    user_id = reservation['user_id']
+    with reservations_lock:
+        reservation = reservations_table.get(id=reservation_id)
+        if reservation['status'] != 'open':
+            raise HTTPException(status_code=409, detail=f"Reservation already {reservation['status']}")
+        if request.used < 0 or request.used > reservation['amount'] + 1e-9:
+            raise HTTPException(status_code=400, detail="Used amount exceeds reservation")
+
+        requests = request.requests or sum(request.agent_usage.values()) or 1
+        entry, transaction, refund = close_reservation(reservation, request.used, requests, request.agent_usage)
+
+    return {"reservation_id": reservation_id, "user_id": user_id, "used": request.used,
+            "refund": refund, "balance": entry['balance'], "transaction": transaction}
+
+# Spend/deposit totals per hour or day for a user or agent, from the rollups.
+# `start`/`end` are inclusive ISO timestamps or bucket prefixes.
+def query_rollups(scope: str, subject_id: str, period: str, start: Optional[str],
+                  end: Optional[str], tx_type: Optional[str]):
+    if period not in PERIODS:
+        raise HTTPException(status_code=400, detail=f"period must be one of {', '.join(PERIODS)}")
+    ledger.refresh()
+    return {
+        scope + "_id": subject_id,
+        "period": period,
+        "rollups": rollups.query(scope, subject_id, period, start, end, tx_type)
+    }
+
+@app.get("/rollups/user/{user_id}")
+def get_user_rollups(user_id: str, period: str = "day", start: Optional[str] = None,
+                     end: Optional[str] = None, type: Optional[str] = None):
+    return query_rollups("user", user_id, period, start, end, type)
+
+@app.get("/rollups/agent/{agent_id}")
+def get_agent_rollups(agent_id: str, period: str = "day", start: Optional[str] = None,
+                      end: Optional[str] = None, type: Optional[str] = None):
+    return query_rollups("agent", agent_id, period, start, end, type)
 
 # Add endpoint to get agent usage count
 @app.get("/usage/{agent_id}")
 def get_agent_usage(agent_id: str):
     """Get the usage count for a specific agent"""
-    Agent = Query()
-    agent_record = agent_usage_table.get(Agent.agent_id == agent_id)
-    
-    if not agent_record:
-        return {"agent_id": agent_id, "usage_count": 0}
-    
-    return {"agent_id": agent_id, "usage_count": agent_record.get("usage_count", 0)}
+    ledger.refresh()
+    with agent_usage_lock:
+        return {"agent_id": agent_id, "usage_count": agent_usage.get(agent_id, 0)}
+
+# Ledger sequence numbers, fsyncs and snapshots, and spend batch sizes
+@app.get("/ledger/stats")
+def get_ledger_stats():
+    stats = ledger.stats()
+    stats["projector"] = is_projector
+    stats["spend_batches"] = spend_batcher.stats() if spend_batcher is not None else {"enabled": False}
+    return stats
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8001)
@@ -0,0 +1,468 @@
+"""
+Append-only write-ahead ledger for escrow balances.
+
+Every balance change is appended to a log file as one JSON line, and is only
+acknowledged once the line is on disk. The log is the source of truth:
+balances are kept in memory, and the storage tables (transaction history,
+reservations) are projections written from it. Concurrent appends share
+fsyncs: whichever caller needs one first flushes everything written so far,
+and the others wait for it instead of syncing themselves (group commit).
+
+The log is split into segments. A snapshot of all balances is written every
+`snapshot_every` entries and starts a new segment, so startup loads the
+latest snapshot and replays only the entries after it. Segments are deleted
+once they are covered by a snapshot and released by the projection.
+
+Several processes can share one ledger directory. Appends hold an flock on
+`ledger.lock`, and each process first reads the entries the others appended
+since it last looked (following the log by offset, across segments), so
+balance checks always see every earlier entry. Entries read that way are
+passed to `on_entry`. How far the projection got is kept in
+`released.json`, so any process can take over projecting.
+"""
+import json
+import logging
+import os
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+from common.interprocess import FileLock
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FILE = "snapshot.json"
+RELEASED_FILE = "released.json"
+LOCK_FILE = "ledger.lock"
+SEGMENT_PREFIX = "ledger-"
+SEGMENT_SUFFIX = ".log"
+
+
+class InsufficientFunds(Exception):
+    pass
+
+
+class LedgerCorrupted(Exception):
+    """A log line other than the last one can't be read"""
+
+
+class Ledger:
+    """Balances backed by an fsync'd append-only log with periodic snapshots"""
+
+    def __init__(self, directory: str, fsync: bool = True, snapshot_every: int = 10000,
+                 on_entry: Optional[Callable[[dict], None]] = None):
+        self.directory = directory
+        self.fsync = fsync
+        self.snapshot_every = snapshot_every
+        # Called (with the lock held) for each entry appended by another process
+        self.on_entry = on_entry
+
+        self._balances: Dict[str, float] = {}
+        self._seq = 0            # last entry written
+        self._durable_seq = 0    # last entry known to be on disk
+        self._snapshot_seq = 0   # last entry covered by the snapshot
+        self._released_seq = 0   # last entry the projection has written
+        self._segments: List[int] = []  # first seq of each segment, oldest first
+        self._file = None
+        # Reads the current segment after the last entry this process has seen
+        self._reader = None
+        # Entries not yet written by the projection, in seq order
+        self._pending: List[dict] = []
+
+        # Guards balances, seq and the files, across threads and processes;
+        # held while catching up and writing to the OS buffer, and across a snapshot
+        self._lock = FileLock(os.path.join(directory, LOCK_FILE))
+        # Hands out the single fsync leader and wakes callers it made durable
+        self._durable = threading.Condition()
+        self._syncing = False
+
+        # Counters exposed through stats()
+        self.appends = 0
+        self.followed = 0
+        self.syncs = 0
+        self.snapshots = 0
+
+    # Startup
+
+    def open(self, initial_balances: Optional[Dict[str, float]] = None) -> List[dict]:
+        """Load the snapshot and replay the log; returns every entry still in the log.
+
+        The returned entries include ones the projection may already have
+        written, so applying them must be idempotent. `initial_balances`
+        seeds a brand new ledger (e.g. from the pre-ledger balance table).
+        Entries after the last one the projection released stay pending.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock:
+            self._segments = self._list_segments()
+            if os.path.exists(os.path.join(self.directory, SNAPSHOT_FILE)):
+                self._load_snapshot()
+            elif not self._segments and initial_balances:
+                self._balances = dict(initial_balances)
+                self._write_snapshot(0, self._balances)
+            self._seq = self._snapshot_seq
+
+            entries = []
+            for index, start in enumerate(self._segments):
+                last_segment = index == len(self._segments) - 1
+                for entry in self._read_segment(start, last_segment):
+                    entries.append(entry)
+                    if entry["seq"] > self._seq:
+                        self._balances[entry["user_id"]] = self._balances.get(entry["user_id"], 0.0) + entry["delta"]
+                        self._seq = entry["seq"]
+
+            self._durable_seq = self._seq
+            # Without a released.json every entry in the log may be missing from storage
+            self._released_seq = max(self._read_released(), entries[0]["seq"] - 1 if entries else self._seq)
+            self._pending = [entry for entry in entries if entry["seq"] > self._released_seq]
+            if not self._segments:
+                self._segments.append(self._seq + 1)
+            path = self._segment_path(self._segments[-1])
+            self._file = open(path, "a", encoding="utf-8")
+            self._reader = open(path, "rb")
+            self._reader.seek(0, os.SEEK_END)
+        logger.info(f"Ledger loaded: {len(self._balances)} balances, seq {self._seq}, "
+                    f"{len(entries)} entries replayed, {len(self._pending)} not yet in storage")
+        return entries
+
+    def _list_segments(self) -> List[int]:
+        return sorted(
+            int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
+            for name in os.listdir(self.directory)
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX)
+        )
+
+    def _load_snapshot(self):
+        with open(os.path.join(self.directory, SNAPSHOT_FILE), encoding="utf-8") as f:
+            snapshot = json.load(f)
+        self._balances = snapshot["balances"]
+        self._snapshot_seq = snapshot["seq"]
+
+    def _read_released(self) -> int:
+        try:
+            with open(os.path.join(self.directory, RELEASED_FILE), encoding="utf-8") as f:
+                return json.load(f)["seq"]
+        except (OSError, ValueError, KeyError):
+            return 0
+
+    def _segment_path(self, start: int) -> str:
+        return os.path.join(self.directory, f"{SEGMENT_PREFIX}{start:012d}{SEGMENT_SUFFIX}")
+
+    def _read_segment(self, start: int, last_segment: bool) -> List[dict]:
+        path = self._segment_path(start)
+        entries = []
+        good_bytes = 0
+        with open(path, "rb") as f:
+            lines = f.readlines()
+        for number, line in enumerate(lines):
+            try:
+                if not line.endswith(b"\n"):
+                    raise ValueError("incomplete line")
+                entries.append(json.loads(line))
+                good_bytes += len(line)
+            except ValueError:
+                # A crash mid-append can only tear the very end of the log
+                if not last_segment or number != len(lines) - 1:
+                    raise LedgerCorrupted(f"Unreadable entry at line {number + 1} of {path}")
+                logger.warning(f"Dropping incomplete last entry of {path}")
+                with open(path, "r+b") as f:
+                    f.truncate(good_bytes)
+        return entries
+
+    # Following other processes
+
+    def refresh(self):
+        """Catch up with entries other processes appended"""
+        with self._lock:
+            self._follow()
+
+    def _follow(self):
+        """Apply entries appended after the last one this process has seen (lock held)"""
+        while True:
+            position = self._reader.tell()
+            data = self._reader.read()
+            complete = data.rfind(b"\n") + 1
+            if complete < len(data):
+                # Nobody else holds the lock, so the writer died mid-append
+                path = self._segment_path(self._segments[-1])
+                logger.warning(f"Dropping incomplete last entry of {path}")
+                os.truncate(path, position + complete)
+                self._reader.seek(position + complete)
+            for number, line in enumerate(data[:complete].splitlines()):
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    raise LedgerCorrupted(f"Unreadable entry {number + 1} after offset {position} "
+                                          f"of segment {self._segments[-1]}")
+                self._apply_followed(entry)
+
+            # A segment is only ever followed by one starting right after its last entry
+            if self._seq + 1 > self._segments[-1] and os.path.exists(self._segment_path(self._seq + 1)):
+                self._open_segment(self._seq + 1)
+            elif not os.path.exists(self._segment_path(self._segments[-1])):
+                self._skip_to_snapshot()
+            else:
+                return
+
+    def _apply_followed(self, entry: dict):
+        if entry["seq"] != self._seq + 1:
+            raise LedgerCorrupted(f"Expected ledger entry {self._seq + 1}, found {entry['seq']}")
+        self._balances[entry["user_id"]] = self._balances.get(entry["user_id"], 0.0) + entry["delta"]
+        self._seq = entry["seq"]
+        self._pending.append(entry)
+        self.followed += 1
+        if self.on_entry:
+            try:
+                self.on_entry(entry)
+            except Exception as e:
+                logger.error(f"Failed to apply ledger entry {entry['seq']}: {str(e)}")
+
+    def _skip_to_snapshot(self):
+        """Jump past segments compacted away before this process read them"""
+        snapshot_seq = self._snapshot_seq
+        self._load_snapshot()
+        if self._snapshot_seq <= self._seq or not os.path.exists(self._segment_path(self._snapshot_seq + 1)):
+            self._snapshot_seq = snapshot_seq
+            raise LedgerCorrupted(f"Ledger segment after entry {self._seq} is missing")
+        logger.warning(f"Ledger entries {self._seq + 1}-{self._snapshot_seq} were compacted before this "
+                       f"process read them; balances reloaded from the snapshot")
+        self._seq = self._snapshot_seq
+        self._pending = [entry for entry in self._pending if entry["seq"] <= self._seq]
+        self._open_segment(self._seq + 1)
+
+    def _open_segment(self, start: int):
+        """Switch appends and following to the segment starting at `start` (lock held).
+
+        The segment is read from its beginning: other processes may already
+        have appended to it.
+        """
+        path = self._segment_path(start)
+        self._file.close()
+        self._reader.close()
+        self._file = open(path, "a", encoding="utf-8")
+        self._reader = open(path, "rb")
+        self._segments.append(start)
+
+    # Appending
+
+    def balance(self, user_id: str) -> Optional[float]:
+        """The user's balance, or None if they have never had one"""
+        with self._lock:
+            self._follow()
+            return self._balances.get(user_id)
+
+    def append(self, user_id: str, delta: float, check_funds: bool = False, **details) -> dict:
+        """Apply a balance change, write it to the log and wait until it is durable.
+
+        With check_funds the change is refused (InsufficientFunds) if the user
+        has no balance or it would go negative. `details` (the transaction,
+        reservation info) are stored in the entry for the projection.
+        """
+        entry = self.append_many([(user_id, delta, check_funds, details)])[0]
+        if isinstance(entry, InsufficientFunds):
+            raise entry
+        return entry
+
+    def append_many(self, changes: List[tuple]) -> List:
+        """Apply (user_id, delta, check_funds, details) changes in order with one durable write.
+
+        Returns an entry per change, or an InsufficientFunds instance for each
+        change that was refused; refused changes don't affect later ones.
+        """
+        results, seq = self.stage(changes)
+        if seq is not None:
+            self.wait_durable(seq)
+        return results
+
+    def stage(self, changes: List[tuple]) -> Tuple[List, Optional[int]]:
+        """Apply changes and write them to the OS buffer, without waiting for the disk.
+
+        Returns the results as append_many does, and the seq to pass to
+        wait_durable before acknowledging them (None if all were refused).
+        Doesn't fsync, but waits for the ledger lock, which another process
+        may hold across a snapshot's fsyncs: call it from a thread, not the
+        event loop.
+        """
+        results = []
+        with self._lock:
+            self._follow()
+            lines = []
+            for user_id, delta, check_funds, details in changes:
+                balance = self._balances.get(user_id)
+                if check_funds and (balance is None or balance + delta < 0):
+                    results.append(InsufficientFunds())
+                    continue
+                self._seq += 1
+                new_balance = (balance or 0.0) + delta
+                self._balances[user_id] = new_balance
+                entry = {"seq": self._seq, "user_id": user_id, "delta": delta, "balance": new_balance, **details}
+                lines.append(json.dumps(entry))
+                results.append(entry)
+                self._pending.append(entry)
+            if not lines:
+                return results, None
+            self._file.write("\n".join(lines) + "\n")
+            # Other processes read the log, so it must reach the OS before the lock is released
+            self._file.flush()
+            self._reader.seek(0, os.SEEK_END)
+            self.appends += len(lines)
+            return results, self._seq
+
+    def wait_durable(self, seq: int):
+        """Block until every entry up to seq is on disk"""
+        with self._durable:
+            while self._durable_seq < seq and self._syncing:
+                self._durable.wait()
+            if self._durable_seq < seq:
+                # Nobody is syncing: this caller syncs for everyone written so far
+                self._syncing = True
+                leader = True
+            else:
+                leader = False
+
+        if leader:
+            synced = None
+            try:
+                with self._lock:
+                    self._file.flush()
+                    synced = self._seq
+                    # Following another process may switch (and close) the file meanwhile
+                    fd = os.dup(self._file.fileno())
+                try:
+                    if self.fsync:
+                        os.fsync(fd)
+                finally:
+                    os.close(fd)
+                self.syncs += 1
+            finally:
+                with self._durable:
+                    self._syncing = False
+                    if synced is not None:
+                        self._durable_seq = max(self._durable_seq, synced)
+                    self._durable.notify_all()
+
+    # Projection and snapshots
+
+    def pending(self) -> List[dict]:
+        """Entries the projection hasn't released yet, from every process, made durable, in seq order"""
+        with self._lock:
+            self._follow()
+            seq = self._seq
+        self.wait_durable(seq)
+        with self._lock:
+            return [entry for entry in self._pending if entry["seq"] <= seq]
+
+    def unreleased(self, user_id: str) -> List[dict]:
+        """A user's entries that may not be in storage yet, after catching up, in seq order"""
+        with self._lock:
+            self._follow()
+            return [entry for entry in self._pending if entry["user_id"] == user_id]
+
+    def release(self, entries: List[dict]):
+        """Mark entries as written by the projection, for every process sharing the ledger"""
+        done = {entry["seq"] for entry in entries}
+        with self._lock:
+            self._pending = [entry for entry in self._pending if entry["seq"] not in done]
+            released = self._pending[0]["seq"] - 1 if self._pending else self._seq
+            self._released_seq = max(self._released_seq, released)
+            path = os.path.join(self.directory, RELEASED_FILE)
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump({"seq": self._released_seq}, f)
+            os.replace(path + ".tmp", path)
+        self._compact()
+
+    def forget_released(self):
+        """Catch up, and drop pending entries another process has projected"""
+        with self._lock:
+            self._follow()
+            self._released_seq = max(self._released_seq, self._read_released())
+            self._pending = [entry for entry in self._pending if entry["seq"] > self._released_seq]
+
+    @property
+    def released_seq(self) -> int:
+        """Last entry known to be written by the projection"""
+        return self._released_seq
+
+    def needs_snapshot(self) -> bool:
+        with self._lock:
+            return self._seq - self._snapshot_seq >= self.snapshot_every
+
+    def snapshot(self):
+        """Write all balances to the snapshot file and start a new segment.
+
+        Done entirely under the lock, so a process following the log into the
+        new segment knows the snapshot before it is on disk, and snapshots
+        from different processes can't overwrite each other out of order.
+        """
+        with self._lock:
+            self._follow()
+            seq = self._seq
+            if seq == self._snapshot_seq:
+                return
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            self._write_snapshot(seq, self._balances)
+            self._snapshot_seq = seq
+            self.snapshots += 1
+            if self._segments[-1] <= seq:
+                self._open_segment(seq + 1)
+        with self._durable:
+            self._durable_seq = max(self._durable_seq, seq)
+        self._compact()
+
+    def _write_snapshot(self, seq: int, balances: Dict[str, float]):
+        path = os.path.join(self.directory, SNAPSHOT_FILE)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"seq": seq, "balances": balances}, f)
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        if self.fsync:
+            dir_fd = os.open(self.directory, os.O_RDONLY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+
+    def _compact(self):
+        """Delete segments that are both snapshotted and released"""
+        with self._lock:
+            covered = min(self._snapshot_seq, self._released_seq)
+            # A segment ends where the next one starts; the current one is never removed
+            removable = [start for start, next_start in zip(self._segments, self._segments[1:])
+                         if next_start - 1 <= covered]
+            self._segments = self._segments[len(removable):]
+        for start in removable:
+            try:
+                os.remove(self._segment_path(start))
+            except FileNotFoundError:
+                pass  # Compacted by another process
+            except OSError as e:
+                logger.warning(f"Failed to remove ledger segment {start}: {str(e)}")
+
+    def close(self):
+        if self._file is not None:
+            with self._lock:
+                self._file.flush()
+                if self.fsync:
+                    os.fsync(self._file.fileno())
+                self._file.close()
+                self._reader.close()
+                self._file = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "accounts": len(self._balances),
+                "seq": self._seq,
+                "durable_seq": self._durable_seq,
+                "snapshot_seq": self._snapshot_seq,
+                "released_seq": self._released_seq,
+                "segments": len(self._segments),
+                "appends": self.appends,
+                "followed": self.followed,
+                "syncs": self.syncs,
+                "snapshots": self.snapshots,
+            }
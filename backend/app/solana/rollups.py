@@ -0,0 +1,165 @@
+"""
+Incremental spend and deposit rollups for the escrow service.
+
+Every deposit and spend adds to count/total buckets per user and per agent,
+by hour and by day. Buckets live in memory, so updating them costs nothing
+on the request path and dashboard queries never scan raw transactions.
+
+The rollups table is written from ledger entries, not from the in-memory
+buckets: write() adds a batch of entries' records to the stored rows and
+saves them, together with the seq of the last entry they cover, in one
+upsert_multiple. After a restart the buckets are loaded back and only
+entries after that seq are added again, so no entry is lost or counted
+twice however the service stopped.
+"""
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+PERIODS = {
+    "hour": "%Y-%m-%dT%H",
+    "day": "%Y-%m-%d",
+}
+
+# Row holding the seq of the last ledger entry the stored rollups include
+SEQ_KEY = "ledger_seq"
+
+# (scope, subject_id, period) -> {(bucket, type): {"count": int, "total": float}}
+RollupKey = Tuple[str, str, str]
+BucketKey = Tuple[str, str]
+
+
+def bucket_for(timestamp: datetime, period: str) -> str:
+    return timestamp.strftime(PERIODS[period])
+
+
+def doc_key(scope: str, subject_id: str, period: str, bucket: str, tx_type: str) -> str:
+    return f"{scope}:{subject_id}:{period}:{bucket}:{tx_type}"
+
+
+class Rollups:
+    """Per-user and per-agent hourly/daily count and sum of transactions"""
+
+    def __init__(self, table):
+        self.table = table
+        self._buckets: Dict[RollupKey, Dict[BucketKey, dict]] = {}
+        # The rows in the table (doc_key -> row) and the last ledger entry they include
+        self._stored: Dict[str, dict] = {}
+        self.stored_seq: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def record(self, user_id: str, tx_type: str, amount: float, count: int = 1,
+               agent_id: Optional[str] = None, at: Optional[datetime] = None,
+               agent_counts: Optional[Dict[str, int]] = None):
+        """Add `count` transactions totalling `amount` to the user's buckets.
+
+        Agent buckets get the same values when `agent_id` is given, or a share
+        of `amount` proportional to each agent's count in `agent_counts`.
+        """
+        increments = self._increments(user_id, tx_type, amount, count, agent_id, at, agent_counts)
+        with self._lock:
+            for scope, subject_id, period, bucket, bucket_type, bucket_count, bucket_amount in increments:
+                entry = self._buckets.setdefault((scope, subject_id, period), {}).setdefault(
+                    (bucket, bucket_type), {"count": 0, "total": 0.0}
+                )
+                entry["count"] += bucket_count
+                entry["total"] += bucket_amount
+
+    def _increments(self, user_id: str, tx_type: str, amount: float, count: int = 1,
+                    agent_id: Optional[str] = None, at: Optional[datetime] = None,
+                    agent_counts: Optional[Dict[str, int]] = None) -> List[tuple]:
+        """(scope, subject_id, period, bucket, type, count, amount) for each bucket a record adds to"""
+        at = at or datetime.now()
+        subjects = [("user", user_id, count, amount)]
+        if agent_id:
+            subjects.append(("agent", agent_id, count, amount))
+        for agent, agent_count in (agent_counts or {}).items():
+            share = amount * agent_count / count if count else 0.0
+            subjects.append(("agent", agent, agent_count, share))
+        return [(scope, subject_id, period, bucket_for(at, period), tx_type, subject_count, subject_amount)
+                for scope, subject_id, subject_count, subject_amount in subjects
+                for period in PERIODS]
+
+    def query(self, scope: str, subject_id: str, period: str,
+              start: Optional[str] = None, end: Optional[str] = None,
+              tx_type: Optional[str] = None) -> List[dict]:
+        """Buckets for one user or agent, oldest first, with optional bucket range"""
+        with self._lock:
+            buckets = dict(self._buckets.get((scope, subject_id, period), {}))
+        rows = []
+        for (bucket, bucket_type), entry in sorted(buckets.items()):
+            if start and bucket < start[:len(bucket)]:
+                continue
+            if end and bucket > end[:len(bucket)]:
+                continue
+            if tx_type and bucket_type != tx_type:
+                continue
+            rows.append({"bucket": bucket, "type": bucket_type, "count": entry["count"], "total": entry["total"]})
+        return rows
+
+    def load(self) -> Optional[int]:
+        """Load persisted buckets into memory; returns the seq they cover (None if not recorded)"""
+        with self._lock:
+            self._buckets.clear()
+            self._load_stored()
+            for row in self._stored.values():
+                self._buckets.setdefault((row["scope"], row["subject_id"], row["period"]), {})[
+                    (row["bucket"], row["type"])
+                ] = {"count": row["count"], "total": row["total"]}
+            return self.stored_seq
+
+    def load_stored(self):
+        """Reread the stored rows, e.g. when taking over the writing from another process"""
+        with self._lock:
+            self._load_stored()
+
+    def _load_stored(self):
+        self._stored.clear()
+        self.stored_seq = None
+        for doc in self.table.all():
+            if doc["key"] == SEQ_KEY:
+                self.stored_seq = doc["seq"]
+            else:
+                self._stored[doc["key"]] = doc
+
+    def backfill(self, transactions: List[dict], tx_types=("deposit", "spent")) -> List[dict]:
+        """Build user buckets from raw transactions (used once when no rollups exist).
+
+        Returns the records added, for write().
+        """
+        records = [
+            {"user_id": tx["user_id"], "tx_type": tx["type"], "amount": tx["amount"],
+             "agent_id": tx.get("agent_id"), "at": datetime.fromisoformat(tx["timestamp"])}
+            for tx in transactions if tx["type"] in tx_types
+        ]
+        for record in records:
+            self.record(**record)
+        return records
+
+    def write(self, records: List[dict], seq: int) -> int:
+        """Add records (record() arguments) to the stored rows and save them as covering entries up to seq.
+
+        Returns the rows written. On failure nothing is saved and the stored
+        rows stay as they were, so the same records can be written again.
+        """
+        with self._lock:
+            rows: Dict[str, dict] = {}
+            for record in records:
+                for scope, subject_id, period, bucket, tx_type, count, amount in self._increments(**record):
+                    key = doc_key(scope, subject_id, period, bucket, tx_type)
+                    row = rows.get(key)
+                    if row is None:
+                        row = dict(self._stored.get(key) or {
+                            "key": key, "scope": scope, "subject_id": subject_id, "period": period,
+                            "bucket": bucket, "type": tx_type, "count": 0, "total": 0.0,
+                        })
+                        rows[key] = row
+                    row["count"] += count
+                    row["total"] += amount
+
+        # The rows and the seq they cover are saved together, in one write
+        self.table.upsert_multiple(list(rows.values()) + [{"key": SEQ_KEY, "seq": seq}], key="key")
+        with self._lock:
+            self._stored.update(rows)
+            self.stored_seq = seq
+        return len(rows)
@@ -0,0 +1,84 @@
+"""
+Group commit for concurrent spends.
+
+Spends arriving within `max_wait` seconds of each other (up to `max_batch`
+of them) are applied to the ledger together: one write and one fsync for
+the whole batch instead of one per request. Each spend is still checked
+against the balance left by the spends before it, in arrival order, and
+gets its own result. Staging a batch waits for the ledger's cross-process
+lock, which another worker may hold across a snapshot's fsyncs, so it runs
+in a thread like the fsync does; batches are still staged one at a time,
+in order, while the next batch fills up.
+"""
+import asyncio
+from typing import List, Optional, Tuple
+
+from ledger import Ledger
+
+
+class SpendBatcher:
+    """Collects ledger appends from concurrent requests into batches"""
+
+    def __init__(self, ledger: Ledger, max_batch: int = 256, max_wait: float = 0.002):
+        self.ledger = ledger
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait
+        self._batch: List[Tuple[tuple, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        # Staging runs in a thread; this keeps batches in the order they were flushed
+        self._staging = asyncio.Lock()
+
+        # Counters exposed through stats()
+        self.batches = 0
+        self.spends = 0
+        self.largest_batch = 0
+
+    async def append(self, user_id: str, delta: float, check_funds: bool = False, **details) -> dict:
+        """Ledger.append, committed with whatever else arrives in the same window"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._batch.append(((user_id, delta, check_funds, details), future))
+        if len(self._batch) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._batch = self._batch, []
+        if not batch:
+            return
+
+        self.batches += 1
+        self.spends += len(batch)
+        self.largest_batch = max(self.largest_batch, len(batch))
+        asyncio.ensure_future(self._commit(batch))
+
+    async def _commit(self, batch: List[Tuple[tuple, asyncio.Future]]):
+        try:
+            # asyncio.Lock wakes waiters first come, first served
+            async with self._staging:
+                results, seq = await asyncio.to_thread(self.ledger.stage, [change for change, _ in batch])
+            if seq is not None:
+                await asyncio.to_thread(self.ledger.wait_durable, seq)
+        except Exception as e:
+            results = [e] * len(batch)
+        for (_, future), result in zip(batch, results):
+            # A cancelled request's spend still stands; there is just nobody to tell
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "spends": self.spends,
+            "mean_batch": self.spends / self.batches if self.batches else 0.0,
+            "largest_batch": self.largest_batch,
+        }
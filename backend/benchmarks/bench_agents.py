@@ -0,0 +1,79 @@
+"""
+Offline throughput test for the agent services in api_endpoints.
+
+Runs api_endpoints/main.py on localhost with the fake LLM (LLM_BACKEND=fake,
+FAKE_LLM_LATENCY seconds per call) and fires concurrent requests at one
+endpoint. With blocking LLM calls throughput stays near 1/latency; with the
+async clients it scales up to the service's *_CONCURRENCY limit.
+
+Usage:
+    python backend/benchmarks/bench_agents.py [--endpoint translate] [--requests 200] [--concurrency 50]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import httpx
+
+from harness import print_summary, run_server, summarize
+
+API_ENDPOINTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "api_endpoints")
+
+PAYLOADS = {
+    "translate": {"tx_signature": "bench", "text": "Hello world", "target_language": "es", "wallet_address": "bench"},
+    "translate/batch": {"tx_signature": "bench", "texts": [f"Hello world {n}" for n in range(10)],
+                        "target_languages": ["es", "fr", "de"], "wallet_address": "bench"},
+    "summarize": {"tx_signature": "bench", "article_url": "http://example.com/a", "article_text": "Markets rallied today. " * 50, "wallet_address": "bench"},
+    "story/generate": {"prompt": "A dragon learns to code", "wallet_address": "bench"},
+}
+
+
+async def drive(url: str, payload: dict, total: int, concurrency: int, vary: bool):
+    latencies = []
+    remaining = iter(range(total))
+
+    async with httpx.AsyncClient(timeout=120, limits=httpx.Limits(max_connections=concurrency)) as client:
+        async def worker():
+            for i in remaining:
+                body = dict(payload)
+                if vary:
+                    # Distinct inputs so response caches and request coalescing don't kick in
+                    for field in ("text", "article_text", "prompt"):
+                        if field in body:
+                            body[field] = f"{body[field]} #{i}"
+                    if "texts" in body:
+                        body["texts"] = [f"{text} #{i}" for text in body["texts"]]
+                start = time.perf_counter()
+                response = await client.post(url, json=body)
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--endpoint", choices=sorted(PAYLOADS), default="translate")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.2, help="Fake LLM latency in seconds")
+    parser.add_argument("--same-input", action="store_true", help="Send identical requests")
+    args = parser.parse_args()
+
+    os.environ["LLM_BACKEND"] = "fake"
+    os.environ["FAKE_LLM_LATENCY"] = str(args.latency)
+    sys.path.insert(0, API_ENDPOINTS_DIR)
+    import main as agents
+
+    with run_server(agents.app) as base_url:
+        summary = asyncio.run(drive(f"{base_url}/{args.endpoint}", PAYLOADS[args.endpoint],
+                                    args.requests, args.concurrency, vary=not args.same_input))
+    print_summary(f"/{args.endpoint}", summary)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Article fetch and extraction for the news summarizer, against a local fixture.
+
+Serves generated HTML articles with ETags (and an artificial delay) from a
+local server, then fetches them through api_endpoints' ArticleFetcher:
+
+    cold         every URL downloaded and parsed
+    cached       the same URLs again within the cache TTL (no requests)
+    revalidated  TTL expired; the server answers 304 Not Modified
+    oversized    a page larger than the size limit is abandoned mid-stream
+
+Usage:
+    python backend/benchmarks/bench_article_fetch.py [--articles 200] [--concurrency 20] [--latency 0.05]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import HTMLResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+from harness import print_summary, run_server, summarize
+
+API_ENDPOINTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "api_endpoints")
+
+PARAGRAPH = "<p>Markets rallied today as investors weighed the latest inflation figures. " * 5 + "</p>"
+counts = {"200": 0, "304": 0}
+
+
+def fixture_app(latency: float) -> Starlette:
+    async def article(request: Request):
+        await asyncio.sleep(latency)
+        etag = f'"article-{request.path_params["n"]}-v1"'
+        if request.headers.get("if-none-match") == etag:
+            counts["304"] += 1
+            return Response(status_code=304, headers={"ETag": etag})
+        counts["200"] += 1
+        html = (
+            f"<html><head><title>Article {request.path_params['n']}</title><script>var x = 1;</script></head>"
+            f"<body><nav><a href='/'>Home</a></nav><article><h1>Headline</h1>{PARAGRAPH * 10}</article>"
+            f"<footer>Copyright</footer></body></html>"
+        )
+        return HTMLResponse(html, headers={"ETag": etag})
+
+    async def large(request: Request):
+        async def chunks():
+            for _ in range(1000):
+                yield b"<p>" + b"x" * 65536 + b"</p>"
+        # No Content-Length, so only the streaming limit can stop it
+        return StreamingResponse(chunks(), media_type="text/html")
+
+    return Starlette(routes=[Route("/articles/{n}", article), Route("/large", large)])
+
+
+async def fetch_all(fetcher, urls, concurrency: int) -> dict:
+    latencies = []
+    remaining = iter(urls)
+
+    async def worker():
+        for url in remaining:
+            start = time.perf_counter()
+            await fetcher.fetch(url)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, time.perf_counter() - start)
+
+
+async def run(base_url: str, args):
+    from article_fetcher import ArticleFetcher, ArticleFetchError
+
+    # The articles are served from localhost
+    fetcher = ArticleFetcher(max_bytes=args.max_kb * 1024, ttl=60, max_connections=args.concurrency,
+                             allow_private_hosts=True)
+    urls = [f"{base_url}/articles/{n}" for n in range(args.articles)]
+    try:
+        print_summary("cold", await fetch_all(fetcher, urls, args.concurrency))
+        print_summary("cached", await fetch_all(fetcher, urls, args.concurrency))
+        fetcher.ttl = 0
+        print_summary("revalidated", await fetch_all(fetcher, urls, args.concurrency))
+
+        start = time.perf_counter()
+        try:
+            await fetcher.fetch(f"{base_url}/large")
+            print("oversized: fetched (size limit not enforced)")
+        except ArticleFetchError as e:
+            print(f"oversized: rejected after {(time.perf_counter() - start) * 1000:.1f} ms ({e})")
+
+        fetcher.ttl = 60
+        article = await fetcher.fetch(urls[0])
+    finally:
+        await fetcher.close()
+
+    print(f"fixture responses: {counts['200']} full, {counts['304']} not modified")
+    print(f"extracted: {article['title']!r}, {len(article['text'])} chars")
+    print(f"fetcher: {fetcher.stats()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--articles", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.05, help="Fixture server delay in seconds")
+    parser.add_argument("--max-kb", type=int, default=2048, help="Article size limit")
+    args = parser.parse_args()
+
+    sys.path.insert(0, API_ENDPOINTS_DIR)
+    with run_server(fixture_app(args.latency)) as base_url:
+        asyncio.run(run(base_url, args))
+
+
+if __name__ == "__main__":
+    main()
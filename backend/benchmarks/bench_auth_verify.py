@@ -0,0 +1,92 @@
+"""
+Benchmark API key lookup in the auth service.
+
+Compares the indexed lookup used by /verify and /apikeys/use against the
+previous full-table scan at 1k, 100k and 1M issued keys.
+
+Usage:
+    python backend/benchmarks/bench_auth_verify.py [--sizes 1000 100000 1000000]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from uuid import uuid4
+
+from tinydb import TinyDB
+from tinydb.storages import MemoryStorage
+
+AUTH_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app", "auth")
+sys.path.append(os.path.join(AUTH_DIR, ".."))
+from common.storage import TinyDBTable
+
+KEYS_PER_USER = 5
+
+
+def load_auth():
+    """Import auth.py with its TinyDB file created in a scratch directory"""
+    sys.path.insert(0, AUTH_DIR)
+    cwd = os.getcwd()
+    os.chdir(tempfile.mkdtemp())
+    try:
+        import auth
+    finally:
+        os.chdir(cwd)
+    return auth
+
+
+def populate(auth, n_keys: int):
+    """Fill an in-memory users table with n_keys keys and rebuild the index"""
+    auth.users_table = TinyDBTable(TinyDB(storage=MemoryStorage).table("users"))
+    users = []
+    keys = []
+    for u in range(max(1, n_keys // KEYS_PER_USER)):
+        api_keys = []
+        for _ in range(KEYS_PER_USER):
+            key = uuid4().hex
+            keys.append(key)
+            api_keys.append({"name": "bench", "key": key, "created_at": "", "last_used": None, "use_count": 0})
+        users.append({"wallet_address": f"wallet_{u}", "session_id": "", "created_at": "", "api_keys": api_keys})
+    auth.users_table.insert_multiple(users)
+    auth.build_api_key_index()
+    return keys
+
+
+def scan_lookup(auth, api_key: str):
+    """The lookup /verify used to do: walk every user's api_keys"""
+    for user in auth.users_table.all():
+        for key in user["api_keys"]:
+            if key["key"] == api_key:
+                return user["wallet_address"], key
+    return None
+
+
+def time_lookups(fn, keys, iterations: int) -> float:
+    """Mean latency in microseconds of fn over random keys"""
+    sample = [random.choice(keys) for _ in range(iterations)]
+    start = time.perf_counter()
+    for key in sample:
+        assert fn(key) is not None
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 100_000, 1_000_000])
+    parser.add_argument("--iterations", type=int, default=10_000)
+    parser.add_argument("--scan-iterations", type=int, default=5)
+    args = parser.parse_args()
+
+    auth = load_auth()
+    print(f"{'keys':>10} {'indexed (us)':>14} {'scan (us)':>14}")
+    for size in args.sizes:
+        keys = populate(auth, size)
+        indexed = time_lookups(auth.find_api_key, keys, args.iterations)
+        scan = time_lookups(lambda k: scan_lookup(auth, k), keys, args.scan_iterations)
+        print(f"{size:>10} {indexed:>14.2f} {scan:>14.0f}")
+
+
+if __name__ == "__main__":
+    main()
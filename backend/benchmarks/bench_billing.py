@@ -0,0 +1,213 @@
+"""
+End-to-end load test of the billed request path.
+
+For each scale, seeds temporary auth and escrow databases with that many
+users (each with API keys, a balance and transaction history), starts the
+auth, escrow and gateway services as separate uvicorn processes on
+localhost, and drives POST /api/proxy at a local dummy upstream with random
+users' keys. Every request goes gateway -> auth /verify (until the key is
+cached) -> escrow /charge, or /reserve blocks with --reservation-size > 0.
+
+Reports throughput, p50/p95/p99 latency, response statuses and how much
+each database file grew, per scale. Results can be saved with --output and compared against a
+saved run with --baseline, failing when throughput or p99 regress by more
+than --max-regression.
+
+Usage:
+    python backend/benchmarks/bench_billing.py [--users 100 1000 10000] [--keys-per-user 2]
+        [--transactions-per-user 20] [--requests 2000] [--concurrency 50] [--reservation-size 0]
+        [--output results.json] [--baseline results.json] [--max-regression 0.2]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta
+
+import httpx
+from starlette.applications import Starlette
+from starlette.responses import Response
+from starlette.routing import Route
+
+from harness import print_summary, run_server, run_service, summarize
+
+from common.storage import STORAGE_BACKEND, open_storage, storage_path
+
+BALANCE = 1_000_000.0
+
+
+async def ok(request):
+    await request.body()
+    return Response(b'{"ok": true}', media_type="application/json")
+
+
+upstream = Starlette(routes=[Route("/ok", ok, methods=["POST"])])
+
+
+def seed(data_dir: str, users: int, keys_per_user: int, transactions_per_user: int) -> list:
+    """Write users, keys, balances and history straight to storage; returns the API keys"""
+    keys = []
+    user_docs = []
+    escrow_docs = []
+    transactions = []
+    start = datetime.now() - timedelta(days=30)
+    for i in range(users):
+        wallet = f"bench_wallet_{i}"
+        api_keys = []
+        for k in range(keys_per_user):
+            key = uuid.uuid4().hex
+            keys.append(key)
+            api_keys.append({"name": f"key{k}", "key": key, "created_at": start.isoformat(),
+                             "last_used": None, "use_count": 0})
+        user_docs.append({"wallet_address": wallet, "session_id": str(uuid.uuid4()),
+                          "created_at": start.isoformat(), "api_keys": api_keys})
+        escrow_docs.append({"user_id": wallet, "balance": BALANCE})
+        for t in range(transactions_per_user):
+            transactions.append({"id": str(uuid.uuid4()), "user_id": wallet, "amount": 0.01, "type": "spent",
+                                 "timestamp": (start + timedelta(minutes=i + t)).isoformat(),
+                                 "agent_id": "bench-agent"})
+
+    auth_db = open_storage(os.path.join(data_dir, "auth_db.json"))
+    auth_db.table("users").insert_multiple(user_docs)
+    auth_db.close()
+    escrow_db = open_storage(os.path.join(data_dir, "escrow.json"))
+    escrow_db.table("user_escrow").insert_multiple(escrow_docs)
+    escrow_db.table("transactions").insert_multiple(transactions)
+    escrow_db.close()
+    return keys
+
+
+def db_sizes(data_dir: str) -> dict:
+    """Bytes on disk per service database (including SQLite's WAL file) and for the escrow ledger"""
+    sizes = {}
+    for name in ("auth_db.json", "escrow.json", "api_calls.json"):
+        path = storage_path(os.path.join(data_dir, name))
+        sizes[name] = sum(os.path.getsize(p) for p in (path, path + "-wal") if os.path.exists(p))
+    ledger_dir = os.path.join(data_dir, "escrow_ledger")
+    sizes["escrow_ledger"] = sum(
+        os.path.getsize(os.path.join(ledger_dir, name)) for name in os.listdir(ledger_dir)
+    ) if os.path.isdir(ledger_dir) else 0
+    return sizes
+
+
+async def drive(url: str, target: str, keys: list, total: int, concurrency: int) -> tuple:
+    latencies = []
+    statuses = Counter()
+    remaining = iter(range(total))
+
+    async with httpx.AsyncClient(timeout=30, limits=httpx.Limits(max_connections=concurrency)) as client:
+        async def worker():
+            for _ in remaining:
+                headers = {"X-API-Key": random.choice(keys), "X-Target-URL": target,
+                           "X-Agent-ID": f"bench-agent-{random.randrange(10)}"}
+                start = time.perf_counter()
+                response = await client.post(url, headers=headers, content=b'{"q": "bench"}')
+                latencies.append(time.perf_counter() - start)
+                statuses[response.status_code] += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, time.perf_counter() - start), statuses
+
+
+def run_scale(users: int, args, upstream_url: str) -> dict:
+    data_dir = tempfile.mkdtemp()
+    keys = seed(data_dir, users, args.keys_per_user, args.transactions_per_user)
+    before = db_sizes(data_dir)
+
+    def db(name):
+        return {"DATABASE_PATH": os.path.join(data_dir, name)}
+
+    with run_service("auth", "auth", db("auth_db.json")) as auth_url, \
+            run_service("escrow_api", "solana", db("escrow.json")) as escrow_url, \
+            run_service("api_gateway", "api", {
+                **db("api_calls.json"),
+                "AUTH_SERVICE_URL": f"{auth_url}/verify",
+                "ESCROW_SERVICE_URL": escrow_url,
+                "CREDIT_RESERVATION_SIZE": str(args.reservation_size),
+                # The upstream runs on localhost
+                "PROXY_ALLOW_PRIVATE_HOSTS": "true",
+                # Measure billing, not throttling
+                "RATE_LIMIT_KEY_RATE": "0",
+                "RATE_LIMIT_AGENT_RATE": "0",
+                "RATE_LIMIT_IP_RATE": "0",
+            }) as gateway_url:
+        proxy_url = f"{gateway_url}/api/proxy"
+        target = f"{upstream_url}/ok"
+        asyncio.run(drive(proxy_url, target, keys, args.concurrency, args.concurrency))
+        summary, statuses = asyncio.run(drive(proxy_url, target, keys, args.requests, args.concurrency))
+
+    after = db_sizes(data_dir)
+    growth = {name: after[name] - before[name] for name in after}
+    return {"users": users, "keys": len(keys), "transactions": users * args.transactions_per_user,
+            **summary, "statuses": {str(code): count for code, count in sorted(statuses.items())},
+            "db_bytes": after, "db_growth": growth}
+
+
+def failed(run: dict) -> int:
+    return sum(count for code, count in run["statuses"].items() if code != "200")
+
+
+def compare(results: list, baseline: list, max_regression: float) -> list:
+    """Descriptions of scales whose throughput, p99 or failure count got worse than allowed"""
+    previous = {run["users"]: run for run in baseline}
+    regressions = []
+    for run in results:
+        old = previous.get(run["users"])
+        if not old:
+            continue
+        if run["rps"] < old["rps"] * (1 - max_regression):
+            regressions.append(f"{run['users']} users: {old['rps']:.0f} -> {run['rps']:.0f} req/s")
+        if run["p99_ms"] > old["p99_ms"] * (1 + max_regression):
+            regressions.append(f"{run['users']} users: p99 {old['p99_ms']:.2f} -> {run['p99_ms']:.2f} ms")
+        if failed(run) > failed(old):
+            regressions.append(f"{run['users']} users: {failed(old)} -> {failed(run)} failed requests")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--keys-per-user", type=int, default=2)
+    parser.add_argument("--transactions-per-user", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--reservation-size", type=int, default=0,
+                        help="CREDIT_RESERVATION_SIZE for the gateway (0 charges escrow on every request)")
+    parser.add_argument("--output", help="write the results as JSON")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2)
+    args = parser.parse_args()
+
+    print(f"storage backend: {STORAGE_BACKEND}, reservation size: {args.reservation_size}")
+    results = []
+    with run_server(upstream) as upstream_url:
+        for users in args.users:
+            run = run_scale(users, args, upstream_url)
+            results.append(run)
+            print_summary(f"{users} users / {run['transactions']} tx", run)
+            growth = ", ".join(f"{name} +{size / 1024:.0f} KiB" for name, size in run["db_growth"].items())
+            statuses = ", ".join(f"{code}: {count}" for code, count in run["statuses"].items())
+            print(f"{'':<28} status {statuses}  db growth: {growth}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.max_regression)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
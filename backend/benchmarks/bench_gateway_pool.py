@@ -0,0 +1,85 @@
+"""
+Load test for the gateway's outbound HTTP client.
+
+Drives GET requests at a local stand-in for the auth service's /verify with
+a fixed concurrency, once opening a new httpx.AsyncClient per request (the
+gateway's previous behaviour) and once through the shared pooled client the
+gateway now creates in its lifespan, and reports p50/p99 for both.
+
+Usage:
+    python backend/benchmarks/bench_gateway_pool.py [--requests 2000] [--concurrency 50]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+import httpx
+from fastapi import FastAPI, Header
+
+from harness import print_summary, run_server, summarize
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app", "api"))
+
+upstream = FastAPI()
+
+
+@upstream.get("/verify")
+async def verify(x_api_key: str = Header(..., alias="X-API-Key")):
+    return {"name": "bench", "wallet_address": "bench_wallet", "uuid": "bench_wallet", "valid": True}
+
+
+async def drive(call, url: str, total: int, concurrency: int):
+    latencies = []
+    remaining = iter(range(total))
+
+    async def worker():
+        for _ in remaining:
+            start = time.perf_counter()
+            response = await call(url)
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, time.perf_counter() - start)
+
+
+async def main_async(args):
+    os.environ.setdefault("DATABASE_PATH", os.path.join(tempfile.mkdtemp(), "api_calls.json"))
+    from api_gateway import create_http_client
+
+    with run_server(upstream) as base_url:
+        url = f"{base_url}/verify"
+        headers = {"X-API-Key": "bench"}
+
+        async def per_request(url):
+            async with httpx.AsyncClient() as client:
+                return await client.get(url, headers=headers)
+
+        shared = create_http_client()
+
+        async def pooled(url):
+            return await shared.get(url, headers=headers)
+
+        # Warm up both paths
+        await drive(per_request, url, args.concurrency, args.concurrency)
+        await drive(pooled, url, args.concurrency, args.concurrency)
+
+        print_summary("client per request", await drive(per_request, url, args.requests, args.concurrency))
+        print_summary("shared pooled client", await drive(pooled, url, args.requests, args.concurrency))
+        await shared.aclose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+Latency the gateway adds when proxying to X-Target-URL.
+
+Starts the auth, escrow and gateway services (temporary databases) and a
+local dummy upstream, creates a funded user with an API key, then sends the
+same POST to the upstream directly and through /api/proxy and compares the
+percentiles. A final run streams a large body up and back through the
+gateway to check throughput without buffering. All servers share this
+process, so compare the two runs rather than reading absolute numbers.
+
+Usage:
+    python backend/benchmarks/bench_gateway_proxy.py [--requests 2000] [--concurrency 50] [--body-kb 1] [--stream-mb 50]
+"""
+import argparse
+import asyncio
+import importlib
+import os
+import sys
+import tempfile
+import time
+
+import httpx
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Route
+
+from harness import APP_DIR, print_summary, run_server, summarize
+
+
+async def echo(request: Request):
+    return Response(await request.body(), media_type="application/octet-stream")
+
+
+async def echo_stream(request: Request):
+    # Consumes the upload chunk by chunk, then streams the same number of bytes back
+    received = 0
+    async for chunk in request.stream():
+        received += len(chunk)
+
+    async def download():
+        remaining = received
+        while remaining > 0:
+            size = min(65536, remaining)
+            remaining -= size
+            yield b"x" * size
+
+    return StreamingResponse(download(), media_type="application/octet-stream")
+
+
+upstream = Starlette(routes=[Route("/echo", echo, methods=["POST"]),
+                             Route("/stream", echo_stream, methods=["POST"])])
+
+
+def load_service(module: str, service_dir: str, db_path: str):
+    """Import a service module with its own DATABASE_PATH"""
+    os.environ["DATABASE_PATH"] = db_path
+    sys.path.insert(0, os.path.join(APP_DIR, service_dir))
+    try:
+        return importlib.import_module(module)
+    finally:
+        sys.path.pop(0)
+
+
+async def drive(url: str, headers: dict, body: bytes, total: int, concurrency: int) -> dict:
+    latencies = []
+    remaining = iter(range(total))
+
+    async with httpx.AsyncClient(timeout=30, limits=httpx.Limits(max_connections=concurrency)) as client:
+        async def worker():
+            for _ in remaining:
+                start = time.perf_counter()
+                response = await client.post(url, headers=headers, content=body)
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, time.perf_counter() - start)
+
+
+async def stream_through(url: str, headers: dict, megabytes: int) -> float:
+    """Upload and download `megabytes` in 64 KiB chunks; returns MB/s"""
+    chunk = b"x" * 65536
+
+    async def upload():
+        for _ in range(megabytes * 16):
+            yield chunk
+
+    received = 0
+    start = time.perf_counter()
+    async with httpx.AsyncClient(timeout=60) as client:
+        async with client.stream("POST", url, headers=headers, content=upload()) as response:
+            response.raise_for_status()
+            async for data in response.aiter_raw():
+                received += len(data)
+    elapsed = time.perf_counter() - start
+    assert received == megabytes * 1024 * 1024, f"received {received} bytes"
+    return megabytes / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--body-kb", type=int, default=1)
+    parser.add_argument("--stream-mb", type=int, default=50)
+    args = parser.parse_args()
+
+    data_dir = tempfile.mkdtemp()
+    auth = load_service("auth", "auth", os.path.join(data_dir, "auth_db.json"))
+    escrow = load_service("escrow_api", "solana", os.path.join(data_dir, "escrow.json"))
+    body = os.urandom(args.body_kb * 1024)
+
+    with run_server(auth.app) as auth_url, run_server(escrow.app) as escrow_url, run_server(upstream) as upstream_url:
+        os.environ["AUTH_SERVICE_URL"] = f"{auth_url}/verify"
+        os.environ["ESCROW_SERVICE_URL"] = escrow_url
+        # One key drives all the load, so don't let the rate limiter cut it off
+        os.environ.setdefault("RATE_LIMIT_KEY_RATE", "0")
+        os.environ.setdefault("RATE_LIMIT_AGENT_RATE", "0")
+        os.environ.setdefault("RATE_LIMIT_IP_RATE", "0")
+        # The upstream runs on localhost
+        os.environ.setdefault("PROXY_ALLOW_PRIVATE_HOSTS", "true")
+        gateway = load_service("api_gateway", "api", os.path.join(data_dir, "api_calls.json"))
+
+        httpx.post(f"{auth_url}/auth", json={"wallet_address": "bench"}).raise_for_status()
+        key = httpx.post(f"{auth_url}/apikeys/add", json={"wallet_address": "bench", "name": "bench"}).json()["key"]
+        httpx.post(f"{escrow_url}/deposit", json={"amount": 1_000_000},
+                   headers={"X-User-ID": "bench"}).raise_for_status()
+
+        with run_server(gateway.app) as gateway_url:
+            proxy_url = f"{gateway_url}/api/proxy"
+            headers = {"X-API-Key": key, "X-Agent-ID": "bench-agent"}
+
+            # Warm up connection pools and caches on both paths
+            asyncio.run(drive(f"{upstream_url}/echo", {}, body, args.concurrency, args.concurrency))
+            asyncio.run(drive(proxy_url, {**headers, "X-Target-URL": f"{upstream_url}/echo"},
+                              body, args.concurrency, args.concurrency))
+
+            direct = asyncio.run(drive(f"{upstream_url}/echo", {}, body, args.requests, args.concurrency))
+            proxied = asyncio.run(drive(proxy_url, {**headers, "X-Target-URL": f"{upstream_url}/echo"},
+                                        body, args.requests, args.concurrency))
+            print_summary("direct", direct)
+            print_summary("via gateway", proxied)
+            print(f"{'added latency':<28} p50 {proxied['p50_ms'] - direct['p50_ms']:>7.2f} ms  "
+                  f"p99 {proxied['p99_ms'] - direct['p99_ms']:>7.2f} ms")
+            for stage, stats in httpx.get(f"{gateway_url}/stats").json()["proxy_stages"].items():
+                print(f"  stage {stage:<20} {stats['count']:>7}      mean {stats['mean_ms']:>7.2f} ms  "
+                      f"max {stats['max_ms']:>7.2f} ms")
+
+            rate = asyncio.run(stream_through(proxy_url, {**headers, "X-Target-URL": f"{upstream_url}/stream"},
+                                              args.stream_mb))
+            print(f"{'streamed ' + str(args.stream_mb) + ' MB each way':<28} {rate:>8.1f} MB/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Helpers shared by the benchmark scripts: running ASGI apps and services on
+localhost and summarising latencies.
+"""
+import contextlib
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from typing import List
+
+import httpx
+import uvicorn
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app")
+sys.path.append(APP_DIR)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@contextlib.contextmanager
+def run_server(app, port: int = 0):
+    """Serve an ASGI app on 127.0.0.1 in a background thread; yields its base URL"""
+    port = port or free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    try:
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        server.should_exit = True
+        thread.join()
+
+
+@contextlib.contextmanager
+def run_service(module: str, service_dir: str, env: dict, workers: int = 1):
+    """Run a service with uvicorn in its own process(es); yields its base URL"""
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", f"{module}:app", "--app-dir", os.path.join(APP_DIR, service_dir),
+         "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning", "--workers", str(workers)],
+        env={**os.environ, **env},
+    )
+    url = f"http://127.0.0.1:{port}"
+    try:
+        deadline = time.monotonic() + 60
+        while True:
+            if process.poll() is not None:
+                raise RuntimeError(f"{module} exited with code {process.returncode}")
+            try:
+                httpx.get(f"{url}/metrics", timeout=1)
+                break
+            except httpx.TransportError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"{module} did not start")
+                time.sleep(0.1)
+        yield url
+    finally:
+        # SIGTERM lets uvicorn run the lifespan shutdown, which flushes pending writes
+        process.terminate()
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(latencies: List[float], elapsed: float) -> dict:
+    """Throughput and latency percentiles (ms) for a run"""
+    return {
+        "requests": len(latencies),
+        "rps": len(latencies) / elapsed if elapsed else 0.0,
+        "mean_ms": statistics.mean(latencies) * 1000,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+def print_summary(label: str, summary: dict):
+    print(
+        f"{label:<28} {summary['requests']:>7} req  {summary['rps']:>8.0f} req/s  "
+        f"p50 {summary['p50_ms']:>7.2f} ms  p95 {summary['p95_ms']:>7.2f} ms  p99 {summary['p99_ms']:>7.2f} ms"
+    )
@@ -0,0 +1,184 @@
+"""
+Stress test of the auth and escrow services running with several uvicorn workers.
+
+Escrow: deposits a balance for one user, then hammers POST /spend for that
+user from many client processes at once, asking for more than the balance
+covers. The number of successful spends must be exactly what the balance
+allows, and the final balance, the wallet history and (after a restart with
+a single worker) the stored transactions must all agree with it.
+
+Auth: many client processes authenticate the same wallet and add API keys
+to it concurrently. Exactly one user must be created, every key must be
+listed and verify on every worker, and deleted keys must stop verifying.
+
+Runs once per storage backend and exits with status 1 on any mismatch.
+
+Usage:
+    python backend/benchmarks/stress_workers.py [--workers 4] [--processes 8] [--requests 250]
+        [--concurrency 16] [--keys 10] [--backends tinydb sqlite]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+from multiprocessing import Pool
+
+import httpx
+
+from harness import run_service
+
+USER = "stress_user"
+WALLET = "stress_wallet"
+# Binary fractions, so the expected balance is exact in floating point
+COST = 0.25
+
+
+def spend(url: str, requests: int, concurrency: int) -> Counter:
+    """One client process: `requests` spends over `concurrency` connections"""
+
+    async def run():
+        statuses = Counter()
+        remaining = iter(range(requests))
+        async with httpx.AsyncClient(timeout=60, limits=httpx.Limits(max_connections=concurrency)) as client:
+            async def worker():
+                for _ in remaining:
+                    response = await client.post(f"{url}/spend", json={"cost": COST},
+                                                 headers={"X-User-ID": USER, "X-Agent-ID": "stress-agent"})
+                    statuses[response.status_code] += 1
+
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return statuses
+
+    return asyncio.run(run())
+
+
+def add_keys(url: str, count: int, client_id: int) -> list:
+    """One client process: authenticate the shared wallet and add `count` keys"""
+    with httpx.Client(base_url=url, timeout=60) as client:
+        session = client.post("/auth", json={"wallet_address": WALLET}).json()["session_id"]
+        keys = []
+        for i in range(count):
+            response = client.post("/apikeys/add", json={"wallet_address": WALLET, "name": f"c{client_id}-{i}"})
+            response.raise_for_status()
+            keys.append(response.json()["key"])
+    return [session, keys]
+
+
+def wallet_spends(url: str) -> int:
+    """Spent transactions in the user's wallet history, across all pages"""
+    spent = 0
+    before = None
+    with httpx.Client(base_url=url, timeout=60) as client:
+        while True:
+            params = {"limit": 500, **({"before": before} if before else {})}
+            page = client.get(f"/wallet/{USER}", params=params).json()
+            spent += sum(1 for tx in page["transactions"] if tx["type"] == "spent")
+            before = page["next_before"]
+            if not before:
+                return spent
+
+
+def stress_escrow(args, data_dir: str, failures: list) -> dict:
+    env = {"DATABASE_PATH": os.path.join(data_dir, "escrow.json")}
+    total = args.processes * args.requests
+    # Enough for three quarters of the spends, so the balance runs out under load
+    balance = total * 3 // 4 * COST
+    expected_spends = total * 3 // 4
+
+    with run_service("escrow_api", "solana", env, workers=args.workers) as url:
+        httpx.post(f"{url}/deposit", json={"amount": balance}, headers={"X-User-ID": USER}, timeout=60)
+        start = time.perf_counter()
+        with Pool(args.processes) as pool:
+            results = pool.starmap(spend, [(url, args.requests, args.concurrency)] * args.processes)
+        elapsed = time.perf_counter() - start
+        statuses = sum(results, Counter())
+
+        final_balance = httpx.get(f"{url}/balance/{USER}", timeout=60).json()["balance"]
+        history = wallet_spends(url)
+
+    # Restart with one worker: the stored transactions must match too
+    with run_service("escrow_api", "solana", env) as url:
+        restarted_balance = httpx.get(f"{url}/balance/{USER}", timeout=60).json()["balance"]
+        stored = wallet_spends(url)
+
+    spends = statuses[200]
+    checks = {
+        "successful spends": (spends, expected_spends),
+        "refused spends": (statuses[400], total - expected_spends),
+        "final balance": (final_balance, balance - spends * COST),
+        "balance after restart": (restarted_balance, final_balance),
+        "spends in wallet history": (history, spends),
+        "spends stored": (stored, spends),
+    }
+    for name, (actual, expected) in checks.items():
+        if actual != expected:
+            failures.append(f"escrow: {name} is {actual}, expected {expected}")
+    return {"requests": total, "rps": total / elapsed, "statuses": dict(statuses), "final_balance": final_balance}
+
+
+def stress_auth(args, data_dir: str, failures: list) -> dict:
+    env = {"DATABASE_PATH": os.path.join(data_dir, "auth_db.json")}
+
+    with run_service("auth", "auth", env, workers=args.workers) as url:
+        with Pool(args.processes) as pool:
+            results = pool.starmap(add_keys, [(url, args.keys, i) for i in range(args.processes)])
+        sessions = {session for session, _ in results}
+        keys = [key for _, client_keys in results for key in client_keys]
+
+        with httpx.Client(base_url=url, timeout=60) as client:
+            listed = {key["key"] for key in client.get(f"/apikeys/{WALLET}").json()}
+            # Verify each key several times, so that every worker is likely asked
+            unverified = [key for key in keys for _ in range(args.workers)
+                          if client.get("/verify", headers={"X-API-Key": key}).status_code != 200]
+            deleted = keys[::2]
+            for key in deleted:
+                client.post("/apikeys/delete", json={"wallet_address": WALLET, "key": key}).raise_for_status()
+            still_valid = [key for key in deleted for _ in range(args.workers)
+                           if client.get("/verify", headers={"X-API-Key": key}).status_code != 401]
+
+    checks = {
+        "sessions for one wallet": (len(sessions), 1),
+        "keys listed": (len(listed & set(keys)), len(keys)),
+        "key verifications failed": (len(unverified), 0),
+        "deleted key verifications passed": (len(still_valid), 0),
+    }
+    for name, (actual, expected) in checks.items():
+        if actual != expected:
+            failures.append(f"auth: {name} is {actual}, expected {expected}")
+    return {"keys": len(keys), "deleted": len(deleted)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4, help="uvicorn workers per service")
+    parser.add_argument("--processes", type=int, default=8, help="client processes")
+    parser.add_argument("--requests", type=int, default=250, help="spends per client process")
+    parser.add_argument("--concurrency", type=int, default=16, help="connections per client process")
+    parser.add_argument("--keys", type=int, default=10, help="API keys added per client process")
+    parser.add_argument("--backends", nargs="+", default=["tinydb", "sqlite"])
+    args = parser.parse_args()
+
+    failures = []
+    for backend in args.backends:
+        # The services read STORAGE_BACKEND at import
+        os.environ["STORAGE_BACKEND"] = backend
+        escrow = stress_escrow(args, tempfile.mkdtemp(), failures)
+        print(f"{backend:<7} escrow: {escrow['requests']} spends from {args.processes} processes "
+              f"on {args.workers} workers, {escrow['rps']:.0f} req/s, statuses {escrow['statuses']}, "
+              f"final balance {escrow['final_balance']}")
+        auth = stress_auth(args, tempfile.mkdtemp(), failures)
+        print(f"{backend:<7} auth:   {auth['keys']} keys added from {args.processes} processes, "
+              f"{auth['deleted']} deleted")
+
+    for failure in failures:
+        print(f"FAIL {failure}")
+    if failures:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,17 @@
+"""
+The services import their siblings and `common` by plain module name, as
+they do when run from their own directory; tests get the same import path,
+plus the benchmarks' harness for running services in their own processes.
+"""
+import os
+import sys
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app")
+sys.path.insert(0, APP_DIR)
+sys.path.insert(0, os.path.join(APP_DIR, "solana"))
+sys.path.insert(0, os.path.join(APP_DIR, "auth"))
+sys.path.insert(0, os.path.join(APP_DIR, "..", "benchmarks"))
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "slow: starts services in their own processes (deselect with -m 'not slow')")
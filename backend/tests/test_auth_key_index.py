@@ -0,0 +1,65 @@
+"""Tests for the auth service's API key index when another worker changes keys"""
+import importlib
+import sys
+import threading
+import time
+
+import pytest
+from fastapi import BackgroundTasks
+
+from common.interprocess import ChangeMarker
+
+
+@pytest.fixture
+def auth(tmp_path, monkeypatch):
+    # The service opens DATABASE_PATH and builds its index at import
+    monkeypatch.setenv("DATABASE_PATH", str(tmp_path / "auth_db.json"))
+    sys.modules.pop("auth", None)
+    module = importlib.import_module("auth")
+    yield module
+    module.db.close()
+    sys.modules.pop("auth", None)
+
+
+def rebuild_during(auth, monkeypatch, change):
+    """Run `change` in this worker while a rebuild triggered by another worker reads the users table"""
+    reading, proceed = threading.Event(), threading.Event()
+    read_all = auth.users_table.all
+
+    def slow_all():
+        users = read_all()
+        reading.set()
+        proceed.wait(5)
+        return users
+
+    monkeypatch.setattr(auth.users_table, "all", slow_all)
+    ChangeMarker(auth.keys_changed.path).bump()
+    rebuild = threading.Thread(target=auth.find_api_key, args=("unknown",))
+    rebuild.start()
+    assert reading.wait(5)
+    monkeypatch.setattr(auth.users_table, "all", read_all)
+
+    result = []
+    local = threading.Thread(target=lambda: result.append(change()))
+    local.start()
+    # Give the change time to land while the rebuild is still reading
+    time.sleep(0.1)
+    proceed.set()
+    rebuild.join(5)
+    local.join(5)
+    return result[0]
+
+
+def test_key_added_during_rebuild_verifies(auth, monkeypatch):
+    auth.authenticate(auth.WalletRequest(wallet_address="wallet"))
+    added = rebuild_during(auth, monkeypatch, lambda: auth.add_api_key(
+        auth.APIKeyRequest(wallet_address="wallet", name="new")))
+    assert auth.find_api_key(added["key"]) is not None
+
+
+def test_key_deleted_during_rebuild_stops_verifying(auth, monkeypatch):
+    auth.authenticate(auth.WalletRequest(wallet_address="wallet"))
+    key = auth.add_api_key(auth.APIKeyRequest(wallet_address="wallet", name="old"))["key"]
+    rebuild_during(auth, monkeypatch, lambda: auth.delete_api_key(
+        auth.DeleteAPIKeyRequest(wallet_address="wallet", key=key), BackgroundTasks()))
+    assert auth.find_api_key(key) is None
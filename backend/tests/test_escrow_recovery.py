@@ -0,0 +1,60 @@
+"""Crash tests for the escrow service: balances, stored transactions and rollups must agree after a restart"""
+import json
+import os
+import subprocess
+import sys
+import textwrap
+
+import pytest
+
+SOLANA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app", "solana")
+
+# Runs in a fresh process, so a crash is a real os._exit with nothing shut down
+SCRIPT = textwrap.dedent("""
+    import json
+    import os
+    import sys
+
+    import escrow_api
+
+    deposits, crash = int(sys.argv[1]), sys.argv[2]
+    if deposits:
+        escrow_api.deposit_funds(escrow_api.DepositRequest(amount=1.0), user_id="alice")
+        escrow_api.project_ledger()
+        for _ in range(deposits - 1):
+            escrow_api.deposit_funds(escrow_api.DepositRequest(amount=1.0), user_id="alice")
+    if crash == "before_release":
+        escrow_api.ledger.release = lambda entries: os._exit(0)
+    if crash != "before_projection":
+        escrow_api.project_ledger()
+    if crash != "none":
+        os._exit(0)
+
+    print(json.dumps({
+        "balance": escrow_api.ledger.balance("alice"),
+        "stored": len(escrow_api.transactions_table.search(user_id="alice")),
+        "rollups": escrow_api.rollups.query("user", "alice", "day"),
+    }))
+""")
+
+
+def run(data_dir: str, backend: str, deposits: int = 0, crash: str = "none") -> dict:
+    env = {**os.environ, "DATABASE_PATH": os.path.join(data_dir, "escrow.json"), "STORAGE_BACKEND": backend,
+           "LEDGER_FSYNC": "false", "SPEND_BATCHING_ENABLED": "false"}
+    result = subprocess.run([sys.executable, "-c", SCRIPT, str(deposits), crash], cwd=SOLANA_DIR, env=env,
+                            capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    return json.loads(result.stdout.splitlines()[-1]) if crash == "none" else {}
+
+
+@pytest.mark.parametrize("backend", ["tinydb", "sqlite"])
+@pytest.mark.parametrize("crash", ["before_projection", "before_release", "after_release"])
+def test_rollups_survive_a_crash(tmp_path, backend, crash):
+    run(str(tmp_path), backend, deposits=6, crash=crash)
+
+    # Twice, so rollups written while recovering aren't counted again either
+    for _ in range(2):
+        state = run(str(tmp_path), backend)
+        assert state["balance"] == 6.0
+        assert state["stored"] == 6
+        assert [(row["type"], row["count"], row["total"]) for row in state["rollups"]] == [("deposit", 6, 6.0)]
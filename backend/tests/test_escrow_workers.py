@@ -0,0 +1,68 @@
+"""Concurrent /spend calls against escrow running with several uvicorn workers"""
+import asyncio
+from collections import Counter
+
+import httpx
+import pytest
+
+from harness import run_service
+
+USER = "workers_user"
+# A binary fraction, so the expected balance is exact in floating point
+COST = 0.25
+SPENDS = 400
+# Enough for three quarters of the spends, so the balance runs out under load
+AFFORDABLE = SPENDS * 3 // 4
+
+
+async def spend_concurrently(url: str, concurrency: int = 32) -> Counter:
+    statuses = Counter()
+    remaining = iter(range(SPENDS))
+    async with httpx.AsyncClient(timeout=60, limits=httpx.Limits(max_connections=concurrency)) as client:
+        async def worker():
+            for _ in remaining:
+                response = await client.post(f"{url}/spend", json={"cost": COST},
+                                             headers={"X-User-ID": USER, "X-Agent-ID": "workers-agent"})
+                statuses[response.status_code] += 1
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return statuses
+
+
+def wallet_spends(url: str) -> int:
+    """Spent transactions in the user's wallet history, across all pages"""
+    spent, before = 0, None
+    with httpx.Client(base_url=url, timeout=60) as client:
+        while True:
+            page = client.get(f"/wallet/{USER}", params={"limit": 500, **({"before": before} if before else {})}).json()
+            spent += sum(1 for tx in page["transactions"] if tx["type"] == "spent")
+            before = page["next_before"]
+            if not before:
+                return spent
+
+
+@pytest.mark.slow
+@pytest.mark.parametrize("backend", ["tinydb", "sqlite"])
+def test_concurrent_spends_on_several_workers(tmp_path, backend):
+    # LEDGER_FSYNC stays on: group commit across workers is part of what is tested
+    env = {"DATABASE_PATH": str(tmp_path / "escrow.json"), "STORAGE_BACKEND": backend}
+
+    with run_service("escrow_api", "solana", env, workers=3) as url:
+        httpx.post(f"{url}/deposit", json={"amount": AFFORDABLE * COST}, headers={"X-User-ID": USER},
+                   timeout=60).raise_for_status()
+        statuses = asyncio.run(spend_concurrently(url))
+        balance = httpx.get(f"{url}/balance/{USER}", timeout=60).json()["balance"]
+        history = wallet_spends(url)
+        usage = httpx.get(f"{url}/usage/workers-agent", timeout=60).json()["usage_count"]
+
+    assert statuses == {200: AFFORDABLE, 400: SPENDS - AFFORDABLE}
+    assert balance == 0
+    assert history == AFFORDABLE
+    assert usage == AFFORDABLE
+
+    # Restarted with one worker, storage must hold every spend exactly once
+    with run_service("escrow_api", "solana", env) as url:
+        assert httpx.get(f"{url}/balance/{USER}", timeout=60).json()["balance"] == 0
+        assert wallet_spends(url) == AFFORDABLE
+        rollups = httpx.get(f"{url}/rollups/user/{USER}", params={"type": "spent"}, timeout=60).json()["rollups"]
+        assert sum(row["count"] for row in rollups) == AFFORDABLE
@@ -0,0 +1,58 @@
+"""The gateway's key cache against a real auth service: usage counts and deleted keys"""
+import httpx
+import pytest
+
+from harness import run_service
+
+WALLET = "gateway_keys_wallet"
+
+
+def add_key(auth_url: str) -> str:
+    with httpx.Client(base_url=auth_url, timeout=60) as client:
+        client.post("/auth", json={"wallet_address": WALLET}).raise_for_status()
+        response = client.post("/apikeys/add", json={"wallet_address": WALLET, "name": "test"})
+        response.raise_for_status()
+        return response.json()["key"]
+
+
+def gateway_env(tmp_path, auth_url: str) -> dict:
+    return {"DATABASE_PATH": str(tmp_path / "api_calls.json"), "AUTH_SERVICE_URL": f"{auth_url}/verify",
+            "KEY_USAGE_FLUSH_INTERVAL": "0.2", "RATE_LIMIT_IP_RATE": "0"}
+
+
+@pytest.mark.slow
+def test_cached_verifications_count_as_key_usage(tmp_path):
+    with run_service("auth", "auth", {"DATABASE_PATH": str(tmp_path / "auth_db.json")}) as auth_url:
+        key = add_key(auth_url)
+        with run_service("api_gateway", "api", gateway_env(tmp_path, auth_url)) as gateway_url:
+            for _ in range(5):
+                response = httpx.post(f"{gateway_url}/api/test-with-auth", headers={"X-API-Key": key}, timeout=60)
+                assert response.status_code == 200
+            stats = httpx.get(f"{gateway_url}/stats", timeout=60).json()
+            # One /verify, then four uses served by the cache
+            assert stats["key_cache"]["hits"] == 4
+        # The gateway reports what is pending when it shuts down
+        keys = httpx.get(f"{auth_url}/apikeys/{WALLET}", timeout=60).json()
+        assert keys[0]["use_count"] == 5
+        assert keys[0]["last_used"]
+
+
+@pytest.mark.slow
+def test_deleted_key_is_dropped_by_every_gateway_worker(tmp_path):
+    workers = 3
+    with run_service("auth", "auth", {"DATABASE_PATH": str(tmp_path / "auth_db.json")}) as auth_url:
+        key = add_key(auth_url)
+        with run_service("api_gateway", "api", gateway_env(tmp_path, auth_url), workers=workers) as gateway_url:
+            # A new connection per request, so requests are spread over the workers
+            def verify() -> int:
+                return httpx.post(f"{gateway_url}/api/test-with-auth", headers={"X-API-Key": key},
+                                  timeout=60).status_code
+
+            # Enough requests that every worker has the key cached
+            assert {verify() for _ in range(workers * 10)} == {200}
+            httpx.post(f"{auth_url}/apikeys/delete", json={"wallet_address": WALLET, "key": key},
+                       timeout=60).raise_for_status()
+            # What auth does with KEY_INVALIDATION_URLS; it reaches one worker
+            httpx.post(f"{gateway_url}/internal/keys/invalidate", json={"key": key}, timeout=60).raise_for_status()
+            statuses = {verify() for _ in range(workers * 10)}
+    assert statuses == {401}
@@ -0,0 +1,23 @@
+"""Tests for ChangeMarker, with two markers on one path standing in for two processes"""
+from common.interprocess import ChangeMarker
+
+
+def test_bump_is_seen_by_others_only(tmp_path):
+    path = str(tmp_path / "marker")
+    mine, theirs = ChangeMarker(path), ChangeMarker(path)
+
+    mine.bump()
+    assert not mine.changed()
+    assert theirs.changed()
+    assert not theirs.changed()
+
+
+def test_bump_keeps_an_unseen_change_from_another_process(tmp_path):
+    path = str(tmp_path / "marker")
+    mine, theirs = ChangeMarker(path), ChangeMarker(path)
+
+    theirs.bump()
+    mine.bump()
+    assert mine.changed()
+    assert not mine.changed()
+    assert theirs.changed()
@@ -0,0 +1,230 @@
+"""Tests for the escrow ledger: replay, torn tails, snapshots and compaction, and several writers"""
+import json
+import os
+
+import pytest
+
+from ledger import InsufficientFunds, Ledger, LedgerCorrupted, SEGMENT_PREFIX
+
+
+def open_ledger(directory, **kwargs) -> Ledger:
+    ledger = Ledger(str(directory), fsync=False, **kwargs)
+    ledger.open()
+    return ledger
+
+
+def segments(directory) -> list:
+    return sorted(name for name in os.listdir(directory) if name.startswith(SEGMENT_PREFIX))
+
+
+def test_replay_after_reopen(tmp_path):
+    ledger = open_ledger(tmp_path)
+    ledger.append("alice", 10.0)
+    ledger.append("alice", -2.5, check_funds=True, tx={"id": "t1"})
+    ledger.append("bob", 4.0)
+    ledger.close()
+
+    reopened = Ledger(str(tmp_path), fsync=False)
+    entries = reopened.open()
+    assert [entry["seq"] for entry in entries] == [1, 2, 3]
+    assert entries[1]["tx"] == {"id": "t1"}
+    assert reopened.balance("alice") == 7.5
+    assert reopened.balance("bob") == 4.0
+    assert reopened.balance("carol") is None
+    # Nothing was released, so everything is still pending for the projection
+    assert [entry["seq"] for entry in reopened.pending()] == [1, 2, 3]
+    assert reopened.append("bob", 1.0)["seq"] == 4
+    reopened.close()
+
+
+def test_initial_balances_seed_only_a_new_ledger(tmp_path):
+    ledger = Ledger(str(tmp_path), fsync=False)
+    ledger.open({"alice": 5.0})
+    ledger.append("alice", 1.0)
+    ledger.close()
+
+    reopened = Ledger(str(tmp_path), fsync=False)
+    reopened.open({"alice": 100.0})
+    assert reopened.balance("alice") == 6.0
+    reopened.close()
+
+
+def test_insufficient_funds(tmp_path):
+    ledger = open_ledger(tmp_path)
+    ledger.append("alice", 1.0)
+    with pytest.raises(InsufficientFunds):
+        ledger.append("alice", -2.0, check_funds=True)
+    with pytest.raises(InsufficientFunds):
+        ledger.append("nobody", -1.0, check_funds=True)
+
+    # A refused change doesn't affect the ones after it
+    results = ledger.append_many([("alice", -5.0, True, {}), ("alice", -1.0, True, {})])
+    assert isinstance(results[0], InsufficientFunds)
+    assert results[1]["balance"] == 0.0
+    assert ledger.stats()["seq"] == 2
+    ledger.close()
+
+
+def test_torn_tail_is_truncated(tmp_path):
+    ledger = open_ledger(tmp_path)
+    ledger.append("alice", 10.0)
+    ledger.append("alice", -1.0)
+    ledger.close()
+
+    # A crash in the middle of the third append
+    path = os.path.join(tmp_path, segments(tmp_path)[-1])
+    size = os.path.getsize(path)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"seq": 3, "user_id": "alice", "del')
+
+    reopened = Ledger(str(tmp_path), fsync=False)
+    assert [entry["seq"] for entry in reopened.open()] == [1, 2]
+    assert os.path.getsize(path) == size
+    assert reopened.balance("alice") == 9.0
+    assert reopened.append("alice", 1.0)["seq"] == 3
+    reopened.close()
+
+    again = Ledger(str(tmp_path), fsync=False)
+    assert [entry["seq"] for entry in again.open()] == [1, 2, 3]
+    again.close()
+
+
+def test_corruption_before_the_tail_is_refused(tmp_path):
+    ledger = open_ledger(tmp_path)
+    ledger.append("alice", 10.0)
+    ledger.append("alice", -1.0)
+    ledger.close()
+
+    path = os.path.join(tmp_path, segments(tmp_path)[-1])
+    with open(path, "rb") as f:
+        lines = f.readlines()
+    with open(path, "wb") as f:
+        f.write(b"garbage\n" + lines[1])
+
+    with pytest.raises(LedgerCorrupted):
+        Ledger(str(tmp_path), fsync=False).open()
+
+
+def test_snapshot_and_compaction(tmp_path):
+    ledger = open_ledger(tmp_path, snapshot_every=3)
+    for _ in range(3):
+        ledger.append("alice", 1.0)
+    assert ledger.needs_snapshot()
+    ledger.snapshot()
+    ledger.append("alice", 1.0)
+    assert not ledger.needs_snapshot()
+
+    # The snapshotted segment stays until the projection releases its entries
+    assert len(segments(tmp_path)) == 2
+    pending = ledger.pending()
+    assert [entry["seq"] for entry in pending] == [1, 2, 3, 4]
+    ledger.release(pending[:2])
+    assert len(segments(tmp_path)) == 2
+    ledger.release(pending[2:3])
+    assert segments(tmp_path) == [f"{SEGMENT_PREFIX}{4:012d}.log"]
+    ledger.close()
+
+    # Startup loads the snapshot and replays only the remaining segment
+    reopened = Ledger(str(tmp_path), fsync=False)
+    entries = reopened.open()
+    assert [entry["seq"] for entry in entries] == [4]
+    assert reopened.balance("alice") == 4.0
+    assert reopened.released_seq == 3
+    assert [entry["seq"] for entry in reopened.pending()] == [4]
+    reopened.close()
+
+
+def test_released_entries_are_not_pending_after_reopen(tmp_path):
+    ledger = open_ledger(tmp_path)
+    for _ in range(3):
+        ledger.append("alice", 1.0)
+    ledger.release(ledger.pending()[:2])
+    ledger.close()
+
+    with open(os.path.join(tmp_path, "released.json"), encoding="utf-8") as f:
+        assert json.load(f) == {"seq": 2}
+    reopened = Ledger(str(tmp_path), fsync=False)
+    assert len(reopened.open()) == 3
+    assert [entry["seq"] for entry in reopened.pending()] == [3]
+    reopened.close()
+
+
+def test_writers_follow_each_other(tmp_path):
+    followed = []
+    first = open_ledger(tmp_path)
+    second = open_ledger(tmp_path, on_entry=followed.append)
+
+    first.append("alice", 10.0)
+    # The second writer catches up before checking funds
+    second.append("alice", -4.0, check_funds=True)
+    with pytest.raises(InsufficientFunds):
+        second.append("alice", -7.0, check_funds=True)
+    assert [entry["seq"] for entry in followed] == [1]
+    assert first.balance("alice") == 6.0
+    assert second.unreleased("alice")[-1]["balance"] == 6.0
+
+    first.close()
+    second.close()
+
+
+def test_projection_takeover(tmp_path):
+    projector = open_ledger(tmp_path, snapshot_every=2)
+    other = open_ledger(tmp_path, snapshot_every=2)
+
+    projector.append("alice", 1.0)
+    other.append("alice", 1.0)
+    projector.release(projector.pending())
+    projector.append("alice", 1.0)
+    # The projector stops; the other process takes over from released.json
+    projector.close()
+
+    other.forget_released()
+    assert other.released_seq == 2
+    pending = other.pending()
+    assert [entry["seq"] for entry in pending] == [3]
+    other.release(pending)
+    other.snapshot()
+    other.append("alice", 1.0)
+    assert len(segments(tmp_path)) == 1
+    other.close()
+
+    reopened = Ledger(str(tmp_path), fsync=False)
+    assert [entry["seq"] for entry in reopened.open()] == [4]
+    assert reopened.balance("alice") == 4.0
+    reopened.close()
+
+
+def test_follower_catches_up_across_compacted_segments(tmp_path):
+    lagging = open_ledger(tmp_path, snapshot_every=2)
+    writer = open_ledger(tmp_path, snapshot_every=2)
+
+    for _ in range(3):
+        writer.append("alice", 1.0)
+    writer.snapshot()
+    writer.release(writer.pending())
+    writer.append("alice", 1.0)
+    assert len(segments(tmp_path)) == 1
+
+    assert lagging.balance("alice") == 4.0
+    assert lagging.stats()["seq"] == 4
+    assert lagging.append("alice", 1.0)["seq"] == 5
+    assert writer.balance("alice") == 5.0
+    lagging.close()
+    writer.close()
+
+
+def test_follower_truncates_a_dead_writers_torn_tail(tmp_path):
+    survivor = open_ledger(tmp_path)
+    survivor.append("alice", 1.0)
+
+    # Another writer died mid-append, leaving a partial line
+    path = os.path.join(tmp_path, segments(tmp_path)[-1])
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"seq": 2, "user_id": "ali')
+
+    assert survivor.append("alice", 1.0)["seq"] == 2
+    survivor.close()
+    reopened = Ledger(str(tmp_path), fsync=False)
+    assert [entry["seq"] for entry in reopened.open()] == [1, 2]
+    assert reopened.balance("alice") == 2.0
+    reopened.close()
@@ -0,0 +1,49 @@
+"""Tests for the spend batcher: ordering, funds checks and per-request results"""
+import asyncio
+
+import pytest
+
+from ledger import InsufficientFunds, Ledger
+from spend_batcher import SpendBatcher
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    ledger = Ledger(str(tmp_path), fsync=False)
+    ledger.open({"alice": 3.0})
+    yield ledger
+    ledger.close()
+
+
+def test_spends_are_applied_in_arrival_order(ledger):
+    batcher = SpendBatcher(ledger, max_batch=4, max_wait=0.001)
+
+    async def spend_all():
+        return await asyncio.gather(*(batcher.append("alice", -1.0, check_funds=True, n=n) for n in range(10)),
+                                    return_exceptions=True)
+
+    results = asyncio.run(spend_all())
+    assert [result["n"] for result in results[:3]] == [0, 1, 2]
+    assert all(isinstance(result, InsufficientFunds) for result in results[3:])
+    assert [result["seq"] for result in results[:3]] == [1, 2, 3]
+    assert ledger.balance("alice") == 0.0
+    assert batcher.stats()["spends"] == 10
+    assert batcher.stats()["largest_batch"] == 4
+
+
+def test_staging_does_not_block_the_event_loop(ledger):
+    batcher = SpendBatcher(ledger, max_wait=0.001)
+
+    async def spend_while_locked():
+        # Another process holding the ledger lock, e.g. during a snapshot
+        ledger._lock.acquire()
+        spend = asyncio.ensure_future(batcher.append("alice", -1.0, check_funds=True))
+        ticks = 0
+        while ticks < 20:
+            await asyncio.sleep(0.001)
+            ticks += 1
+        assert not spend.done()
+        ledger._lock.release()
+        return await spend
+
+    assert asyncio.run(spend_while_locked())["balance"] == 2.0
@@ -7,11 +7,22 @@ import {
   authenticateWallet,
   getWalletDetails,
   depositFunds,
+  type Transaction,
   type WalletDetails as ApiWalletDetails
 } from '@/utils/api';
 import PageLayout from '@/components/PageLayout';
 import { LIVE_ESCROW_API_URL } from '@/utils/constants';
 
+const TRANSACTION_LABELS: Record<Transaction['type'], string> = {
+  deposit: 'Deposit',
+  spent: 'Spent',
+  reserved: 'Reserved',
+  refund: 'Refund',
+};
+
+// Deposits and refunds of unused reserved credit add to the balance
+const isCredit = (tx: Transaction) => tx.type === 'deposit' || tx.type === 'refund';
+
 export default function WalletPage() {
   const { publicKey, connected } = useWallet();
   const router = useRouter();
@@ -21,6 +32,7 @@ export default function WalletPage() {
   const [sessionId, setSessionId] = useState<string | null>(null);
   const [depositAmount, setDepositAmount] = useState<number>(1);
   const [isDepositing, setIsDepositing] = useState(false);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [useMockData, setUseMockData] = useState(false);
   const [apiStatus, setApiStatus] = useState<'unknown' | 'online' | 'offline'>('unknown');
 
@@ -113,6 +125,28 @@ export default function WalletPage() {
     }
   };
 
+  // Append the next (older) page of transactions
+  const handleLoadMore = async () => {
+    if (!sessionId || !walletData?.next_before) return;
+
+    try {
+      setLoadingMore(true);
+      setError(null);
+
+      const olderPage = await getWalletDetails(sessionId, useMockData, walletData.next_before);
+      setWalletData({
+        ...walletData,
+        transactions: [...walletData.transactions, ...olderPage.transactions],
+        next_before: olderPage.next_before
+      });
+    } catch (err) {
+      console.error('Failed to load more transactions:', err);
+      setError('Failed to load more transactions. Please try again later.');
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   // Toggle data source
   const toggleDataSource = () => {
     // Only inform user if live API is not available when trying to use it
@@ -238,22 +272,33 @@ export default function WalletPage() {
                         <td className="py-3 px-2 text-sm">{formatDate(tx.timestamp)}</td>
                         <td className="py-3 px-2">
                           <span className={`inline-block rounded-full px-2 py-1 text-xs font-medium ${
-                            tx.type === 'deposit' 
+                            isCredit(tx) 
                               ? 'bg-green/10 text-green' 
                               : 'bg-yellow/10 text-yellow'
                           }`}>
-                            {tx.type === 'deposit' ? 'Deposit' : 'Spent'}
+                            {TRANSACTION_LABELS[tx.type] ?? 'Spent'}
                           </span>
                         </td>
                         <td className="py-3 px-2 text-right font-medium">
-                          <span className={tx.type === 'deposit' ? 'text-green' : 'text-yellow'}>
-                            {tx.type === 'deposit' ? '+' : '-'}{tx.amount.toFixed(2)} SOL
+                          <span className={isCredit(tx) ? 'text-green' : 'text-yellow'}>
+                            {isCredit(tx) ? '+' : '-'}{tx.amount.toFixed(2)} SOL
                           </span>
                         </td>
                       </tr>
                     ))}
                   </tbody>
                 </table>
+                {walletData.next_before && (
+                  <div className="text-center mt-4">
+                    <button
+                      className="bg-gray/10 hover:bg-gray/20 text-lightGray font-medium py-2 px-4 rounded-md transition"
+                      onClick={handleLoadMore}
+                      disabled={loadingMore}
+                    >
+                      {loadingMore ? 'Loading...' : 'Load more'}
+                    </button>
+                  </div>
+                )}
               </div>
             ) : (
               <div className="text-center py-8 text-lightGray">
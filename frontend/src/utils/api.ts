@@ -19,7 +19,7 @@ export interface Transaction {
   id: string;
   user_id?: string;
   amount: number;
-  type: 'deposit' | 'spent';
+  type: 'deposit' | 'spent' | 'reserved' | 'refund';
   timestamp: string;
 }
 
@@ -27,6 +27,8 @@ export interface WalletDetails {
   user_id: string;
   balance: number;
   transactions: Transaction[];
+  // Pass as `before` to fetch the next (older) page; null on the last page
+  next_before?: string | null;
 }
 
 /**
@@ -98,13 +100,15 @@ export async function getWalletBalance(
 }
 
 /**
- * Get full wallet details including transaction history
+ * Get wallet details with one page of transaction history, newest first
  * @param sessionId The authenticated session ID
  * @param useMockData Whether to use mock data or live API
+ * @param before The previous page's `next_before`, to fetch older transactions
  */
 export async function getWalletDetails(
   sessionId: string,
-  useMockData: boolean = false
+  useMockData: boolean = false,
+  before?: string
 ): Promise<WalletDetails> {
   if (useMockData) {
     console.log(`Getting mock wallet details for session: ${sessionId}`);
@@ -145,14 +149,16 @@ export async function getWalletDetails(
     return {
       user_id: sessionId,
       balance: 25.75,
-      transactions
+      transactions: before ? [] : transactions,
+      next_before: null
     };
   } else {
     // Call live API
     console.log(`Getting live wallet details for wallet: ${sessionId}`);
     
     try {
-      const url = `${ESCROW_API_URL}/wallet/${sessionId}`;
+      const query = before ? `?before=${encodeURIComponent(before)}` : '';
+      const url = `${ESCROW_API_URL}/wallet/${sessionId}${query}`;
       console.log('Fetching from URL:', url);
       
       const response = await fetch(url, {
@@ -177,7 +183,7 @@ export async function getWalletDetails(
       // Fall back to mock data on error if needed
       if (!useMockData) {
         console.log('Falling back to mock data due to API error');
-        return getWalletDetails(sessionId, true);
+        return getWalletDetails(sessionId, true, before);
       }
       throw error;
     }